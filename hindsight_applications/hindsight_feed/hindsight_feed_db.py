@@ -1,7 +1,7 @@
 import os
 import portalocker
 from contextlib import contextmanager
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, FLOAT, DateTime, JSON
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, FLOAT, DateTime, JSON, text, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 
@@ -9,6 +9,7 @@ import time
 from datetime import datetime, timezone
 
 import hindsight_applications.hindsight_feed.feed_utils as feed_utils
+import hindsight_server.metrics as metrics
 
 from hindsight_applications.hindsight_feed.feed_config import DATA_DIR
 
@@ -17,6 +18,8 @@ Base = declarative_base()
 db_path = os.path.join(DATA_DIR, 'hindsight_feed.db')
 lock_path = db_path + ".lock"
 
+LOCK_WAIT_SECONDS = metrics.histogram("hindsight_feed_lock_wait_seconds", "Time waiting for the feed database file lock")
+
 class Content(Base):
     __tablename__ = 'content'
     id = Column(Integer, primary_key=True)
@@ -35,6 +38,7 @@ class Content(Base):
     timestamp = Column(Integer, default=lambda: int(time.time() * 1000))  
     last_modified_timestamp = Column(Integer, default=lambda: int(time.time() * 1000))
     content_generator_specific_data = Column(JSON, nullable=True)
+    change_seq = Column(Integer, nullable=True, index=True) # Increases on every change, see bump_change_seq
 
     def __repr__(self):
         return f"<Content(title={self.title}, url={self.url}, published_date={self.published_date}, score={self.score}, clicked={self.clicked})>"
@@ -52,7 +56,12 @@ engine = create_engine(f'sqlite:///{db_path}', connect_args={'timeout': 30},
                        pool_size=10, max_overflow=20,
                        pool_timeout=30,
                        pool_recycle=1800)
-Base.metadata.create_all(engine)
+
+"""Fields of content sent to the app by /get_new_content, leaving out the large
+content_generator_specific_data."""
+CONTENT_SYNC_FIELDS = ("id", "content_generator_id", "title", "summary", "url", "thumbnail_url", "published_date",
+                       "ranking_score", "score", "clicked", "viewed", "topic_label", "url_is_local", "timestamp",
+                       "last_modified_timestamp", "change_seq")
 
 def get_session():
     Session = scoped_session(sessionmaker(bind=engine))
@@ -71,11 +80,19 @@ def session_scope():
     finally:
         session.close()
 
+def bump_change_seq(session, contents):
+    """Gives each of contents the next change sequence numbers. Must be called under with_lock so
+    sequence numbers are never reused."""
+    max_change_seq = session.query(func.max(Content.change_seq)).scalar() or 0
+    for i, content in enumerate(contents):
+        content.change_seq = max_change_seq + i + 1
+
 def with_lock(func):
     """Decorator to handle database locking."""
     def wrapper(*args, **kwargs):
         with open(lock_path, 'a') as lock_file:
-            portalocker.lock(lock_file, portalocker.LOCK_EX)
+            with LOCK_WAIT_SECONDS.time():
+                portalocker.lock(lock_file, portalocker.LOCK_EX)
             try:
                 result = func(*args, **kwargs)
             finally:
@@ -83,6 +100,27 @@ def with_lock(func):
             return result
     return wrapper
 
+@with_lock
+def migrate_feed_db():
+    """Creates missing tables and adds content.change_seq to databases created before it existed,
+    numbering existing content by last modification. Runs under the file lock since the server
+    and the backend both import this module at startup, and the column check and ALTER TABLE are
+    not atomic on their own."""
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        columns = [row[1] for row in conn.execute(text("PRAGMA table_info(content)"))]
+        if 'change_seq' not in columns:
+            conn.execute(text("ALTER TABLE content ADD COLUMN change_seq INTEGER"))
+            conn.execute(text('''
+                UPDATE content SET change_seq = ordered.seq
+                FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY last_modified_timestamp, id) AS seq FROM content) AS ordered
+                WHERE content.id = ordered.id
+            '''))
+            print("Added change_seq column to content")
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_content_change_seq ON content (change_seq)"))
+
+migrate_feed_db()
+
 @with_lock
 def add_content(title, url, published_date, content_generator_id, ranking_score=-1,thumbnail_url=None, 
                 content_generator_specific_data=None, summary=None):
@@ -96,6 +134,7 @@ def add_content(title, url, published_date, content_generator_id, ranking_score=
                                 content_generator_id=content_generator_id, thumbnail_url=thumbnail_url,
                                 url_is_local=feed_utils.is_local_url(url), content_generator_specific_data=content_generator_specific_data,
                                 summary=summary)
+            bump_change_seq(session, [new_content])
             session.add(new_content)
         else:
             print(f"Content with URL '{url}' already exists in the database.")
@@ -129,6 +168,7 @@ def df_add_contents(df):
                 print(f"Content with URL '{row['url']}' already exists in the database and will not be added.")
         try:
             if contents:
+                bump_change_seq(session, contents)
                 session.bulk_save_objects(contents)
             else:
                 print("No new contents to add.")
@@ -143,6 +183,7 @@ def content_clicked(id):
             content.clicked = True
             content.viewed = True
             content.last_modified_timestamp = int(time.time() * 1000)
+            bump_change_seq(session, [content])
 
 @with_lock
 def update_content_score(id, score):
@@ -151,20 +192,23 @@ def update_content_score(id, score):
         if content:
             content.score = score
             content.last_modified_timestamp = int(time.time() * 1000)
+            bump_change_seq(session, [content])
 
 @with_lock
 def update_content_ranked_score(id, ranking_score):
     with session_scope() as session:
         content = session.query(Content).get(id)
-        if content:
+        if content and content.ranking_score != ranking_score:
             content.ranking_score = ranking_score
+            bump_change_seq(session, [content])
 
 @with_lock
 def update_content_topic_label(id, topic_label):
     with session_scope() as session:
         content = session.query(Content).get(id)
-        if content:
+        if content and content.topic_label != topic_label:
             content.topic_label = topic_label
+            bump_change_seq(session, [content])
 
 @with_lock
 def content_viewed(id):
@@ -173,6 +217,7 @@ def content_viewed(id):
         if content:
             content.viewed = True
             content.last_modified_timestamp = int(time.time() * 1000)
+            bump_change_seq(session, [content])
 
 @with_lock
 def fetch_contents(non_viewed=False, content_generator_id=None, last_content_id=None):
@@ -212,6 +257,7 @@ def fetch_content_generators():
 def from_app_update_content(content_sync_list):
     with session_scope() as session:
         try:
+            changed_contents = list()
             for content_sync in content_sync_list:
                 # Get the content record by its ID
                 content = session.query(Content).get(content_sync['id'])
@@ -234,9 +280,12 @@ def from_app_update_content(content_sync_list):
                     # Handle viewed: same logic as clicked, keep true if it was already true or the incoming update sets it to true
                     if 'viewed' in content_sync:
                         content.viewed = content.viewed or content_sync['viewed']
-            
+
+                    if session.is_modified(content):
+                        changed_contents.append(content)
                 else:
                     print(f"Content with ID {content_sync['id']} not found in the database.")
+            bump_change_seq(session, changed_contents)
 
         except Exception as e:
             print(f"Failed to update content from app: {e}")
@@ -251,4 +300,20 @@ def fetch_newly_viewed_content(since_timestamp):
         contents =  query.all()
         session.expunge_all()
         return contents
-    
+
+@with_lock
+def get_max_change_seq():
+    """Returns the change sequence number of the most recent content change (0 if none)."""
+    with session_scope() as session:
+        return session.query(func.max(Content.change_seq)).scalar() or 0
+
+@with_lock
+def fetch_content_changes(since_change_seq, limit=None):
+    """Returns the CONTENT_SYNC_FIELDS of content changed after since_change_seq as dicts,
+    in change order."""
+    with session_scope() as session:
+        query = session.query(*[getattr(Content, f) for f in CONTENT_SYNC_FIELDS])
+        query = query.filter(Content.title != "", Content.change_seq > since_change_seq).order_by(Content.change_seq)
+        if limit is not None:
+            query = query.limit(limit)
+        return [dict(zip(CONTENT_SYNC_FIELDS, row)) for row in query.all()]
@@ -0,0 +1,115 @@
+"""Admission control for uploads. Uploads are refused with 429 and a Retry-After while the backend
+is too far behind (uploaded frames awaiting OCR or frames awaiting embedding) or the data directory
+is low on disk space, so devices pace themselves instead of growing the backlog without limit.
+"""
+import os
+import time
+import shutil
+import threading
+
+import hindsight_server.metrics as metrics
+from hindsight_server.config import DATA_DIR, SCREENSHOTS_TMP_DIR, MAX_OCR_BACKLOG, MAX_EMBEDDING_BACKLOG, MIN_FREE_DISK_MB
+
+UPLOADS_REJECTED = metrics.counter("hindsight_uploads_rejected_total", "Uploads refused by admission control", ["kind", "reason"])
+
+"""Which limits apply to each kind of upload. Synced frames arrive with OCR results and videos
+only add disk usage."""
+UPLOAD_LIMITS = {
+    "images": ("ocr", "embedding", "disk"),
+    "sync": ("embedding", "disk"),
+    "video": ("disk",),
+}
+
+class AdmissionController:
+    """Samples the backlog and free disk space at most every check_interval seconds. A limit that
+    was exceeded keeps refusing uploads until its backlog drops below resume_fraction of the limit,
+    so devices are not let back in the moment the backlog dips under it.
+    """
+    def __init__(self, db, max_ocr_backlog=MAX_OCR_BACKLOG, max_embedding_backlog=MAX_EMBEDDING_BACKLOG,
+                 min_free_disk_mb=MIN_FREE_DISK_MB, check_interval=5, resume_fraction=0.8, max_retry_after=300,
+                 max_suggested_interval=60):
+        self.db = db
+        self.max_backlog = {"ocr": max_ocr_backlog, "embedding": max_embedding_backlog}
+        self.min_free_disk_mb = min_free_disk_mb
+        self.check_interval = check_interval
+        self.resume_fraction = resume_fraction
+        self.max_retry_after = max_retry_after
+        self.max_suggested_interval = max_suggested_interval
+        self.backlog = {"ocr": 0, "embedding": 0}
+        self.drain_rate = {"ocr": 0.0, "embedding": 0.0} # Frames per second, smoothed
+        self.free_disk_mb = None
+        self.exceeded = set()
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    def _sample(self):
+        counts = self.db.get_backlog_counts()
+        tmp_images = len(os.listdir(SCREENSHOTS_TMP_DIR)) if os.path.exists(SCREENSHOTS_TMP_DIR) else 0
+        backlog = {"ocr": counts["frames_awaiting_ocr"] + tmp_images, "embedding": counts["frames_awaiting_embedding"]}
+        now = time.time()
+        if self._last_check is not None:
+            elapsed = max(now - self._last_check, 1e-3)
+            for name, count in backlog.items():
+                rate = max(self.backlog[name] - count, 0) / elapsed
+                self.drain_rate[name] = 0.7 * self.drain_rate[name] + 0.3 * rate
+        self.backlog = backlog
+        self.free_disk_mb = shutil.disk_usage(DATA_DIR).free / 1e6
+
+        for name, limit in self.max_backlog.items():
+            if backlog[name] >= limit:
+                self.exceeded.add(name)
+            elif backlog[name] < limit * self.resume_fraction:
+                self.exceeded.discard(name)
+        if self.free_disk_mb < self.min_free_disk_mb:
+            self.exceeded.add("disk")
+        else:
+            self.exceeded.discard("disk")
+        self._last_check = now
+
+    def refresh(self):
+        """Resamples if the last sample is older than check_interval. Never blocks a request on
+        another request's sample: while one is running the previous sample is used."""
+        if self._last_check is not None and time.time() - self._last_check < self.check_interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._sample()
+        except Exception as e:
+            print(f"Failed to sample upload backlog: {e}")
+        finally:
+            self._lock.release()
+
+    def retry_after(self, reasons):
+        """Seconds until the backlogs behind reasons are expected to drain to their resume level."""
+        seconds = 0
+        for name in reasons:
+            if name == "disk":
+                seconds = max(seconds, self.max_retry_after)
+                continue
+            excess = self.backlog[name] - self.max_backlog[name] * self.resume_fraction
+            rate = self.drain_rate[name]
+            seconds = max(seconds, excess / rate if rate > 0 else self.max_retry_after)
+        return int(min(max(seconds, self.check_interval), self.max_retry_after))
+
+    def check(self, kind):
+        """Returns None if an upload of kind (see UPLOAD_LIMITS) is accepted, otherwise
+        (message, retry_after seconds)."""
+        self.refresh()
+        reasons = [name for name in UPLOAD_LIMITS[kind] if name in self.exceeded]
+        if not reasons:
+            return None
+        for reason in reasons:
+            UPLOADS_REJECTED.inc(kind=kind, reason=reason)
+        return f"Server is busy ({', '.join(reasons)}), retry later", self.retry_after(reasons)
+
+    def suggested_upload_interval(self):
+        """Seconds devices should wait between uploads: 0 while backlogs are under half their
+        limits, growing to max_suggested_interval as they reach them."""
+        self.refresh()
+        if self.exceeded:
+            return self.retry_after(self.exceeded)
+        load = max(self.backlog[name] / limit for name, limit in self.max_backlog.items())
+        if load < 0.5:
+            return 0
+        return int(self.max_suggested_interval * (load - 0.5) / 0.5)
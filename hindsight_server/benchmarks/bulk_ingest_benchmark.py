@@ -0,0 +1,62 @@
+"""Benchmark of frame + OCR ingest throughput: one insert_frame / insert_ocr_results call per
+frame (the old sync_db path) against a single insert_frames_with_ocr_bulk call.
+
+Run from the hindsight_server directory: python benchmarks/bulk_ingest_benchmark.py
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import contextlib
+
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+from hindsight_server.db import HindsightDB
+
+def make_records(num_frames, ocr_per_frame, source, start_timestamp):
+    return [{"timestamp": start_timestamp + i * 2000, "path": "None", "application": "bench", "source": source,
+             "source_id": i, "ocr_results": [(10.0 * j, 20.0, 30.0, 8.0, f"word{j}", 0.9, 0, -1) for j in range(ocr_per_frame)]}
+            for i in range(num_frames)]
+
+def ingest_per_frame(db, records):
+    for r in records:
+        frame_id = db.insert_frame(timestamp=r['timestamp'], path=r['path'], application=r['application'],
+                                   source=r['source'], source_id=r['source_id'])
+        db.insert_ocr_results(frame_id=frame_id, ocr_results=r['ocr_results'])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=10000, help="Number of frames to ingest")
+    parser.add_argument("--ocr_per_frame", type=int, default=40, help="OCR results per frame")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = HindsightDB(db_file=os.path.join(tmp_dir, "bench.db"))
+        results = dict()
+        modes = [("per frame", ingest_per_frame), ("bulk", db.insert_frames_with_ocr_bulk)]
+        for mode_num, (mode, ingest) in enumerate(modes):
+            # Frames are unique on (timestamp, path) so give each mode its own time range
+            records = make_records(args.frames, args.ocr_per_frame, source=mode,
+                                   start_timestamp=1_700_000_000_000 + mode_num * args.frames * 2000)
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                if mode == "bulk":
+                    ingest(records)
+                else:
+                    ingest(db, records)
+                results[mode] = args.frames / (time.perf_counter() - start)
+
+            # Re-sending the same records must be idempotent
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                db.insert_frames_with_ocr_bulk(records)
+        num_frames = db.get_connection().execute("SELECT COUNT(*) FROM frames").fetchone()[0]
+        db.close()
+
+    for mode, frames_per_s in results.items():
+        print(f"{mode:>10}: {frames_per_s:>10.0f} frames/s")
+    print(f"Frames in database after re-sending every record: {num_frames} (expected {2 * args.frames})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Microbenchmark comparing per-call latency of HindsightDB hot paths with a new connection
+per call (the old behaviour) against the pooled, long-lived connections.
+
+Run from the hindsight_server directory: python benchmarks/db_connection_benchmark.py
+"""
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import argparse
+
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+from hindsight_server.db import HindsightDB
+
+class UnpooledHindsightDB(HindsightDB):
+    """Opens a new connection and re-runs the pragmas on every call."""
+    def get_connection(self):
+        connection = sqlite3.connect(self.db_file, timeout=50)
+        connection.execute('PRAGMA journal_mode=WAL;')
+        connection.execute('PRAGMA busy_timeout = 10000;')
+        return connection
+
+def time_calls(func, n):
+    """Returns the mean latency of func in microseconds."""
+    start = time.perf_counter()
+    for i in range(n):
+        func(i)
+    return (time.perf_counter() - start) / n * 1e6
+
+def run_benchmark(db_class, db_file, n):
+    db = db_class(db_file=db_file)
+    ocr_results = [(10.0, 20.0, 30.0, 8.0, f"word{i}", 0.9, 0, 0) for i in range(50)]
+    frame_ids = list()
+
+    def insert_frame(i):
+        frame_ids.append(db.insert_frame(timestamp=1_700_000_000_000 + i, path=f"/tmp/frame_{i}.jpg", application="bench"))
+
+    results = {
+        "insert_frame": time_calls(insert_frame, n),
+        "insert_ocr_results": time_calls(lambda i: db.insert_ocr_results(frame_ids[i], ocr_results), n),
+        "get_last_id": time_calls(lambda i: db.get_last_id(source=None), n),
+    }
+    db.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=2000, help="Number of calls per method")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        unpooled = run_benchmark(UnpooledHindsightDB, os.path.join(tmp_dir, "unpooled.db"), args.n)
+        pooled = run_benchmark(HindsightDB, os.path.join(tmp_dir, "pooled.db"), args.n)
+
+    print(f"{'method':<22}{'unpooled (us)':>16}{'pooled (us)':>16}{'speedup':>10}")
+    for method in unpooled:
+        print(f"{method:<22}{unpooled[method]:>16.1f}{pooled[method]:>16.1f}{unpooled[method] / pooled[method]:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Contention benchmark with N concurrent writers. Compares the old global portalocker file
+lock (new connection and commit per write) against HindsightDB's single writer thread, which
+batches queued writes into BEGIN IMMEDIATE transactions.
+
+Run from the hindsight_server directory: python benchmarks/db_write_contention_benchmark.py
+"""
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import argparse
+import threading
+import numpy as np
+
+import portalocker
+
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+from hindsight_server.db import HindsightDB
+
+def locked_insert_frame(db_file, timestamp, path, application):
+    """The pre writer-queue insert path: file lock, fresh connection and a commit per write."""
+    with open(db_file + '.lock', 'a') as lock_file:
+        portalocker.lock(lock_file, portalocker.LOCK_EX)
+        try:
+            with sqlite3.connect(db_file, timeout=50) as conn:
+                conn.execute('PRAGMA journal_mode=WAL;')
+                conn.execute('PRAGMA busy_timeout = 10000;')
+                cursor = conn.execute('''
+                    INSERT INTO frames (timestamp, path, application)
+                    VALUES (?, ?, ?)
+                ''', (timestamp, path, application))
+                conn.commit()
+                return cursor.lastrowid
+        finally:
+            portalocker.unlock(lock_file)
+
+def run_writers(insert_frame, num_writers, writes_per_writer):
+    """Runs num_writers threads that each insert writes_per_writer frames. Returns the
+    total throughput and the per-write latencies in milliseconds."""
+    latencies = list()
+    latencies_lock = threading.Lock()
+
+    def run_writer(writer_num):
+        writer_latencies = list()
+        for i in range(writes_per_writer):
+            start = time.perf_counter()
+            insert_frame(writer_num * writes_per_writer + i, f"/tmp/{writer_num}_{i}.jpg", "bench")
+            writer_latencies.append((time.perf_counter() - start) * 1000)
+        with latencies_lock:
+            latencies.extend(writer_latencies)
+
+    threads = [threading.Thread(target=run_writer, args=(n,)) for n in range(num_writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return num_writers * writes_per_writer / elapsed, np.array(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 4, 16, 32], help="Numbers of concurrent writers to test")
+    parser.add_argument("--writes", type=int, default=250, help="Writes per writer")
+    args = parser.parse_args()
+
+    # Silence the per-frame prints of insert_frame
+    stdout = sys.stdout
+    print(f"{'writers':>8}{'mode':>14}{'writes/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_writers in args.writers:
+            locked_db_file = os.path.join(tmp_dir, f"locked_{num_writers}.db")
+            HindsightDB(db_file=locked_db_file).close() # Create tables
+            queued_db = HindsightDB(db_file=os.path.join(tmp_dir, f"queued_{num_writers}.db"))
+
+            modes = {"file lock": lambda t, p, a: locked_insert_frame(locked_db_file, t, p, a),
+                     "writer queue": queued_db.insert_frame}
+            for mode, insert_frame in modes.items():
+                sys.stdout = open(os.devnull, 'w')
+                try:
+                    throughput, latencies = run_writers(insert_frame, num_writers, args.writes)
+                finally:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                print(f"{num_writers:>8}{mode:>14}{throughput:>12.0f}{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 99):>10.2f}")
+            queued_db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compares the two OCR storage modes: one ocr_results row per box ("rows") against one compact
+ocr_boxes blob per frame ("blob"). Reports OCR storage size, database file size, ingest throughput and the latency of
+reading the OCR results of batches of frames with get_frames_with_ocr.
+
+Run from the hindsight_server directory: python benchmarks/ocr_storage_benchmark.py
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+import contextlib
+import numpy as np
+
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+from hindsight_server.db import HindsightDB
+
+def make_records(num_frames, ocr_per_frame):
+    words = ["the", "hindsight", "screenshot", "message", "search", "settings", "notification", "12:45"]
+    return [{"timestamp": 1_700_000_000_000 + i * 2000, "path": f"/tmp/frame_{i}.jpg", "application": "bench",
+             "ocr_results": [(random.uniform(0, 1000), random.uniform(0, 2000), random.uniform(10, 300), 14.0,
+                              random.choice(words), random.random(), j // 10, j % 10) for j in range(ocr_per_frame)]}
+            for i in range(num_frames)]
+
+def ocr_storage_mb(conn):
+    """Size of the OCR tables and their indexes, excluding the shared full-text search index."""
+    size = conn.execute('''
+        SELECT SUM(pgsize) FROM dbstat
+        WHERE name IN ('ocr_results', 'idx_ocr_results_frame_id', 'ocr_boxes')
+    ''').fetchone()[0]
+    return size / 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=5000, help="Number of frames to ingest")
+    parser.add_argument("--ocr_per_frame", type=int, default=60, help="OCR results per frame")
+    parser.add_argument("--read_batch", type=int, default=500, help="Frames per get_frames_with_ocr call")
+    parser.add_argument("--reads", type=int, default=20, help="Number of get_frames_with_ocr calls")
+    args = parser.parse_args()
+
+    records = make_records(args.frames, args.ocr_per_frame)
+    print(f"{'mode':>6}{'OCR MB':>10}{'file MB':>10}{'frames/s':>12}{'read p50 ms':>14}{'read p99 ms':>14}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in ["rows", "blob"]:
+            db_file = os.path.join(tmp_dir, f"{mode}.db")
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                db = HindsightDB(db_file=db_file, ocr_storage=mode)
+                start = time.perf_counter()
+                db.insert_frames_with_ocr_bulk(records)
+                frames_per_s = args.frames / (time.perf_counter() - start)
+            conn = db.get_connection()
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("VACUUM")
+
+            frame_ids = np.arange(1, args.frames + 1)
+            latencies = list()
+            for _ in range(args.reads):
+                batch = np.random.choice(frame_ids, size=min(args.read_batch, args.frames), replace=False).tolist()
+                start = time.perf_counter()
+                df = db.get_frames_with_ocr(frame_ids=batch)
+                latencies.append((time.perf_counter() - start) * 1000)
+                assert len(df) == len(batch) * args.ocr_per_frame
+            print(f"{mode:>6}{ocr_storage_mb(conn):>10.1f}{os.path.getsize(db_file) / 1e6:>10.1f}{frames_per_s:>12.0f}{np.percentile(latencies, 50):>14.1f}{np.percentile(latencies, 99):>14.1f}")
+            db.close()
+
+if __name__ == "__main__":
+    main()
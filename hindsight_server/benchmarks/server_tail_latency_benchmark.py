@@ -0,0 +1,94 @@
+"""Tail latency of a fast endpoint (/ping) while other clients hit a slow database endpoint on the
+same gevent server, with the database call made inline on the gevent hub against offloaded to the
+blocking pool (blocking.py). Each mode runs in its own process since monkey patching is global.
+
+Run from the hindsight_server directory: python benchmarks/server_tail_latency_benchmark.py
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+def run_mode(args):
+    from gevent import monkey
+    monkey.patch_all(thread=False, queue=False)
+    import gevent
+    import numpy as np
+    import urllib.request
+    from flask import Flask, jsonify
+    from gevent.pywsgi import WSGIServer
+
+    from hindsight_server.db import HindsightDB
+    from hindsight_server.blocking import run_blocking
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            db = HindsightDB(db_file=os.path.join(tmp_dir, "bench.db"))
+            db.insert_frames_with_ocr_bulk([{"timestamp": 1_700_000_000_000 + i * 2000, "path": f"/tmp/{i}.jpg",
+                                             "application": f"app{i % 20}"} for i in range(args.frames)])
+
+        app = Flask(__name__)
+
+        @app.route("/ping")
+        def ping():
+            return jsonify({"status": "success"})
+
+        @app.route("/frames")
+        def frames():
+            if args.mode == "offloaded":
+                df = run_blocking(db.get_frames, application_alias=False)
+            else:
+                df = db.get_frames(application_alias=False)
+            return jsonify({"num_frames": len(df)})
+
+        server = WSGIServer(("127.0.0.1", 0), app, log=None)
+        server.start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+        deadline = time.time() + args.seconds
+        ping_latencies = list()
+        num_slow = [0]
+
+        def slow_client():
+            while time.time() < deadline:
+                urllib.request.urlopen(f"{base_url}/frames").read()
+                num_slow[0] += 1
+
+        def ping_client():
+            while time.time() < deadline:
+                start = time.perf_counter()
+                urllib.request.urlopen(f"{base_url}/ping").read()
+                ping_latencies.append((time.perf_counter() - start) * 1000)
+                gevent.sleep(0.02)
+
+        gevent.joinall([gevent.spawn(slow_client) for _ in range(args.slow_clients)] +
+                       [gevent.spawn(ping_client) for _ in range(args.ping_clients)])
+        server.stop()
+        db.close()
+
+    print(f"{args.mode:>10}{len(ping_latencies):>8}{np.percentile(ping_latencies, 50):>10.1f}"
+          f"{np.percentile(ping_latencies, 99):>10.1f}{max(ping_latencies):>10.1f}{num_slow[0] / args.seconds:>12.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=100000, help="Frames read by each slow request")
+    parser.add_argument("--slow_clients", type=int, default=4, help="Clients looping on the slow endpoint")
+    parser.add_argument("--ping_clients", type=int, default=8, help="Clients pinging every 20ms")
+    parser.add_argument("--seconds", type=float, default=10, help="Duration of each mode")
+    parser.add_argument("--mode", choices=["inline", "offloaded"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run_mode(args)
+        return
+    print(f"{'mode':>10}{'pings':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'slow req/s':>12}")
+    for mode in ["inline", "offloaded"]:
+        subprocess.run([sys.executable, __file__, "--mode", mode] + sys.argv[1:], check=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Compares /sync_db payload encodings: JSON (optionally gzipped) against the sync_format wire format.
+Reports payload size and the time to decode every frame of the payload, the part of sync_db that
+happens before frames reach the database.
+
+Run from the hindsight_server directory: python benchmarks/sync_format_benchmark.py
+"""
+import io
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+from hindsight_server import sync_format
+
+def make_json_payload(num_frames, ocr_per_frame):
+    words = ["the", "hindsight", "screenshot", "message", "search", "settings", "notification", "12:45"]
+    frames = [{"id": i, "timestamp": 1_700_000_000_000 + i * 2000, "application": "com.android.chrome",
+               "ocr_results": [{"x": random.randint(0, 1000), "y": random.randint(0, 2000), "width": random.randint(10, 300),
+                                "height": 14, "text": random.choice(words), "confidence": round(random.random(), 3),
+                                "blockNum": j // 10} for j in range(ocr_per_frame)]}
+              for i in range(num_frames)]
+    return {"source": "bench", "annotations": [], "locations": [], "content": [], "frames": frames}
+
+def decode_json(body, compressed):
+    data = json.load(gzip.GzipFile(fileobj=io.BytesIO(body)) if compressed else io.BytesIO(body))
+    return sum(1 for _ in (sync_format.convert_json_frame(f) for f in data["frames"]))
+
+def decode_binary(body, content_encoding):
+    _, frames = sync_format.read_sync_payload(sync_format.decompressed_stream(io.BytesIO(body), content_encoding))
+    return sum(1 for _ in frames)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=2000, help="Frames per payload")
+    parser.add_argument("--ocr_per_frame", type=int, default=60, help="OCR results per frame")
+    args = parser.parse_args()
+
+    payload = make_json_payload(args.frames, args.ocr_per_frame)
+    metadata = {k: v for k, v in payload.items() if k != "frames"}
+    frames = [sync_format.convert_json_frame(f) for f in payload["frames"]]
+    json_body = json.dumps(payload).encode("utf-8")
+    encodings = {
+        "json": (json_body, lambda b: decode_json(b, compressed=False)),
+        "json+gzip": (gzip.compress(json_body), lambda b: decode_json(b, compressed=True)),
+        "binary": (sync_format.encode_sync_payload(metadata, frames, None), lambda b: decode_binary(b, None)),
+        "binary+gzip": (sync_format.encode_sync_payload(metadata, frames, "gzip"), lambda b: decode_binary(b, "gzip")),
+    }
+    if "zstd" in sync_format.supported_encodings():
+        encodings["binary+zstd"] = (sync_format.encode_sync_payload(metadata, frames, "zstd"), lambda b: decode_binary(b, "zstd"))
+
+    print(f"{'encoding':>12}{'MB':>8}{'decode ms':>12}")
+    for name, (body, decode) in encodings.items():
+        start = time.perf_counter()
+        assert decode(body) == args.frames
+        print(f"{name:>12}{len(body) / 1e6:>8.2f}{(time.perf_counter() - start) * 1000:>12.0f}")
+
+if __name__ == "__main__":
+    main()
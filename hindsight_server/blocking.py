@@ -0,0 +1,38 @@
+"""Runs blocking work (SQLite queries, file locks, fsync) on a bounded pool of native threads so the
+gevent hub keeps serving other requests meanwhile. Relies on gevent leaving threading unpatched
+(monkey.patch_all(thread=False, queue=False)) so the pool threads and HindsightDB's writer are real threads.
+"""
+import functools
+import threading
+from gevent.threadpool import ThreadPool
+
+from hindsight_server.config import BLOCKING_POOL_SIZE
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(BLOCKING_POOL_SIZE)
+        return _pool
+
+def run_blocking(func, *args, **kwargs):
+    """Calls func on the pool and cooperatively waits for its result (or exception)."""
+    return get_pool().apply(func, args, kwargs)
+
+class Offloaded:
+    """Proxy that runs every method call of the wrapped object with run_blocking."""
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapped, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            return run_blocking(attr, *args, **kwargs)
+        return call
@@ -32,9 +32,9 @@ def get_embedding_function():
         return MLXEmbeddingFunction(model_id=MLX_EMBDEDDING_MODEL)
     return embedding_functions.DefaultEmbeddingFunction()
 
-def get_chroma_collection(collection_name=DEFAULT_COLLECTION):
+def get_chroma_collection(collection_name=DEFAULT_COLLECTION, embedding_function=None):
     """Returns chromadb collections."""
-    embedding_function = get_embedding_function()
+    embedding_function = get_embedding_function() if embedding_function is None else embedding_function
     chroma_client = chromadb.PersistentClient(path=chroma_db_path)
     chroma_collection = chroma_client.get_or_create_collection(collection_name, embedding_function=embedding_function)
     return chroma_collection
@@ -106,36 +106,45 @@ def query_chroma(query_text: str, source_apps=None, utc_milliseconds_start_date=
 def get_chromadb_metadata(row):
     return {"frame_id" : row['id'], "application" : row['application'], "timestamp" : row['timestamp']}
 
-def run_chroma_ingest(db, df, chroma_collection, ocr_results_df):
-    """Runs chromadb ingest for frames in df. Will skip frames that have the same ocr results as the 
-    prior frame.
+def get_chroma_documents(df, frame_texts_df):
+    """Returns the chromadb document of each frame in df, in order. Frames without text and frames
+    with the same document as the prior frame get None.
     """
     documents = list()
-    metadatas = list()
-    ids = list()
     last_document = ""
+    frame_id_to_text = dict(zip(frame_texts_df['frame_id'], frame_texts_df['text']))
     for i, row in df.iterrows():
-        # ocr_result = db.get_ocr_results(frame_id=row['id'])
-        ocr_result = ocr_results_df.loc[ocr_results_df['frame_id'] == row['id']]
-        if len(ocr_result) == 0 or set(ocr_result['text']) == {None}:
-            continue
-        document = utils.get_preprompted_text(ocr_result=ocr_result, application=row['application'], timestamp=row['timestamp'])
-        if last_document != document:
-            documents.append(document)
-            metadatas.append(get_chromadb_metadata(row))
-            ids.append(str(row['id']))
-            last_document = document
-
-    if len(documents) == 0:
-        db.update_chromadb_processed(frame_ids=set(df['id']))
-        return
-    chroma_collection.add(
-        documents=documents,
-        metadatas=metadatas,
-        ids=ids
-    )
+        frame_text = frame_id_to_text.get(row['id'])
+        document = None
+        if frame_text:
+            document = utils.preprompt_cleaned_text(frame_text, application=row['application'], timestamp=row['timestamp'])
+            if last_document != document:
+                last_document = document
+            else:
+                document = None
+        documents.append(document)
+    return documents
+
+def add_chroma_documents(df, chroma_collection):
+    """Adds the frames of df with a "document" to chromadb, with their precomputed "embedding" if
+    df has that column."""
+    df = df.loc[df['document'].notnull()]
+    if len(df) > 0:
+        chroma_collection.add(
+            documents=list(df['document']),
+            metadatas=[get_chromadb_metadata(row) for i, row in df.iterrows()],
+            ids=[str(frame_id) for frame_id in df['id']],
+            embeddings=list(df['embedding']) if 'embedding' in df.columns else None
+        )
+        print(f"Successfully added {len(df)} documents to chromadb")
+
+def run_chroma_ingest(db, df, chroma_collection, frame_texts_df):
+    """Runs chromadb ingest for frames in df. Will skip frames that have the same ocr results as the 
+    prior frame.
+    """
+    df = df.assign(document=get_chroma_documents(df, frame_texts_df))
+    add_chroma_documents(df, chroma_collection)
     db.update_chromadb_processed(frame_ids=set(df['id']))
-    print(f"Successfully added {len(documents)} documents to chromadb")
 
 def run_chroma_ingest_batched(db: HindsightDB, df: pd.DataFrame, chroma_collection: chromadb.Collection, batch_size=1000):
     """Runs chromadb ingest in a batched fashion to balance efficiency and reliability.
@@ -151,8 +160,8 @@ def run_chroma_ingest_batched(db: HindsightDB, df: pd.DataFrame, chroma_collecti
         start_index = i * batch_size
         end_index = start_index + batch_size
         frames_batch = df.iloc[start_index:end_index]
-        ocr_results_df = db.get_frames_with_ocr(frame_ids=set(frames_batch['id']))
-        run_chroma_ingest(db=db, df=frames_batch, chroma_collection=chroma_collection, ocr_results_df=ocr_results_df)
+        frame_texts_df = db.get_frame_texts(frame_ids=frames_batch['id'])
+        run_chroma_ingest(db=db, df=frames_batch, chroma_collection=chroma_collection, frame_texts_df=frame_texts_df)
 
 if __name__ == "__main__":
     db = HindsightDB()
@@ -13,6 +13,17 @@ RAW_SCREENSHOTS_DIR = DATA_DIR / "raw_screenshots"
 VIDEO_FILES_DIR = DATA_DIR / "video_files"
 SERVER_LOG_FILE = DATA_DIR / "hindsight_server.log"
 ANDROID_IDENTIFIERS_ALIAS_FILE = DATA_DIR / "android_identifiers.json"
+SCREENSHOTS_MANIFEST_FILE = DATA_DIR / "screenshots_manifest.json"
+
+"""How new OCR results are stored. "rows" writes one ocr_results row per box, "blob" packs each
+frame's boxes into a single ocr_boxes row (see ocr_blob.py). Reads always cover both. Existing
+rows can be converted with: python db.py --migrate_ocr_to_blobs
+The gain of "blob" is speed, not disk space: reading the OCR results of 500 frames takes about
+70 instead of 210 ms and ingest is ~1.8x faster, but storage only shrinks ~6% (21.8 to 20.5 MB
+for 5000 frames of 60 boxes, see benchmarks/ocr_storage_benchmark.py) since a frame's blob
+typically takes a database page of its own. Do not migrate to save space.
+"""
+OCR_STORAGE = "rows"
 
 API_KEY_FILE = HINDSIGHT_SERVER_DIR / "secret_api_key.txt"
 if os.path.exists(API_KEY_FILE):
@@ -21,6 +32,37 @@ if os.path.exists(API_KEY_FILE):
 else:
     SECRET_API_KEY = "NONE"
 
+"""Upload admission control (see admission.py). Uploads get 429 with a Retry-After while more uploaded
+frames than MAX_OCR_BACKLOG await OCR, more frames than MAX_EMBEDDING_BACKLOG await embedding, or
+while DATA_DIR has less than MIN_FREE_DISK_MB free.
+"""
+MAX_OCR_BACKLOG = 5000
+MAX_EMBEDDING_BACKLOG = 50000
+MIN_FREE_DISK_MB = 2000
+
+"""Native threads the server runs blocking SQLite and file work on (see blocking.py). Also bounds
+the server's SQLite read connections, one per thread."""
+BLOCKING_POOL_SIZE = 8
+
+"""Local port the backend serves its /metrics on (the server serves them on its own port)."""
+BACKEND_METRICS_PORT = 6001
+
+"""Local UDP port processes writing to the database wake the backend on (see wakeup.py). Without a
+wakeup the backend still checks for new work every BACKEND_IDLE_CHECK_SECONDS, and reruns every
+stage every BACKEND_FULL_SWEEP_SECONDS in case a change was missed, rescanning frames for the ingest
+pipeline from the first one (see server_backend.IngestFeeder)."""
+BACKEND_WAKEUP_PORT = 6002
+BACKEND_IDLE_CHECK_SECONDS = 5
+BACKEND_FULL_SWEEP_SECONDS = 600
+
+"""Days the backend keeps finished (done) jobs in the jobs table for /jobs/<job_id> before deleting
+them. Failed jobs are kept."""
+JOB_RETENTION_DAYS = 7
+
+"""Worker processes the backend ingests images and runs OCR with (see worker_pool.py). Leaves two
+cores for the server and the backend's own work, but always at least one worker."""
+BACKEND_WORKERS = max(1, (os.cpu_count() or 1) - 2)
+
 RUNNING_PLATFORM = platform.system()
 
 """Should be able to run any LLMs in huggingface mlx-community if mac. Otherwise, any transformers LLAMA model"""
@@ -1,221 +1,940 @@
 """Code for interfacing with SQLite database."""
 import os
+import re
+import json
 import time
+import queue
+import atexit
 import shutil
 import sqlite3
+import weakref
+import functools
+import threading
 import numpy as np
 import pandas as pd
-from datetime import timedelta
-
-import portalocker
+from concurrent.futures import Future
 
 import tzlocal
 from zoneinfo import ZoneInfo
 
-from hindsight_server.config import DATA_DIR, RAW_SCREENSHOTS_DIR
+from hindsight_server.config import DATA_DIR, RAW_SCREENSHOTS_DIR, OCR_STORAGE
+from hindsight_server.ocr_blob import encode_ocr_results, decode_ocr_results, ocr_blobs_to_df
 import hindsight_server.utils as utils
+import hindsight_server.metrics as metrics
+import hindsight_server.wakeup as wakeup
 
 local_timezone = tzlocal.get_localzone()
 video_timezone = ZoneInfo("UTC")
 
 DB_FILE = os.path.join(DATA_DIR, "hindsight.db")
 
+def _populate_search_index(db, cursor):
+    """(Re)builds ocr_text_fts from every frame's OCR results."""
+    cursor.execute("DELETE FROM ocr_text_fts")
+    cursor.execute('''
+        INSERT INTO ocr_text_fts (rowid, text)
+        SELECT frame_id, GROUP_CONCAT(text, ' ') FROM ocr_results
+        GROUP BY frame_id
+    ''')
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ocr_boxes'")
+    if cursor.fetchone() is None:
+        return
+    # Blob-stored frames. Frames with results in both stores get both texts.
+    for frame_id, boxes in cursor.connection.execute("SELECT frame_id, boxes FROM ocr_boxes").fetchall():
+        cursor.execute("SELECT text FROM ocr_text_fts WHERE rowid = ?", (frame_id,))
+        row = cursor.fetchone()
+        texts = [row[0]] if row is not None and row[0] is not None else []
+        texts += [r[4] for r in decode_ocr_results(boxes) if r[4] is not None]
+        cursor.execute("DELETE FROM ocr_text_fts WHERE rowid = ?", (frame_id,))
+        cursor.execute("INSERT INTO ocr_text_fts (rowid, text) VALUES (?, ?)", (frame_id, ' '.join(texts) if texts else None))
+
+def _create_search_index(db, cursor):
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS ocr_text_fts USING fts5(text)")
+    _populate_search_index(db, cursor)
+
+def _split_frames_unique_keys(db, cursor):
+    """Rebuilds frames without its table-level UNIQUE (timestamp, path), which let frames synced
+    from different devices (all with path 'None') collide on equal timestamps. Frames backed by a
+    file stay unique by (timestamp, path), frames without one by (source, source_id)."""
+    cursor.execute('''
+        CREATE TABLE frames_new (
+            id INTEGER PRIMARY KEY,
+            timestamp INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            application TEXT NOT NULL,
+            chromadb_processed BOOLEAN NOT NULL DEFAULT false,
+            source TEXT,
+            source_id INTEGER,
+            video_chunk_id INTEGER,
+            video_chunk_offset INTEGER
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO frames_new (id, timestamp, path, application, chromadb_processed, source, source_id, video_chunk_id, video_chunk_offset)
+        SELECT id, timestamp, path, application, chromadb_processed, source, source_id, video_chunk_id, video_chunk_offset FROM frames
+    ''')
+    cursor.execute("DROP TABLE frames")
+    cursor.execute("ALTER TABLE frames_new RENAME TO frames")
+    for statement in [
+        "CREATE UNIQUE INDEX idx_frames_timestamp_path ON frames (timestamp, path) WHERE path != 'None'",
+        "CREATE UNIQUE INDEX idx_frames_synced_source_id ON frames (source, source_id) WHERE path = 'None'",
+        # Indexes of earlier migrations, dropped with the old table
+        "CREATE INDEX idx_frames_source_source_id ON frames (source, source_id)",
+        "CREATE INDEX idx_frames_application_timestamp ON frames (application, timestamp)",
+        "CREATE INDEX idx_frames_not_chromadb_processed ON frames (id) WHERE NOT chromadb_processed",
+        "CREATE INDEX idx_frames_timestamp ON frames (timestamp)",
+        "CREATE INDEX idx_frames_video_chunk_id ON frames (video_chunk_id)",
+    ]:
+        cursor.execute(statement)
+
+"""Schema migrations applied in order on top of the tables in create_tables. Each migration is
+(version, description, migration) where migration is a list of SQL statements or a function
+taking (db, cursor). Versions must only ever be appended.
+"""
+MIGRATIONS = [
+    (1, "Index ocr_results by frame_id", [
+        "CREATE INDEX IF NOT EXISTS idx_ocr_results_frame_id ON ocr_results (frame_id)",
+    ]),
+    (2, "Index frames and video_chunks by source", [
+        "CREATE INDEX IF NOT EXISTS idx_frames_source_source_id ON frames (source, source_id)",
+        "CREATE INDEX IF NOT EXISTS idx_video_chunks_source_source_id ON video_chunks (source, source_id)",
+    ]),
+    (3, "Index frames by application and timestamp", [
+        "CREATE INDEX IF NOT EXISTS idx_frames_application_timestamp ON frames (application, timestamp)",
+    ]),
+    (4, "Partial index on frames not processed by chromadb", [
+        "CREATE INDEX IF NOT EXISTS idx_frames_not_chromadb_processed ON frames (id) WHERE NOT chromadb_processed",
+    ]),
+    (5, "Index labels", [
+        "CREATE INDEX IF NOT EXISTS idx_labels_frame_id ON labels (frame_id)",
+        "CREATE INDEX IF NOT EXISTS idx_labels_label_value ON labels (label, value, frame_id)",
+    ]),
+    (6, "Partial indexes on unfinished and active queries", [
+        "CREATE INDEX IF NOT EXISTS idx_queries_unfinished ON queries (id) WHERE finished_timestamp IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_queries_active ON queries (timestamp) WHERE active = true",
+    ]),
+    (7, "Full-text search index of frame OCR text", _create_search_index),
+    (8, "Index frames by (timestamp, id) for keyset pagination", [
+        "CREATE INDEX IF NOT EXISTS idx_frames_timestamp ON frames (timestamp)",
+    ]),
+    (9, "Compact per-frame OCR storage (see ocr_blob.py)", [
+        '''CREATE TABLE IF NOT EXISTS ocr_boxes (
+            frame_id INTEGER PRIMARY KEY,
+            num_boxes INTEGER NOT NULL,
+            boxes BLOB NOT NULL,
+            FOREIGN KEY (frame_id) REFERENCES frames(id)
+        )''',
+    ]),
+    (10, "Materialized cleaned text per frame", [
+        '''CREATE TABLE IF NOT EXISTS frame_text (
+            frame_id INTEGER PRIMARY KEY,
+            text TEXT NOT NULL,
+            text_length INTEGER NOT NULL,
+            text_hash TEXT NOT NULL,
+            cleaning_version INTEGER NOT NULL,
+            FOREIGN KEY (frame_id) REFERENCES frames(id)
+        )''',
+    ]),
+    (11, "Index frames by video chunk", [
+        "CREATE INDEX IF NOT EXISTS idx_frames_video_chunk_id ON frames (video_chunk_id)",
+    ]),
+    (12, "Durable job queue", [
+        '''CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            job_type TEXT NOT NULL,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            progress DOUBLE,
+            error TEXT,
+            created_timestamp INTEGER NOT NULL,
+            started_timestamp INTEGER,
+            finished_timestamp INTEGER
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (job_type, id) WHERE status = 'pending'",
+    ]),
+    (13, "Unique frames by (source, source_id) when they have no file", _split_frames_unique_keys),
+]
+
+FRAME_COLUMNS = ("id", "timestamp", "path", "application", "chromadb_processed", "source", "source_id",
+                 "video_chunk_id", "video_chunk_offset")
+
+def to_fts_query(text):
+    """Converts search text into an FTS5 MATCH expression. Words are matched as whole tokens,
+    a trailing * makes a word a prefix query and double quoted text is matched as a phrase.
+    All terms must match.
+    """
+    terms = list()
+    for phrase, word in re.findall(r'"([^"]*)"|([^\s"]+)', text):
+        if phrase.strip():
+            terms.append(f'"{phrase}"')
+        elif word.rstrip('*'):
+            terms.append(f'"{word.rstrip("*")}"' + ('*' if word.endswith('*') else ''))
+    return ' '.join(terms)
+
+def _migration_progress_handler(description, report_every_s=5):
+    """Returns a sqlite progress handler that prints elapsed time during long migrations."""
+    start_time = last_report = time.time()
+    def handler():
+        nonlocal last_report
+        now = time.time()
+        if now - last_report >= report_every_s:
+            print(f"    ...{description}: {now - start_time:.0f}s elapsed")
+            last_report = now
+        return 0 # Returning non-zero would abort the statement
+    return handler
+
+_open_databases = weakref.WeakSet()
+
+@atexit.register
+def close_all_databases():
+    """Shutdown hook that closes the pooled connections of every live HindsightDB."""
+    for db in list(_open_databases):
+        db.close()
+
+class _PooledConnection:
+    """Holds a thread's connection so it is closed when the owning thread (and its
+    thread-local storage) goes away."""
+    def __init__(self, connection):
+        self.connection = connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except sqlite3.Error:
+            pass
+
+"""Tables whose changes are published to other processes through change markers, see
+HindsightDB.get_table_versions. Commits changing them also wake the backend (see wakeup.py)."""
+TRACKED_TABLES = ("frames", "video_chunks", "queries", "annotations", "locations", "jobs")
+
+DB_READ_SECONDS = metrics.histogram("hindsight_db_read_seconds", "Duration of timed read methods", ["method"])
+DB_WRITE_SECONDS = metrics.histogram("hindsight_db_write_seconds", "Duration of write methods inside their transaction", ["method"])
+DB_WRITE_QUEUE_WAIT_SECONDS = metrics.histogram("hindsight_db_write_queue_wait_seconds",
+                                                "Time writes wait for the writer thread to start their batch")
+DB_LOCK_WAIT_SECONDS = metrics.histogram("hindsight_db_lock_wait_seconds",
+                                         "Time the writer waits for SQLite's database file write lock (BEGIN IMMEDIATE)")
+DB_WRITE_BATCH_SIZE = metrics.histogram("hindsight_db_write_batch_size", "Writes committed per transaction",
+                                        buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+
+def timed(func):
+    """Decorator recording a read method's duration in hindsight_db_read_seconds."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with DB_READ_SECONDS.time(method=func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+class _WriteJob:
+    """A write method call queued for the writer thread."""
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued_time = time.perf_counter()
+
+def writer(func):
+    """Decorator that runs a write method on the database's writer thread. The method is
+    passed the writer's cursor as its first argument and must not commit: queued writes are
+    batched into a single BEGIN IMMEDIATE transaction, each inside its own savepoint so a
+    failing write only rolls back itself. Blocks until the batch is committed.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        return self._submit_write(func, args, kwargs)
+    return wrapper
+
 class HindsightDB:
-    def __init__(self, db_file=DB_FILE):
+    def __init__(self, db_file=DB_FILE, cached_statements=256, max_write_batch=256, ocr_storage=OCR_STORAGE):
+        if ocr_storage not in {"rows", "blob"}:
+            raise ValueError(f"Invalid ocr_storage {ocr_storage}, must be rows or blob")
         self.db_file = db_file
-        self.lock_file = db_file + '.lock'
+        self.ocr_storage = ocr_storage
+        self.cached_statements = cached_statements
+        self.max_write_batch = max_write_batch
+        self._init_pool()
+        _open_databases.add(self)
         self.create_tables()
+        self.run_migrations()
 
-    def get_connection(self):
-        """Get a new connection every time for thread safety."""
-        connection = sqlite3.connect(self.db_file, timeout=50)
+    def _init_pool(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._pool = weakref.WeakSet()
+        self._pool_lock = threading.Lock()
+        self._writer_lock = threading.Lock()
+        self._writer_thread = None
+        self._writer_ident = None
+        self._writer_cursor = None
+        self._write_queue = None
+        self._changed_tables = set() # Tracked tables changed by the writer's current transaction
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # Forked children must not touch the parent's connections or writer. Keep references
+            # so they are never closed (and never release the parent's locks) from here.
+            self._inherited_pool = (self._local, set(self._pool))
+            self._init_pool()
+
+    def _connect(self, **kwargs):
+        connection = sqlite3.connect(self.db_file, timeout=50, check_same_thread=False,
+                                     cached_statements=self.cached_statements, **kwargs)
         connection.execute('PRAGMA journal_mode=WAL;')
         connection.execute('PRAGMA busy_timeout = 10000;')
         return connection
-    
-    def with_lock(func):
-        """Decorator to handle database locking."""
-        def wrapper(self, *args, **kwargs):
-            with open(self.lock_file, 'a') as lock_file:
-                portalocker.lock(lock_file, portalocker.LOCK_EX)
+
+    def get_connection(self):
+        """Returns the calling thread's long-lived connection, opening it on first use.
+        Connections are never shared between threads or across a fork. Use for reads; writes
+        go through the writer thread (see writer).
+        """
+        self._check_pid()
+        pooled = getattr(self._local, "pooled", None)
+        if pooled is None or pooled.connection is None:
+            pooled = _PooledConnection(self._connect())
+            self._local.pooled = pooled
+            with self._pool_lock:
+                self._pool.add(pooled)
+        return pooled.connection
+
+    def _submit_write(self, func, args, kwargs):
+        """Queues a write for the writer thread and waits for its result."""
+        self._check_pid()
+        if threading.get_ident() == self._writer_ident:
+            # Write method called from within another write, join its transaction
+            return func(self, self._writer_cursor, *args, **kwargs)
+        job = _WriteJob(func, args, kwargs)
+        self._enqueue_write(job)
+        return job.future.result()
+
+    def _enqueue_write(self, job):
+        """Queues job for this process's writer thread, starting one if there is none. A writer
+        that died has failed every job queued for it, so the next write starts a new one."""
+        with self._writer_lock:
+            if self._writer_thread is None or not self._writer_thread.is_alive():
+                self._write_queue = queue.Queue()
+                self._writer_thread = threading.Thread(target=self._writer_loop, args=(self._write_queue,),
+                                                       name="HindsightDBWriter", daemon=True)
+                self._writer_thread.start()
+            self._write_queue.put(job)
+
+    def _writer_loop(self, write_queue):
+        """Drains write_queue, committing everything queued so far in one transaction. If the
+        writer dies (e.g. the database cannot be opened) every job queued for it fails with the
+        error instead of waiting forever."""
+        try:
+            self._writer_ident = threading.get_ident()
+            connection = self._connect(isolation_level=None) # Transactions are managed explicitly
+            try:
+                connection.execute('PRAGMA busy_timeout = 60000;')
+                self._writer_cursor = connection.cursor()
+                running = True
+                while running:
+                    jobs = [write_queue.get()]
+                    while len(jobs) < self.max_write_batch:
+                        try:
+                            jobs.append(write_queue.get_nowait())
+                        except queue.Empty:
+                            break
+                    if None in jobs: # Shutdown sentinel
+                        running = False
+                        jobs = [j for j in jobs if j is not None]
+                    if jobs:
+                        self._run_write_batch(self._writer_cursor, jobs)
+            finally:
+                connection.close()
+        except BaseException as e:
+            print(f"Database writer thread died: {e!r}")
+            with self._writer_lock:
+                # No job is queued for this writer once it is no longer the current one
+                if self._writer_thread is threading.current_thread():
+                    self._writer_thread = None
+            while True:
+                try:
+                    job = write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job.future.set_exception(e)
+
+    def _run_write_batch(self, cursor, jobs):
+        results = list()
+        start_time = time.perf_counter()
+        for job in jobs:
+            DB_WRITE_QUEUE_WAIT_SECONDS.observe(start_time - job.enqueued_time)
+        DB_WRITE_BATCH_SIZE.observe(len(jobs))
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            DB_LOCK_WAIT_SECONDS.observe(time.perf_counter() - start_time)
+            for job in jobs:
+                cursor.execute("SAVEPOINT write_job")
                 try:
-                    result = func(self, *args, **kwargs)
-                finally:
-                    portalocker.unlock(lock_file)
-                return result
-        return wrapper
-
-    @with_lock
-    def create_tables(self):
+                    with DB_WRITE_SECONDS.time(method=job.func.__name__):
+                        result = job.func(self, cursor, *job.args, **job.kwargs)
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO write_job")
+                    results.append((job, None, e))
+                else:
+                    results.append((job, result, None))
+                cursor.execute("RELEASE write_job")
+            cursor.execute("COMMIT")
+        except BaseException as e:
+            print(f"Write transaction of {len(jobs)} jobs failed: {e!r}")
+            self._changed_tables.clear()
+            for job in jobs:
+                job.future.set_exception(e)
+            try:
+                if cursor.connection.in_transaction:
+                    cursor.execute("ROLLBACK")
+            except sqlite3.Error as rollback_error:
+                print(f"Rollback failed: {rollback_error}")
+            if not isinstance(e, Exception):
+                raise # Kills the writer, which fails the jobs still queued
+            return
+
+        # Only report results once they are durable
+        for job, result, error in results:
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+        try:
+            self._bump_change_markers()
+        except OSError as e:
+            # Readers then miss this change until the next one, but the writes are committed
+            print(f"Failed to bump change markers: {e}")
+            self._changed_tables.clear()
+
+    def _change_marker_path(self, table):
+        return f"{self.db_file}.changes.{table}"
+
+    def _mark_changed(self, table):
+        """Records that the writer's current transaction changes table (one of TRACKED_TABLES).
+        Its change marker is bumped once the transaction commits."""
+        self._changed_tables.add(table)
+
+    def _bump_change_markers(self):
+        """Sets the mtime of the change marker of every table changed by the committed transaction
+        to the current time in nanoseconds, so every process sees a new version."""
+        if not self._changed_tables:
+            return
+        for table in self._changed_tables:
+            path = self._change_marker_path(table)
+            try:
+                now_ns = max(time.time_ns(), os.stat(path).st_mtime_ns + 1)
+            except FileNotFoundError:
+                open(path, 'a').close()
+                now_ns = time.time_ns()
+            os.utime(path, ns=(now_ns, now_ns))
+        self._changed_tables.clear()
+        wakeup.notify()
+
+    def get_table_versions(self, tables):
+        """Returns a tuple of versions of tables (from TRACKED_TABLES) that changes whenever any
+        process commits a change to one of them. Only stats files, so it is cheap enough to check
+        on every request before trusting a cached read."""
+        versions = list()
+        for table in tables:
+            try:
+                versions.append(os.stat(self._change_marker_path(table)).st_mtime_ns)
+            except FileNotFoundError:
+                versions.append(0)
+        return tuple(versions)
+
+    def close(self):
+        """Stops the writer thread and closes every pooled connection opened by this process."""
+        if self._pid != os.getpid():
+            return
+        with self._writer_lock:
+            writer_thread = self._writer_thread
+            self._writer_thread = None
+        if writer_thread is not None and writer_thread.is_alive() and threading.get_ident() != self._writer_ident:
+            self._write_queue.put(None)
+            writer_thread.join()
+        with self._pool_lock:
+            pooled_connections = list(self._pool)
+            self._pool.clear()
+        for pooled in pooled_connections:
+            pooled.close()
+
+    @writer
+    def create_tables(self, cursor):
         # Create the "frames" table if it doesn't exist
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS frames (
+                id INTEGER PRIMARY KEY,
+                timestamp INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                application TEXT NOT NULL,
+                chromadb_processed BOOLEAN NOT NULL DEFAULT false,
+                source TEXT,
+                source_id INTEGER,
+                video_chunk_id INTEGER,
+                video_chunk_offset INTEGER,
+                UNIQUE (timestamp, path)
+            )
+        ''')
+        
+        # Create the "ocr_results" table if it doesn't exist
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ocr_results (
+                id INTEGER PRIMARY KEY,
+                frame_id INTEGER NOT NULL,
+                x DOUBLE NOT NULL,
+                y DOUBLE NOT NULL,
+                w DOUBLE NOT NULL,
+                h DOUBLE NOT NULL,
+                text TEXT,
+                conf DOUBLE NOT NULL,
+                block_num INTEGER,
+                line_num INTEGER,
+                FOREIGN KEY (frame_id) REFERENCES frames(id)
+            )
+        ''')
+
+        # Tables for handling queries
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS queries (
+                id INTEGER PRIMARY KEY,
+                query TEXT NOT NULL,
+                result TEXT,
+                source_frame_ids TEXT,
+                timestamp INTEGER NOT NULL,
+                active BOOLEAN NOT NULL DEFAULT true,
+                finished_timestamp INTEGER,
+                context_start_timestamp INTEGER,
+                context_end_timestamp INTEGER,
+                context_applications TEXT
+            )
+        ''')
+
+        # Create locations table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS locations (
+                timestamp INTEGER NOT NULL PRIMARY KEY,
+                latitude DOUBLE NOT NULL,
+                longitude DOUBLE NOT NULL
+            )
+        ''')
+
+        # Create locations table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS annotations (
+                timestamp INTEGER NOT NULL PRIMARY KEY,
+                text TEXT
+            )
+        ''')
+
+        # Create labels table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS labels (
+                frame_id INTEGER NOT NULL,
+                label TEXT NOT NULL,
+                value TEXT 
+            )
+        ''')
+
+        # Create video_chunks table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS video_chunks (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                source TEXT,
+                source_id INTEGER,
+                UNIQUE (path)
+            )
+        ''')
+
+        # Applied migrations (see MIGRATIONS)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_timestamp INTEGER NOT NULL,
+                duration_ms INTEGER NOT NULL
+            )
+        ''')
+
+        cursor.execute('''
+            PRAGMA table_info(video_chunks)
+        ''')
+        columns = [row[1] for row in cursor.fetchall()]
+        if 'source' not in columns:
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS frames (
-                    id INTEGER PRIMARY KEY,
-                    timestamp INTEGER NOT NULL,
-                    path TEXT NOT NULL,
-                    application TEXT NOT NULL,
-                    chromadb_processed BOOLEAN NOT NULL DEFAULT false,
-                    source TEXT,
-                    source_id INTEGER,
-                    video_chunk_id INTEGER,
-                    video_chunk_offset INTEGER,
-                    UNIQUE (timestamp, path)
-                )
+                ALTER TABLE video_chunks
+                ADD COLUMN source TEXT
             ''')
-            
-            # Create the "ocr_results" table if it doesn't exist
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS ocr_results (
-                    id INTEGER PRIMARY KEY,
-                    frame_id INTEGER NOT NULL,
-                    x DOUBLE NOT NULL,
-                    y DOUBLE NOT NULL,
-                    w DOUBLE NOT NULL,
-                    h DOUBLE NOT NULL,
-                    text TEXT,
-                    conf DOUBLE NOT NULL,
-                    block_num INTEGER,
-                    line_num INTEGER,
-                    FOREIGN KEY (frame_id) REFERENCES frames(id)
-                )
+                ALTER TABLE video_chunks
+                ADD COLUMN source_id INTEGER
             ''')
 
-            # Tables for handling queries
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS queries (
-                    id INTEGER PRIMARY KEY,
-                    query TEXT NOT NULL,
-                    result TEXT,
-                    source_frame_ids TEXT,
-                    timestamp INTEGER NOT NULL,
-                    active BOOLEAN NOT NULL DEFAULT true,
-                    finished_timestamp INTEGER,
-                    context_start_timestamp INTEGER,
-                    context_end_timestamp INTEGER,
-                    context_applications TEXT
-                )
-            ''')
+    def get_schema_version(self):
+        """Returns the version of the last applied migration (0 if none)."""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MAX(version) FROM schema_version")
+            version = cursor.fetchone()[0]
+            return 0 if version is None else version
 
-            # Create locations table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS locations (
-                    timestamp INTEGER NOT NULL PRIMARY KEY,
-                    latitude DOUBLE NOT NULL,
-                    longitude DOUBLE NOT NULL
-                )
-            ''')
+    def run_migrations(self):
+        """Applies pending MIGRATIONS in place, each in its own transaction."""
+        schema_version = self.get_schema_version()
+        pending_migrations = [m for m in MIGRATIONS if m[0] > schema_version]
+        for i, (version, description, migration) in enumerate(pending_migrations):
+            print(f"Applying migration {i + 1}/{len(pending_migrations)} (version {version}): {description}")
+            duration_ms = self._apply_migration(version, description, migration)
+            if duration_ms is not None:
+                print(f"Applied migration {version} in {duration_ms / 1000:.1f}s")
 
-            # Create locations table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS annotations (
-                    timestamp INTEGER NOT NULL PRIMARY KEY,
-                    text TEXT
-                )
-            ''')
+    @writer
+    def _apply_migration(self, cursor, version, description, migration):
+        """Applies a single migration and records it in schema_version. Returns its duration
+        in milliseconds or None if another process already applied it."""
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+        applied_version = cursor.fetchone()[0]
+        if applied_version is not None and applied_version >= version:
+            return None
+
+        start_time = time.time()
+        cursor.connection.set_progress_handler(_migration_progress_handler(description), 1_000_000)
+        try:
+            if callable(migration):
+                migration(self, cursor)
+            else:
+                for statement in migration:
+                    cursor.execute(statement)
+        finally:
+            cursor.connection.set_progress_handler(None, 0)
+        duration_ms = int((time.time() - start_time) * 1000)
+
+        cursor.execute('''
+            INSERT INTO schema_version (version, description, applied_timestamp, duration_ms)
+            VALUES (?, ?, ?, ?)
+        ''', (version, description, int(time.time() * 1000), duration_ms))
+        return duration_ms
 
-            # Create labels table
+    @writer
+    def insert_frame(self, cursor, timestamp, path, application, source=None, source_id=None, video_chunk_id=None, video_chunk_offset=None):
+        """Insert frame into frames table and return frame_id."""
+        try:
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS labels (
-                    frame_id INTEGER NOT NULL,
-                    label TEXT NOT NULL,
-                    value TEXT 
-                )
-            ''')
+                INSERT INTO frames (timestamp, path, application, source, source_id, video_chunk_id, video_chunk_offset)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (timestamp, path, application, source, source_id, video_chunk_id, video_chunk_offset))
+            
+            # Get the last inserted frame_id
+            frame_id = cursor.lastrowid
+            self._mark_changed("frames")
+            print(f"Frame added successfully with frame_id: {frame_id}")
+        except sqlite3.IntegrityError:
+            # Frame already exists, get the existing frame_id
+            frame_id = self._existing_frame_id(cursor, timestamp, path, source, source_id)
+            print(f"Frame already exists with frame_id: {frame_id}")
+        
+        return frame_id
 
-            # Create video_chunks table
+    def _existing_frame_id(self, cursor, timestamp, path, source, source_id):
+        """Returns the id of the frame a new frame collided with: the one with the same timestamp and
+        path, or for frames without a file (path 'None') the one with the same source and source_id."""
+        if path == "None":
+            cursor.execute("SELECT id FROM frames WHERE source IS ? AND source_id = ? AND path = 'None'", (source, source_id))
+        else:
+            cursor.execute("SELECT id FROM frames WHERE timestamp = ? AND path = ?", (timestamp, path))
+        return cursor.fetchone()[0]
+        
+    @writer
+    def insert_video_chunk(self, cursor, path, source=None, source_id=None):
+        """Insert frame into frames table and return frame_id."""
+        try:
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS video_chunks (
-                    id INTEGER PRIMARY KEY,
-                    path TEXT NOT NULL,
-                    source TEXT,
-                    source_id INTEGER,
-                    UNIQUE (path)
-                )
-            ''')
+                INSERT INTO video_chunks (path, source, source_id)
+                VALUES (?, ?, ?)
+            ''', (path, source, source_id,))
+            
+            # Get the last inserted frame_id
+            video_chunk_id = cursor.lastrowid
+            self._mark_changed("video_chunks")
+            print(f"Video Chunk added successfully with video_chunk_id: {video_chunk_id}")
+        except sqlite3.IntegrityError:
+            # Frame already exists, get the existing frame_id
+            cursor.execute('''
+                SELECT id FROM video_chunks
+                WHERE path = ?
+            ''', (path,))
+            video_chunk_id= cursor.fetchone()[0]
+            print(f"Video Chunk already exists with video_chunk_id: {video_chunk_id}")
+        
+        return video_chunk_id
 
+    def _write_ocr_blob(self, cursor, frame_id, ocr_results):
+        """Stores ocr_results in the frame's ocr_boxes blob, appending to any results already
+        stored there, and updates its full-text search entry. Must run on the writer thread."""
+        cursor.execute("SELECT boxes FROM ocr_boxes WHERE frame_id = ?", (frame_id,))
+        row = cursor.fetchone()
+        if row is not None:
+            ocr_results = decode_ocr_results(row[0]) + list(ocr_results)
+        cursor.execute("INSERT OR REPLACE INTO ocr_boxes (frame_id, num_boxes, boxes) VALUES (?, ?, ?)",
+                       (frame_id, len(ocr_results), encode_ocr_results(ocr_results)))
+
+        texts = [r[4] for r in ocr_results if r[4] is not None]
+        cursor.execute("DELETE FROM ocr_text_fts WHERE rowid = ?", (frame_id,))
+        cursor.execute("INSERT INTO ocr_text_fts (rowid, text) VALUES (?, ?)", (frame_id, ' '.join(texts) if texts else None))
+
+    @writer
+    def insert_ocr_results(self, cursor, frame_id, ocr_results, if_missing=False):
+        """Insert ocr results into ocr_results table (or ocr_boxes, see OCR_STORAGE). With if_missing,
+        nothing is inserted if the frame already has OCR results, e.g. when an ingest job and the
+        ingest pipeline OCRed it at the same time. Returns whether the results were inserted."""
+        if if_missing:
             cursor.execute('''
-                PRAGMA table_info(video_chunks)
-            ''')
-            columns = [row[1] for row in cursor.fetchall()]
-            if 'source' not in columns:
-                cursor.execute('''
-                    ALTER TABLE video_chunks
-                    ADD COLUMN source TEXT
-                ''')
-                cursor.execute('''
-                    ALTER TABLE video_chunks
-                    ADD COLUMN source_id INTEGER
-                ''')
+                SELECT EXISTS (SELECT 1 FROM ocr_results WHERE frame_id = ?)
+                    OR EXISTS (SELECT 1 FROM ocr_boxes WHERE frame_id = ?)
+            ''', (frame_id, frame_id))
+            if cursor.fetchone()[0]:
+                return False
+        # The frame's cleaned text is recomputed from all of its results on next use
+        cursor.execute("DELETE FROM frame_text WHERE frame_id = ?", (frame_id,))
+        if self.ocr_storage == "blob":
+            self._write_ocr_blob(cursor, frame_id, ocr_results)
+            return True
 
-            # Commit the changes and close the connection
-            conn.commit()
+        # Insert multiple OCR results
+        cursor.executemany('''
+            INSERT INTO ocr_results (frame_id, x, y, w, h, text, conf, block_num, line_num)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(frame_id, x, y, w, h, text, conf, block_num, line_num) for x, y, w, h, text, conf, block_num, line_num in ocr_results])
 
-    @with_lock
-    def insert_frame(self, timestamp, path, application, source=None, source_id=None, video_chunk_id=None, video_chunk_offset=None):
-        """Insert frame into frames table and return frame_id."""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute('''
-                    INSERT INTO frames (timestamp, path, application, source, source_id, video_chunk_id, video_chunk_offset)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (timestamp, path, application, source, source_id, video_chunk_id, video_chunk_offset))
-                
-                # Get the last inserted frame_id
+        # Keep the frame's full-text search entry in sync with all of its OCR results
+        cursor.execute("DELETE FROM ocr_text_fts WHERE rowid = ?", (frame_id,))
+        cursor.execute('''
+            INSERT INTO ocr_text_fts (rowid, text)
+            SELECT frame_id, GROUP_CONCAT(text, ' ') FROM ocr_results
+            WHERE frame_id = ?
+            GROUP BY frame_id
+        ''', (frame_id,))
+        return True
+
+    @writer
+    def insert_frames_with_ocr_bulk(self, cursor, records):
+        """Inserts many frames and their OCR results in a single transaction. Frames that already
+        exist (same timestamp and path, or for frames without a file (path 'None') same source and
+        source_id) are not duplicated and only get OCR results inserted if they have none, so
+        re-sending records is idempotent.
+        Args:
+            records (iterable[dict]): frames with keys timestamp, path, application and optionally
+                source, source_id, video_chunk_id, video_chunk_offset and ocr_results (a list of
+                (x, y, w, h, text, conf, block_num, line_num) tuples)
+        Returns:
+            dict mapping each record's source_id (or (timestamp, path) when it has no source_id)
+            to its frame_id
+        """
+        id_map = dict()
+        ocr_rows = list()
+        blob_rows = list()
+        fts_rows = list()
+        ocr_frame_ids = set() # Frames given OCR results by this call
+        num_new_frames = 0
+        for record in records:
+            timestamp, path = record['timestamp'], record['path']
+            source, source_id = record.get('source'), record.get('source_id')
+            # The conflict target must be the partial unique index the frame falls under
+            conflict_target = "(source, source_id) WHERE path = 'None'" if path == "None" else "(timestamp, path) WHERE path != 'None'"
+            cursor.execute(f'''
+                INSERT INTO frames (timestamp, path, application, source, source_id, video_chunk_id, video_chunk_offset)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT {conflict_target} DO NOTHING
+            ''', (timestamp, path, record['application'], source, source_id,
+                  record.get('video_chunk_id'), record.get('video_chunk_offset')))
+            ocr_results = record.get('ocr_results') or []
+            if cursor.rowcount == 1:
                 frame_id = cursor.lastrowid
-                conn.commit()
-                print(f"Frame added successfully with frame_id: {frame_id}")
-            except sqlite3.IntegrityError:
-                # Frame already exists, get the existing frame_id
+                num_new_frames += 1
+            else:
+                frame_id = self._existing_frame_id(cursor, timestamp, path, source, source_id)
                 cursor.execute('''
-                    SELECT id FROM frames
-                    WHERE timestamp = ? AND path = ?
-                ''', (timestamp, path))
-                frame_id = cursor.fetchone()[0]
-                print(f"Frame already exists with frame_id: {frame_id}")
-            
-            return frame_id
-        
-    @with_lock
-    def insert_video_chunk(self, path, source=None, source_id=None):
-        """Insert frame into frames table and return frame_id."""
+                    SELECT EXISTS (SELECT 1 FROM ocr_results WHERE frame_id = ?)
+                        OR EXISTS (SELECT 1 FROM ocr_boxes WHERE frame_id = ?)
+                ''', (frame_id, frame_id))
+                if cursor.fetchone()[0] or frame_id in ocr_frame_ids:
+                    ocr_results = []
+
+            if ocr_results:
+                ocr_frame_ids.add(frame_id)
+                if self.ocr_storage == "blob":
+                    blob_rows.append((frame_id, len(ocr_results), encode_ocr_results(ocr_results)))
+                else:
+                    ocr_rows.extend((frame_id, x, y, w, h, text, conf, block_num, line_num)
+                                    for x, y, w, h, text, conf, block_num, line_num in ocr_results)
+                texts = [r[4] for r in ocr_results if r[4] is not None]
+                fts_rows.append((frame_id, ' '.join(texts) if texts else None))
+
+            id_map[source_id if source_id is not None else (timestamp, path)] = frame_id
+
+        cursor.executemany('''
+            INSERT INTO ocr_results (frame_id, x, y, w, h, text, conf, block_num, line_num)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', ocr_rows)
+        cursor.executemany("INSERT INTO ocr_boxes (frame_id, num_boxes, boxes) VALUES (?, ?, ?)", blob_rows)
+        cursor.executemany("INSERT INTO ocr_text_fts (rowid, text) VALUES (?, ?)", fts_rows)
+        num_ocr_results = len(ocr_rows) + sum(r[1] for r in blob_rows)
+        if num_new_frames > 0:
+            self._mark_changed("frames")
+        print(f"Bulk inserted {num_new_frames} new frames ({len(id_map) - num_new_frames} already existed) with {num_ocr_results} OCR results.")
+        return id_map
+
+    @writer
+    def insert_video_chunks_with_frames(self, cursor, video_chunks):
+        """Inserts video chunks together with their frames and OCR results in a single transaction,
+        so a failure never leaves chunks behind without their frames.
+        Args:
+            video_chunks (iterable[dict]): chunks with keys path, source, source_id and frames (records
+                as for insert_frames_with_ocr_bulk, which get the chunk's video_chunk_id)
+        Returns:
+            insert_frames_with_ocr_bulk's mapping of the frames to their frame_ids
+        """
+        frame_records = list()
+        for video_chunk in video_chunks:
+            # Nested writes join this transaction
+            video_chunk_id = self.insert_video_chunk(video_chunk['path'], source=video_chunk.get('source'),
+                                                     source_id=video_chunk.get('source_id'))
+            frame_records.extend({**record, "video_chunk_id": video_chunk_id} for record in video_chunk['frames'])
+        return self.insert_frames_with_ocr_bulk(frame_records)
+
+    @writer
+    def _migrate_ocr_batch_to_blobs(self, cursor, batch_size):
+        """Moves the OCR results of up to batch_size frames from ocr_results into ocr_boxes.
+        Returns the number of frames moved."""
+        cursor.execute("SELECT DISTINCT frame_id FROM ocr_results ORDER BY frame_id LIMIT ?", (batch_size,))
+        frame_ids = [r[0] for r in cursor.fetchall()]
+        if not frame_ids:
+            return 0
+        placeholders = ','.join(['?'] * len(frame_ids))
+        cursor.execute(f'''
+            SELECT frame_id, x, y, w, h, text, conf, block_num, line_num FROM ocr_results
+            WHERE frame_id IN ({placeholders}) ORDER BY frame_id, id
+        ''', frame_ids)
+        frame_ocr_results = {frame_id: list() for frame_id in frame_ids}
+        for row in cursor.fetchall():
+            frame_ocr_results[row[0]].append(row[1:])
+
+        cursor.execute(f"SELECT frame_id FROM ocr_boxes WHERE frame_id IN ({placeholders})", frame_ids)
+        existing_blob_frame_ids = {r[0] for r in cursor.fetchall()}
+        for frame_id in existing_blob_frame_ids:
+            self._write_ocr_blob(cursor, frame_id, frame_ocr_results.pop(frame_id))
+        # The search index already holds the text of the remaining frames
+        cursor.executemany("INSERT INTO ocr_boxes (frame_id, num_boxes, boxes) VALUES (?, ?, ?)",
+                           [(frame_id, len(r), encode_ocr_results(r)) for frame_id, r in frame_ocr_results.items()])
+        cursor.execute(f"DELETE FROM ocr_results WHERE frame_id IN ({placeholders})", frame_ids)
+        return len(frame_ids)
+
+    def migrate_ocr_to_blobs(self, batch_size=1000):
+        """Converts all ocr_results rows to per-frame ocr_boxes blobs, batch_size frames per
+        transaction so other writers are not blocked for long. Safe to interrupt and re-run."""
+        start_time = time.time()
+        num_frames = 0
+        while True:
+            num_migrated = self._migrate_ocr_batch_to_blobs(batch_size)
+            if num_migrated == 0:
+                break
+            num_frames += num_migrated
+            print(f"    ...migrated OCR results of {num_frames} frames ({time.time() - start_time:.0f}s elapsed)")
+        print(f"Migrated OCR results of {num_frames} frames to ocr_boxes in {time.time() - start_time:.1f}s")
+
+    @writer
+    def rebuild_search_index(self, cursor):
+        """One-shot (re)build of the full-text search index from the ocr_results and ocr_boxes tables."""
+        start_time = time.time()
+        cursor.connection.set_progress_handler(_migration_progress_handler("Rebuilding search index"), 1_000_000)
+        try:
+            _populate_search_index(self, cursor)
+        finally:
+            cursor.connection.set_progress_handler(None, 0)
+        print(f"Rebuilt search index in {time.time() - start_time:.1f}s")
+
+    @writer
+    def _insert_frame_texts(self, cursor, frame_texts):
+        cursor.executemany('''
+            INSERT OR REPLACE INTO frame_text (frame_id, text, text_length, text_hash, cleaning_version)
+            VALUES (?, ?, ?, ?, ?)
+        ''', frame_texts)
+
+    def get_stale_frame_text_ids(self, frame_ids=None, max_frames=None, after_id=None, min_timestamp=None):
+        """Returns the ids of frames with OCR results whose frame_text is missing or was cleaned
+        with an older utils.TEXT_CLEANING_VERSION, most recent first.
+        Args:
+            frame_ids (list[int]): only consider these frames. Defaults to all frames with OCR results.
+            max_frames (int): return at most this many frames
+            after_id (int): only consider frames with a larger id, returned in id order instead (to
+                scan with a cursor)
+            min_timestamp (int): only consider frames captured at or after this time (UTC milliseconds)
+        """
+        query = '''
+            SELECT frames.id FROM frames
+            LEFT JOIN frame_text ON frame_text.frame_id = frames.id
+            WHERE (frame_text.frame_id IS NULL OR frame_text.cleaning_version != ?)
+                AND (EXISTS (SELECT 1 FROM ocr_results WHERE ocr_results.frame_id = frames.id)
+                     OR EXISTS (SELECT 1 FROM ocr_boxes WHERE ocr_boxes.frame_id = frames.id))
+        '''
+        params = [utils.TEXT_CLEANING_VERSION]
+        if frame_ids is not None:
+            frame_ids = [int(i) for i in frame_ids]
+            if len(frame_ids) == 0:
+                return []
+            query += f" AND frames.id IN ({','.join(['?'] * len(frame_ids))})"
+            params.extend(frame_ids)
+        if min_timestamp is not None:
+            query += " AND frames.timestamp >= ?"
+            params.append(min_timestamp)
+        if after_id is not None:
+            query += " AND frames.id > ? ORDER BY frames.id"
+            params.append(after_id)
+        else:
+            query += " ORDER BY frames.id DESC"
+        if max_frames is not None:
+            query += " LIMIT ?"
+            params.append(max_frames)
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute('''
-                    INSERT INTO video_chunks (path, source, source_id)
-                    VALUES (?, ?, ?)
-                ''', (path, source, source_id,))
-                
-                # Get the last inserted frame_id
-                video_chunk_id = cursor.lastrowid
-                conn.commit()
-                print(f"Video Chunk added successfully with video_chunk_id: {video_chunk_id}")
-            except sqlite3.IntegrityError:
-                # Frame already exists, get the existing frame_id
-                cursor.execute('''
-                    SELECT id FROM video_chunks
-                    WHERE path = ?
-                ''', (path))
-                video_chunk_id= cursor.fetchone()[0]
-                print(f"Video Chunk already exists with video_chunk_id: {video_chunk_id}")
-            
-            return video_chunk_id
+            return [r[0] for r in conn.execute(query, params).fetchall()]
 
-    @with_lock
-    def insert_ocr_results(self, frame_id, ocr_results):
-        """Insert ocr results into ocr_results table."""
+    def materialize_frame_text(self, frame_ids=None, max_frames=None, batch_size=1000):
+        """Fills frame_text with the cleaned OCR text (utils.ocr_results_to_str) of frames whose
+        text is missing or was cleaned with an older utils.TEXT_CLEANING_VERSION.
+        Args:
+            frame_ids (list[int]): only consider these frames. Defaults to all frames with OCR results.
+            max_frames (int): materialize at most this many frames, most recent first
+            batch_size (int): frames cleaned and written per transaction
+        Returns:
+            number of frames materialized
+        """
+        stale_frame_ids = self.get_stale_frame_text_ids(frame_ids=frame_ids, max_frames=max_frames)
+
+        for i in range(0, len(stale_frame_ids), batch_size):
+            ocr_results_df = self.get_frames_with_ocr(frame_ids=stale_frame_ids[i:i + batch_size])
+            frame_texts = list()
+            for frame_id, frame_ocr_results in ocr_results_df.groupby('frame_id', sort=False):
+                text = utils.ocr_results_to_str(frame_ocr_results)
+                frame_texts.append((int(frame_id), text, len(text), utils.hash_text(text), utils.TEXT_CLEANING_VERSION))
+            self._insert_frame_texts(frame_texts)
+        if frame_ids is None and len(stale_frame_ids) > 0:
+            print(f"Materialized cleaned text of {len(stale_frame_ids)} frames.")
+        return len(stale_frame_ids)
+
+    @timed
+    def get_frame_texts(self, frame_ids):
+        """Returns a DataFrame of frame_id, text, text_length and text_hash with the cleaned OCR
+        text of frame_ids, materializing any that are missing or stale. Frames without OCR
+        results are left out."""
+        frame_ids = [int(i) for i in frame_ids]
+        self.materialize_frame_text(frame_ids=frame_ids)
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            # Insert multiple OCR results
-            cursor.executemany('''
-                INSERT INTO ocr_results (frame_id, x, y, w, h, text, conf, block_num, line_num)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', [(frame_id, x, y, w, h, text, conf, block_num, line_num) for x, y, w, h, text, conf, block_num, line_num in ocr_results])
-            
-            conn.commit()
+            query = f"SELECT frame_id, text, text_length, text_hash FROM frame_text WHERE frame_id IN ({','.join(['?'] * len(frame_ids))})"
+            return pd.read_sql_query(query, conn, params=frame_ids)
 
     def get_all_applications(self):
         """Returns all applications in the frames table."""
@@ -230,6 +949,7 @@ class HindsightDB:
             df = pd.read_sql_query(query, conn)
             return set(df['application'])
         
+    @timed
     def get_screenshots(self, frame_ids=None, impute_applications=False, application_alias=True):
         """Select frames with associated OCR results."""
         with self.get_connection() as conn:
@@ -259,6 +979,7 @@ class HindsightDB:
                 df['application'] = df['application'].fillna(df['application_org'])
             return df
 
+    @timed
     def get_frames(self, frame_ids=None, impute_applications=False, application_alias=True, applications=None):
         """Select frames with associated OCR results."""
         with self.get_connection() as conn:
@@ -291,63 +1012,181 @@ class HindsightDB:
                 df['application'] = df['application'].fillna(df['application_org'])
             return df
         
+    def get_first_frame_id_since(self, min_timestamp):
+        """Returns the smallest id of the frames captured at or after min_timestamp (UTC
+        milliseconds), or None if there are none."""
+        with self.get_connection() as conn:
+            # Without INDEXED BY SQLite looks for the minimum by walking frames in id order
+            return conn.execute("SELECT MIN(id) FROM frames INDEXED BY idx_frames_timestamp WHERE timestamp >= ?",
+                                (int(min_timestamp),)).fetchone()[0]
+
+    def get_frame_paths(self, application, start_ts, end_ts):
+        """Returns a DataFrame of id, path and video_chunk_id of the frames of application with
+        start_ts <= timestamp < end_ts (UTC milliseconds)."""
+        with self.get_connection() as conn:
+            query = '''
+                SELECT id, path, video_chunk_id FROM frames
+                WHERE application = ? AND timestamp >= ? AND timestamp < ?
+            '''
+            return pd.read_sql_query(query, conn, params=(application, int(start_ts), int(end_ts)))
+
+    def iter_frames(self, start_ts=None, end_ts=None, columns=None, page_size=10000, applications=None,
+                    application_alias=False):
+        """Yields DataFrames of frames ordered by (timestamp, id), at most page_size rows at a time.
+        Uses keyset pagination on (timestamp, id) so memory stays bounded for the whole history.
+        Args:
+            start_ts (int): only frames with timestamp >= start_ts (UTC milliseconds)
+            end_ts (int): only frames with timestamp <= end_ts (UTC milliseconds)
+            columns (list[str]): frames columns to select, or video_chunk_path. id and timestamp
+                are always included. Defaults to all frames columns.
+            page_size (int): maximum number of rows per DataFrame
+            applications (list[str]): only include these application identifiers
+            application_alias (bool): replace application identifiers with their alias, keeping
+                the identifier in application_org
+        """
+        columns = list(FRAME_COLUMNS) if columns is None else list(columns)
+        if application_alias and "application" not in columns:
+            columns.append("application")
+        invalid_columns = set(columns) - set(FRAME_COLUMNS) - {"video_chunk_path"}
+        if invalid_columns:
+            raise ValueError(f"Invalid frames columns {invalid_columns}")
+
+        select_columns = ["frames.id", "frames.timestamp"]
+        select_columns += [f"frames.{c}" for c in columns if c in FRAME_COLUMNS and c not in {"id", "timestamp"}]
+        query = f"SELECT {', '.join(select_columns)}"
+        if "video_chunk_path" in columns:
+            query += ", video_chunks.path AS video_chunk_path FROM frames LEFT JOIN video_chunks ON frames.video_chunk_id = video_chunks.id"
+        else:
+            query += " FROM frames"
+
+        # Keyset condition (timestamp, id) > (last_timestamp, last_id), written so the
+        # timestamp index bounds the scan
+        conditions = ["frames.timestamp >= ?", "(frames.timestamp > ? OR frames.id > ?)"]
+        params = list()
+        if start_ts is not None:
+            conditions.append("frames.timestamp >= ?")
+            params.append(int(start_ts))
+        if end_ts is not None:
+            conditions.append("frames.timestamp <= ?")
+            params.append(int(end_ts))
+        if applications:
+            applications = list(applications)
+            conditions.append(f"frames.application IN ({','.join(['?'] * len(applications))})")
+            params.extend(applications)
+        query += f" WHERE {' AND '.join(conditions)} ORDER BY frames.timestamp, frames.id LIMIT ?"
+
+        id_to_alias = utils.get_identifiers_to_alias() if application_alias else None
+        last_timestamp, last_id = -2**63, -2**63
+        while True:
+            with self.get_connection() as conn:
+                df = pd.read_sql_query(query, conn, params=[last_timestamp, last_timestamp, last_id] + params + [page_size])
+            if len(df) == 0:
+                return
+            last_timestamp, last_id = int(df['timestamp'].iloc[-1]), int(df['id'].iloc[-1])
+
+            if application_alias:
+                df['application_org'] = df['application'].copy()
+                df['application'] = df['application'].map(id_to_alias).fillna(df['application_org'])
+            yield df
+            if len(df) < page_size:
+                return
+
     def get_video_chunks(self):
         with self.get_connection() as conn:
             query = '''SELECT * FROM video_chunks'''
             df = pd.read_sql(query, conn)
             return df
         
-    @with_lock
-    def update_video_chunk_info(self, video_chunk_id, frame_ids):
+    @writer
+    def update_video_chunk_info(self, cursor, video_chunk_id, frame_ids, start_offset=0):
         """
         Updates the video_chunk_id and video_chunk_offset for a frame_id.
         
         Args:
             video_chunk_id (int): The video chunk ID to assign.
             frame_ids (list[int]): List of frame IDs in order of video compression.
+            start_offset (int): Offset in the video chunk of the first of frame_ids, for updating
+                a chunk's frames in batches.
+        Raises sqlite3.Error if the update fails, after rolling it back.
         """
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            try:
-                # Prepare the data for the executemany function
-                data_to_update = [(video_chunk_id, i, frame_id) for i, frame_id in enumerate(frame_ids)]
-                
-                cursor.executemany('''
-                    UPDATE frames
-                    SET video_chunk_id = ?, video_chunk_offset = ?
-                    WHERE id = ?
-                ''', data_to_update)
-                conn.commit()
-                print(f"Updated video_chunk_id and video_chunk_offset for {len(frame_ids)} frames.")
-            except sqlite3.Error as e:
-                print(f"An error occurred while updating video_chunk_id and video_chunk_offset: {e}")
+        # Prepare the data for the executemany function
+        data_to_update = [(video_chunk_id, start_offset + i, frame_id) for i, frame_id in enumerate(frame_ids)]
+
+        cursor.executemany('''
+            UPDATE frames
+            SET video_chunk_id = ?, video_chunk_offset = ?
+            WHERE id = ?
+        ''', data_to_update)
+        self._mark_changed("frames")
+        print(f"Updated video_chunk_id and video_chunk_offset for {len(frame_ids)} frames.")
     
+    def _read_ocr_boxes(self, conn, frame_ids=None):
+        """Returns the blob-stored OCR results of frame_ids (all if None) in the ocr_results shape."""
+        query = "SELECT frame_id, boxes FROM ocr_boxes"
+        if frame_ids is not None:
+            query += f" WHERE frame_id IN ({','.join(['?'] * len(frame_ids))})"
+        rows = conn.execute(query, tuple(frame_ids) if frame_ids is not None else ()).fetchall()
+        df = ocr_blobs_to_df([r[0] for r in rows], [r[1] for r in rows])
+        df.insert(0, 'id', None) # Boxes in a blob have no row id
+        return df
+
+    @timed
     def get_ocr_results(self, frame_id=None):
         """Gets ocr results for a single frame_id."""
         with self.get_connection() as conn:
             if frame_id is None:
                 query = '''SELECT * FROM ocr_results'''
             else:
-                query = f'''SELECT * FROM ocr_results WHERE frame_id = {frame_id}'''
+                query = '''SELECT * FROM ocr_results WHERE frame_id = ?'''
             # Use pandas to read the SQL query result into a DataFrame
-            df = pd.read_sql_query(query, conn)
+            df = pd.read_sql_query(query, conn, params=(frame_id,) if frame_id is not None else None)
+            blob_df = self._read_ocr_boxes(conn, frame_ids=[frame_id] if frame_id is not None else None)
+        if len(blob_df) == 0:
             return df
+        if len(df) == 0:
+            return blob_df
+        return pd.concat([df, blob_df], ignore_index=True)
         
-    def get_frames_without_ocr(self):
-        """Select frames that have not been linked to any OCR results."""
+    @timed
+    def get_frames_without_ocr(self, frame_ids=None, after_id=None, min_timestamp=None, limit=None, exclude_job_type=None):
+        """Select frames that have not been linked to any OCR results, optionally only those captured
+        at or after min_timestamp (UTC milliseconds) and only those without a pending or running job
+        of exclude_job_type. With after_id, only frames with a larger id are selected, at most limit
+        of them in id order (to scan with a cursor)."""
         with self.get_connection() as conn:
             # Query to get the frames that do not have associated OCR results
             query = '''
                 SELECT f.*
                 FROM frames f
-                LEFT JOIN ocr_results o ON f.id = o.frame_id
-                WHERE o.id IS NULL
+                WHERE NOT EXISTS (SELECT 1 FROM ocr_results o WHERE o.frame_id = f.id)
+                    AND NOT EXISTS (SELECT 1 FROM ocr_boxes b WHERE b.frame_id = f.id)
             '''
+            params = list()
+            if frame_ids is not None:
+                params = [int(i) for i in frame_ids]
+                query += f" AND f.id IN ({','.join(['?'] * len(params))})"
+            if min_timestamp is not None:
+                query += " AND f.timestamp >= ?"
+                params.append(min_timestamp)
+            if exclude_job_type is not None:
+                # In the same query so a job finishing meanwhile cannot hand its frame to the caller
+                query += ''' AND f.id NOT IN (
+                    SELECT json_extract(payload, '$.frame_id') FROM jobs
+                    WHERE job_type = ? AND status IN ('pending', 'running') AND json_extract(payload, '$.frame_id') IS NOT NULL
+                )'''
+                params.append(exclude_job_type)
+            if after_id is not None:
+                query += " AND f.id > ? ORDER BY f.id"
+                params.append(after_id)
+                if limit is not None:
+                    query += " LIMIT ?"
+                    params.append(limit)
 
             # Use pandas to read the SQL query result into a DataFrame
-            df = pd.read_sql_query(query, conn)
+            df = pd.read_sql_query(query, conn, params=params)
             return df
 
+    @timed
     def get_frames_with_ocr(self, frame_ids=None, impute_applications=False):
         """Select frames with associated OCR results."""
         if frame_ids is not None and len(frame_ids) == 0:
@@ -365,79 +1204,115 @@ class HindsightDB:
             
             # Use pandas to read the SQL query result into a DataFrame
             df = pd.read_sql_query(query, conn, params=tuple(frame_ids) if frame_ids else None)
-            if impute_applications:
-                df = utils.impute_applications(df)
-            return df
+
+            # Frames with blob-stored OCR results
+            query = '''
+                SELECT frames.id as frame_id, frames.timestamp, frames.path, frames.application, ocr_boxes.boxes
+                FROM frames
+                INNER JOIN ocr_boxes ON frames.id = ocr_boxes.frame_id
+            '''
+            if frame_ids:
+                query += f" WHERE frames.id IN ({placeholders})"
+            blob_frames = conn.execute(query, tuple(frame_ids) if frame_ids else ()).fetchall()
+
+        if blob_frames:
+            blob_frame_ids, timestamps, paths, applications, blobs = zip(*blob_frames)
+            frames_df = pd.DataFrame({"frame_id": blob_frame_ids, "timestamp": timestamps, "path": paths, "application": applications})
+            blob_df = frames_df.merge(ocr_blobs_to_df(blob_frame_ids, blobs), on="frame_id")[df.columns]
+            df = blob_df if len(df) == 0 else pd.concat([df, blob_df], ignore_index=True)
+        if impute_applications:
+            df = utils.impute_applications(df)
+        return df
     
+    @timed
     def search(self, text=None, start_date=None, end_date=None, apps=None, n_seconds=None, impute_applications=False):
         """Search for frames with OCR results containing the specified text.
         Args:
-            text (str): text to search for
-            start_date (pd.datetime): search all frames after this time
-            end_date (pd.datetime): search all frames before this time
+            text (str): text to search for. Words match whole tokens, word* matches a prefix
+                and "quoted text" matches a phrase (see to_fts_query)
+            start_date (pd.datetime | int): search all frames after this time (naive datetimes are
+                local time, ints are UTC milliseconds)
+            end_date (pd.datetime | int): search all frames before this time
             app (list | set): only include these app identifiers
-            n_seconds (int): only return 1 result within a n_seconds time period
+            n_seconds (int): only return the most recent result within each n_seconds time bucket
         Returns:
-            pd.Dataframe containing search results
-        Bonus:
-            Date and app filtering could be done in query to optimize but perfomance isn't currently
-            an issue so leaning towards simplicity.
+            pd.Dataframe containing search results. When text is provided they are ordered by
+            bm25 relevance (rank column, lower is better), otherwise by most recent.
+            cleaned_text holds the frame's materialized frame_text (None if not yet materialized).
         """
+        fts_query = to_fts_query(text) if text else ""
+        start_timestamp = utils.to_utc_milliseconds(start_date) if start_date is not None else None
+        end_timestamp = utils.to_utc_milliseconds(end_date) if end_date is not None else None
+
+        time_conditions = list()
+        time_params = list()
+        if start_timestamp is not None:
+            time_conditions.append("frames.timestamp >= ?")
+            time_params.append(start_timestamp)
+        if end_timestamp is not None:
+            time_conditions.append("frames.timestamp <= ?")
+            time_params.append(end_timestamp)
+
+        conditions = list(time_conditions)
+        params = list(time_params)
+        # Imputed applications are only known after loading so filter those in pandas
+        if apps and not impute_applications:
+            apps = list(apps)
+            conditions.append(f"frames.application IN ({','.join(['?'] * len(apps))})")
+            params.extend(apps)
+
         with self.get_connection() as conn:
-            if text is None:
-                query = '''
-                SELECT frames.id, frames.path, frames.timestamp, frames.application, GROUP_CONCAT(ocr_results.text, ' ') AS combined_text
-                FROM frames
-                INNER JOIN ocr_results ON frames.id = ocr_results.frame_id
-                GROUP BY frames.id
+            if fts_query:
+                if time_conditions:
+                    # Bound the full-text scan to the ids of frames in the date range
+                    cursor = conn.cursor()
+                    cursor.execute(f"SELECT MIN(id), MAX(id) FROM frames WHERE {' AND '.join(time_conditions)}", time_params)
+                    min_id, max_id = cursor.fetchone()
+                    conditions.append("ocr_text_fts.rowid BETWEEN ? AND ?")
+                    params.extend([min_id if min_id is not None else 0, max_id if max_id is not None else -1])
+
+                # Full-text match on the combined OCR text of each frame
+                query = f'''
+                    SELECT frames.id, frames.path, frames.timestamp, frames.application, ocr_text_fts.text AS combined_text,
+                        frame_text.text AS cleaned_text, bm25(ocr_text_fts) AS rank
+                    FROM ocr_text_fts
+                    INNER JOIN frames ON frames.id = ocr_text_fts.rowid
+                    LEFT JOIN frame_text ON frame_text.frame_id = frames.id
+                    WHERE {' AND '.join(["ocr_text_fts MATCH ?"] + conditions)}
                 '''
-                df = pd.read_sql_query(query, conn)
+                params = [fts_query] + params
             else:
-                # Query to get the combined OCR text for each frame_id
                 query = '''
-                    SELECT frames.id, frames.path, frames.timestamp, frames.application, GROUP_CONCAT(ocr_results.text, ' ') AS combined_text
-                    FROM frames
-                    INNER JOIN ocr_results ON frames.id = ocr_results.frame_id
-                    GROUP BY frames.id
-                    HAVING combined_text LIKE ?
+                SELECT frames.id, frames.path, frames.timestamp, frames.application, ocr_text_fts.text AS combined_text,
+                    frame_text.text AS cleaned_text
+                FROM frames
+                INNER JOIN ocr_text_fts ON ocr_text_fts.rowid = frames.id
+                LEFT JOIN frame_text ON frame_text.frame_id = frames.id
                 '''
-                df = pd.read_sql_query(query, conn, params=('%' + text + '%',))
-
-            if impute_applications:
-                df = utils.impute_applications(df)
+                if conditions:
+                    query += f" WHERE {' AND '.join(conditions)}"
+            df = pd.read_sql_query(query, conn, params=params)
 
+        if impute_applications:
+            df = utils.impute_applications(df)
             if apps:
                 df = df.loc[df['application'].isin(apps)]
 
-            # Convert timestamp to datetime
-            df['datetime_utc'] = pd.to_datetime(df['timestamp'] / 1000, unit='s', utc=True)
-            df['datetime_local'] = df['datetime_utc'].apply(lambda x: x.replace(tzinfo=video_timezone).astimezone(local_timezone))
-            if start_date:
-                df = df.loc[df['datetime_local'] >= start_date]
-
-            if end_date:
-                df = df.loc[df['datetime_local'] <= end_date]
+        df = utils.add_datetimes(df)
+        df = df.sort_values(by='timestamp', ascending=False)
 
-            # Sort by timestamp
-            df = df.sort_values(by='datetime_utc', ascending=False)
+        if n_seconds is not None:
+            # Keep the most recent frame in each n_seconds bucket
+            buckets = df['timestamp'].to_numpy() // (n_seconds * 1000)
+            _, first_in_bucket = np.unique(buckets, return_index=True)
+            df = df.iloc[np.sort(first_in_bucket)]
 
-            if n_seconds is None:
-                return df
-            
-            # Select the most recent frame per N minutes
-            result = []
-            last_time = None
-            for _, row in df.iterrows():
-                if last_time is None or row['datetime_utc'] <= last_time - timedelta(seconds=n_seconds):
-                    result.append(row)
-                    last_time = row['datetime_utc']
-
-            # Convert result to DataFrame
-            result_df = pd.DataFrame(result)
-            
-            return result_df
+        if fts_query:
+            df = df.sort_values(by='rank', ascending=True)
+        return df
         
-    def insert_query(self, query, context_start_timestamp=None, context_end_timestamp=None, context_applications=None):
+    @writer
+    def insert_query(self, cursor, query, context_start_timestamp=None, context_end_timestamp=None, context_applications=None):
         """Inserts query into queries table
         Args:
             query (str): LLM query
@@ -445,37 +1320,43 @@ class HindsightDB:
             context_end_timestamp (int): the latest screenshot timestamp to use for context
             context_applications (list[str]): a list of applications to use as potential context. If None all will be used."""
         query_timestamp = int(time.time() * 1000) # UTC in milliseconds
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO queries (query, timestamp, context_start_timestamp, context_end_timestamp, context_applications)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (query, query_timestamp, context_start_timestamp, context_end_timestamp, context_applications))
-            
-            # Get the last inserted frame_id
-            query_id = cursor.lastrowid
-            conn.commit()
-            print(f"Query added successfully with query_id: {query_id}")
-            return query_id
+        cursor.execute('''
+            INSERT INTO queries (query, timestamp, context_start_timestamp, context_end_timestamp, context_applications)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (query, query_timestamp, context_start_timestamp, context_end_timestamp, context_applications))
+        
+        # Get the last inserted frame_id
+        query_id = cursor.lastrowid
+        self._mark_changed("queries")
+        print(f"Query added successfully with query_id: {query_id}")
+        return query_id
         
-    def insert_query_result(self, query_id, result, source_frame_ids):
+    @writer
+    def insert_query_result(self, cursor, query_id, result, source_frame_ids):
         """Inserts the result of a query into the queries table"""
         # Convert source_frame_ids from a list or set to a comma-separated string
         finished_timestamp = int(time.time() * 1000) # UTC in milliseconds
         source_frame_ids_str = ','.join(map(str, source_frame_ids))
         
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute('''
-                    UPDATE queries SET result = ?, source_frame_ids = ?, finished_timestamp = ?
-                    WHERE id = ?
-                ''', (result, source_frame_ids_str, finished_timestamp, query_id))
-                conn.commit()
-                print(f"Query result added successfully for query_id: {query_id}")
-            except sqlite3.Error as e:
-                print(f"An error occurred: {e}")
+        try:
+            cursor.execute('''
+                UPDATE queries SET result = ?, source_frame_ids = ?, finished_timestamp = ?
+                WHERE id = ?
+            ''', (result, source_frame_ids_str, finished_timestamp, query_id))
+            self._mark_changed("queries")
+            print(f"Query result added successfully for query_id: {query_id}")
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e}")
+
 
+    def get_recent_active_queries(self, limit=6):
+        """Returns the query and result of the limit most recent active queries, newest first."""
+        with self.get_connection() as conn:
+            rows = conn.execute('''
+                SELECT query, result FROM queries WHERE active = true
+                ORDER BY timestamp DESC LIMIT ?
+            ''', (limit,)).fetchall()
+        return [{"query": query, "result": "Query Running..." if result is None else result} for query, result in rows]
 
     def get_active_queries(self):
         """Returns all active queries. This inlcudes for completed and currently running queries."""
@@ -486,6 +1367,7 @@ class HindsightDB:
             df['result'] = df['result'].fillna("Query Running...")
             return df
         
+    @timed
     def get_unprocessed_queries(self):
         """Returns all queries without finished_timestamp."""
         with self.get_connection() as conn:
@@ -495,41 +1377,187 @@ class HindsightDB:
             df = df.replace({np.nan : None})
             return df
         
-    @with_lock
-    def update_chromadb_processed(self, frame_ids, value=True):
+    @writer
+    def update_chromadb_processed(self, cursor, frame_ids, value=True):
         """Updates the chromadb_processed status for a list of frame_ids."""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            # Prepare the data for the executemany function
-            data_to_update = [(value, frame_id) for frame_id in frame_ids]
-            try:
-                cursor.executemany('''
-                    UPDATE frames
-                    SET chromadb_processed = ?
-                    WHERE id = ?
-                ''', data_to_update)
-                conn.commit()
-                print(f"Updated chromadb_processed for {len(frame_ids)} frames.")
-            except sqlite3.Error as e:
-                print(f"An error occurred while updating chromadb_processed: {e}")
-
-    def get_non_chromadb_processed_frames_with_ocr(self, frame_ids=None, impute_applications=False):
-        """Select frames that have not been processed but chromadb but have associated OCR results."""
+        # Prepare the data for the executemany function
+        data_to_update = [(value, frame_id) for frame_id in frame_ids]
+        try:
+            cursor.executemany('''
+                UPDATE frames
+                SET chromadb_processed = ?
+                WHERE id = ?
+            ''', data_to_update)
+            self._mark_changed("frames")
+            print(f"Updated chromadb_processed for {len(frame_ids)} frames.")
+        except sqlite3.Error as e:
+            print(f"An error occurred while updating chromadb_processed: {e}")
+
+    @timed
+    def get_non_chromadb_processed_frames_with_ocr(self, frame_ids=None, impute_applications=False, after_id=None,
+                                                   min_timestamp=None, limit=None):
+        """Select frames that have not been processed but chromadb but have associated OCR results,
+        optionally only those captured at or after min_timestamp (UTC milliseconds). With after_id,
+        only frames with a larger id are selected, at most limit of them in id order (to scan with a
+        cursor)."""
         with self.get_connection() as conn:
             # Query to get the frames with OCR results
             query = '''
-                SELECT DISTINCT frames.*
+                SELECT frames.*
                 FROM frames
-                INNER JOIN ocr_results ON frames.id = ocr_results.frame_id
                 WHERE NOT frames.chromadb_processed
+                    AND (EXISTS (SELECT 1 FROM ocr_results WHERE ocr_results.frame_id = frames.id)
+                         OR EXISTS (SELECT 1 FROM ocr_boxes WHERE ocr_boxes.frame_id = frames.id))
             '''
+            params = list()
+            if min_timestamp is not None:
+                query += " AND frames.timestamp >= ?"
+                params.append(min_timestamp)
+            if after_id is not None:
+                query += " AND frames.id > ? ORDER BY frames.id"
+                params.append(after_id)
+                if limit is not None:
+                    query += " LIMIT ?"
+                    params.append(limit)
             
             # Use pandas to read the SQL query result into a DataFrame
-            df = pd.read_sql_query(query, conn)
+            df = pd.read_sql_query(query, conn, params=params)
             if impute_applications:
                 df = utils.impute_applications(df)
             return df
         
+    @writer
+    def insert_uploaded_frame(self, cursor, timestamp, path, application):
+        """Inserts an uploaded screenshot's frame and queues an ingest_frame job for it in the
+        same transaction. A frame uploaded again (e.g. a client retrying after a timeout) keeps its
+        pending or running job and gets no job once it has OCR results. Returns (frame_id, job_id),
+        with job_id None if no job was needed."""
+        cursor.execute("SELECT id FROM frames WHERE timestamp = ? AND path = ?", (timestamp, path))
+        row = cursor.fetchone()
+        if row is None:
+            frame_id = self.insert_frame(timestamp, path, application)
+        else:
+            frame_id = row[0]
+            cursor.execute('''
+                SELECT id FROM jobs
+                WHERE job_type = 'ingest_frame' AND status IN ('pending', 'running') AND json_extract(payload, '$.frame_id') = ?
+                ORDER BY id LIMIT 1
+            ''', (frame_id,))
+            job = cursor.fetchone()
+            if job is not None:
+                return frame_id, job[0]
+            cursor.execute('''
+                SELECT EXISTS (SELECT 1 FROM ocr_results WHERE frame_id = ?)
+                    OR EXISTS (SELECT 1 FROM ocr_boxes WHERE frame_id = ?)
+            ''', (frame_id, frame_id))
+            if cursor.fetchone()[0]:
+                return frame_id, None
+        job_id = self.enqueue_job("ingest_frame", {"frame_id": frame_id, "path": path})
+        return frame_id, job_id
+
+    @writer
+    def insert_uploaded_frames(self, cursor, frames):
+        """insert_uploaded_frame for many (timestamp, path, application) frames in a single
+        transaction. Returns a list of (frame_id, job_id or None) in the same order."""
+        return [self.insert_uploaded_frame(timestamp, path, application) for timestamp, path, application in frames]
+
+    @writer
+    def enqueue_job(self, cursor, job_type, payload=None):
+        """Adds a pending job to the jobs table. payload must be JSON serializable. Returns the job id."""
+        cursor.execute('''
+            INSERT INTO jobs (job_type, payload, created_timestamp)
+            VALUES (?, ?, ?)
+        ''', (job_type, json.dumps(payload), int(time.time() * 1000)))
+        self._mark_changed("jobs")
+        return cursor.lastrowid
+
+    @writer
+    def claim_jobs(self, cursor, job_type, limit=100):
+        """Marks up to limit pending jobs of job_type as running, oldest first, and returns them
+        as dicts with a decoded payload."""
+        cursor.execute('''
+            SELECT id, payload FROM jobs
+            WHERE job_type = ? AND status = 'pending'
+            ORDER BY id LIMIT ?
+        ''', (job_type, limit))
+        jobs = [{"id": job_id, "job_type": job_type, "payload": json.loads(payload)} for job_id, payload in cursor.fetchall()]
+        cursor.executemany("UPDATE jobs SET status = 'running', started_timestamp = ? WHERE id = ?",
+                           [(int(time.time() * 1000), job['id']) for job in jobs])
+        return jobs
+
+    @writer
+    def update_job_progress(self, cursor, job_id, progress):
+        cursor.execute("UPDATE jobs SET progress = ? WHERE id = ?", (progress, job_id))
+
+    @writer
+    def complete_jobs(self, cursor, job_ids):
+        cursor.executemany("UPDATE jobs SET status = 'done', progress = 1, finished_timestamp = ? WHERE id = ?",
+                           [(int(time.time() * 1000), job_id) for job_id in job_ids])
+
+    @writer
+    def fail_jobs(self, cursor, job_ids, error):
+        cursor.executemany("UPDATE jobs SET status = 'failed', error = ?, finished_timestamp = ? WHERE id = ?",
+                           [(str(error), int(time.time() * 1000), job_id) for job_id in job_ids])
+
+    @writer
+    def requeue_running_jobs(self, cursor, job_type):
+        """Returns jobs left running by a consumer that exited (e.g. a crashed backend) to pending."""
+        cursor.execute("UPDATE jobs SET status = 'pending', started_timestamp = NULL WHERE job_type = ? AND status = 'running'", (job_type,))
+        if cursor.rowcount > 0:
+            self._mark_changed("jobs")
+            print(f"Requeued {cursor.rowcount} interrupted {job_type} jobs.")
+
+    @writer
+    def delete_done_jobs(self, cursor, max_age_days):
+        """Deletes done jobs that finished more than max_age_days ago. Returns the number deleted."""
+        cutoff = int((time.time() - max_age_days * 24 * 60 * 60) * 1000)
+        cursor.execute("DELETE FROM jobs WHERE status = 'done' AND finished_timestamp < ?", (cutoff,))
+        if cursor.rowcount > 0:
+            print(f"Deleted {cursor.rowcount} jobs finished more than {max_age_days} days ago.")
+        return cursor.rowcount
+
+    def get_job(self, job_id):
+        """Returns a job as a dict (payload decoded) or None if it does not exist."""
+        with self.get_connection() as conn:
+            cursor = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            job = dict(zip([c[0] for c in cursor.description], row))
+            job['payload'] = json.loads(job['payload'])
+            return job
+
+    def get_backlog_counts(self):
+        """Returns the number of uploaded frames awaiting OCR (pending ingest_frame jobs), frames
+        awaiting embedding, unprocessed queries and pending jobs by type. Polled by admission
+        control and the metrics gauges, so every count is served by an index (see
+        count_frames_without_ocr for the full count of frames awaiting OCR)."""
+        with self.get_connection() as conn:
+            # The backend does not embed frames ingested from rem
+            frames_awaiting_embedding = conn.execute('''
+                SELECT COUNT(*) FROM frames WHERE NOT chromadb_processed AND source IS NOT 'rem'
+            ''').fetchone()[0]
+            unprocessed_queries = conn.execute("SELECT COUNT(*) FROM queries WHERE finished_timestamp IS NULL").fetchone()[0]
+            pending_jobs = dict(conn.execute("SELECT job_type, COUNT(*) FROM jobs WHERE status = 'pending' GROUP BY job_type").fetchall())
+        return {"frames_awaiting_ocr": pending_jobs.get("ingest_frame", 0), "frames_awaiting_embedding": frames_awaiting_embedding,
+                "unprocessed_queries": unprocessed_queries, "pending_jobs": pending_jobs}
+
+    def count_frames_without_ocr(self):
+        """Returns the number of screenshot frames without OCR results, including those not queued
+        by an upload. Probes the OCR tables for every frame, so it is only for diagnostics
+        (python db.py --backlog)."""
+        with self.get_connection() as conn:
+            return conn.execute('''
+                SELECT COUNT(*) FROM frames f
+                WHERE f.path != 'None'
+                    AND NOT EXISTS (SELECT 1 FROM ocr_results o WHERE o.frame_id = f.id)
+                    AND NOT EXISTS (SELECT 1 FROM ocr_boxes b WHERE b.frame_id = f.id)
+            ''').fetchone()[0]
+
+    def get_pending_job_count(self, job_type):
+        with self.get_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE job_type = ? AND status = 'pending'", (job_type,)).fetchone()[0]
+
     def get_last_id(self, source=None, table="frames"):
         """Returns the largest id from a given source and table"""
         with self.get_connection() as conn:
@@ -555,19 +1583,19 @@ class HindsightDB:
             max_timestamp = cursor.fetchone()[0]
             return max_timestamp
     
-    @with_lock
-    def insert_annotations(self, annotations):
-        """Insert annotations into annotations table."""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.executemany('''
-                INSERT INTO annotations (timestamp, text)
-                VALUES (?, ?)
-            ''', [(a['timestamp'], a['text']) for a in annotations])
-            
-            conn.commit()
-            
-            print(f"{len(annotations)} annotations added successfully.")
+    @writer
+    def insert_annotations(self, cursor, annotations):
+        """Insert annotations into annotations table, ignoring ones already recorded (same
+        timestamp). Returns the number of new annotations."""
+        cursor.executemany('''
+            INSERT OR IGNORE INTO annotations (timestamp, text)
+            VALUES (?, ?)
+        ''', [(a['timestamp'], a['text']) for a in annotations])
+        num_inserted = max(cursor.rowcount, 0)
+        if num_inserted > 0:
+            self._mark_changed("annotations")
+        print(f"{num_inserted} annotations added successfully ({len(annotations) - num_inserted} already existed).")
+        return num_inserted
 
     def get_annotations(self):
         """Returns all annotations."""
@@ -577,19 +1605,19 @@ class HindsightDB:
             df = df.dropna()
             return df
 
-    @with_lock
-    def insert_locations(self, locations):
-        """Insert locations into locations table."""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.executemany('''
-                INSERT INTO locations (latitude, longitude, timestamp)
-                VALUES (?, ?, ?)
-            ''', [(l['latitude'], l['longitude'], l['timestamp']) for l in locations])
-            
-            conn.commit()
-            
-            print(f"{len(locations)} locations added successfully.")
+    @writer
+    def insert_locations(self, cursor, locations):
+        """Insert locations into locations table, ignoring ones already recorded (same
+        timestamp). Returns the number of new locations."""
+        cursor.executemany('''
+            INSERT OR IGNORE INTO locations (latitude, longitude, timestamp)
+            VALUES (?, ?, ?)
+        ''', [(l['latitude'], l['longitude'], l['timestamp']) for l in locations])
+        num_inserted = max(cursor.rowcount, 0)
+        if num_inserted > 0:
+            self._mark_changed("locations")
+        print(f"{num_inserted} locations added successfully ({len(locations) - num_inserted} already existed).")
+        return num_inserted
 
     def get_locations(self):
         """Returns all locations."""
@@ -598,17 +1626,13 @@ class HindsightDB:
             df = pd.read_sql_query(query, conn)
             return df
         
-    @with_lock
-    def add_label(self, frame_id, label, value=None):
+    @writer
+    def add_label(self, cursor, frame_id, label, value=None):
         """Adds a label to the labels table for a given frame."""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(f'''INSERT INTO labels (frame_id, label, value)
-            VALUES (?, ?, ?)''', (frame_id, label, value))
-            conn.commit()
-            print(f"Successfully added label {label}:{value} for {frame_id}")
+        cursor.execute(f'''INSERT INTO labels (frame_id, label, value)
+        VALUES (?, ?, ?)''', (frame_id, label, value))
+        print(f"Successfully added label {label}:{value} for {frame_id}")
 
-    @with_lock
     def get_frames_with_label(self, label, value=None):
         """Returns all frame_ids with the associated label."""
         with self.get_connection() as conn:
@@ -684,6 +1708,7 @@ class HindsightDB:
         new_db_conn.commit()
         new_db_conn.close()
 
+    @timed
     def convert_source_ids_to_hindsight_ids(self, table: str, source: str, source_ids: list[int]) -> list[int]:
         """
         Converts a list of source_ids to hindsight database ids in the same order.
@@ -701,23 +1726,48 @@ class HindsightDB:
 
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            # Convert list to tuple format for SQL query
-            placeholders = ','.join(['?'] * len(source_ids))
-            query = f"""
-                SELECT source_id, id
-                FROM {table}
-                WHERE source_id IN ({placeholders}) AND source = ?
-            """
-            
-            # Execute the query and fetch results
-            cursor.execute(query, (*source_ids, source))
-            rows = cursor.fetchall()
 
-            # Convert results into a dictionary {source_id: hindsight_id}
-            source_to_hindsight_map = {source_id: hindsight_id for source_id, hindsight_id in rows}
+            # Look up in batches to keep the IN (...) lists bounded
+            source_to_hindsight_map = dict()
+            for i in range(0, len(source_ids), 500):
+                batch = source_ids[i:i + 500]
+                placeholders = ','.join(['?'] * len(batch))
+                query = f"""
+                    SELECT source_id, id
+                    FROM {table}
+                    WHERE source_id IN ({placeholders}) AND source = ?
+                """
+                cursor.execute(query, (*batch, source))
+                # Convert results into a dictionary {source_id: hindsight_id}
+                source_to_hindsight_map.update(cursor.fetchall())
 
             # Map input source_ids to their corresponding hindsight IDs while maintaining order
             hindsight_ids = [source_to_hindsight_map.get(sid, None) for sid in source_ids]
 
             return hindsight_ids
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Hindsight database maintenance.")
+    parser.add_argument("--rebuild_search_index", action="store_true",
+                        help="Rebuild the full-text search index from all OCR results")
+    parser.add_argument("--migrate_ocr_to_blobs", action="store_true",
+                        help="Convert ocr_results rows to compact per-frame ocr_boxes blobs and VACUUM")
+    parser.add_argument("--backlog", action="store_true",
+                        help="Print the backend backlog, counting every frame without OCR results (slow on large databases)")
+    args = parser.parse_args()
+
+    db = HindsightDB()
+    if args.rebuild_search_index:
+        db.rebuild_search_index()
+    if args.migrate_ocr_to_blobs:
+        db.migrate_ocr_to_blobs()
+        print("Reclaiming space (VACUUM)...")
+        db.get_connection().execute("VACUUM")
+        if OCR_STORAGE != "blob":
+            print('Set OCR_STORAGE = "blob" in config.py so new OCR results are also stored as blobs.')
+    if args.backlog:
+        counts = db.get_backlog_counts()
+        counts["frames_without_ocr"] = db.count_frames_without_ocr()
+        for name, count in counts.items():
+            print(f"{name}: {count}")
@@ -0,0 +1,226 @@
+"""In-memory index of the frames table shared by the views and queries."""
+import threading
+import numpy as np
+import pandas as pd
+
+import hindsight_server.utils as utils
+
+class FrameIndex:
+    """NumPy-backed index of every frame, sorted by (timestamp, id). refresh() only reads frames
+    added since the last refresh (id > last_seen_id) and frames assigned to new video chunks or
+    to the chunks of unfinished video_chunk jobs, so keeping it current is cheap. Lookups use
+    binary search and return positions into the sorted arrays, which to_df turns into a frames
+    DataFrame.
+    """
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.RLock()
+        self.last_seen_id = 0
+        self.last_seen_video_chunk_id = 0
+        self._pending_video_chunk_ids = set() # Chunks of unfinished video_chunk jobs at the last refresh
+
+        self.timestamps = np.empty(0, dtype=np.int64)
+        self.ids = np.empty(0, dtype=np.int32)
+        self.app_codes = np.empty(0, dtype=np.int32)
+        self.source_codes = np.empty(0, dtype=np.int32)
+        self.video_chunk_ids = np.empty(0, dtype=np.int64) # -1 if not in a video chunk
+        self.video_chunk_offsets = np.empty(0, dtype=np.int32)
+        self.paths = np.empty(0, dtype=object)
+        self.applications = list() # app code -> application identifier
+        self.sources = [None] # source code -> source
+        self.video_chunk_paths = dict()
+        self._app_to_code = dict()
+        self._source_to_code = {None: 0}
+        self._id_order = np.empty(0, dtype=np.int64) # positions sorted by frame id
+        self._sorted_ids = np.empty(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _encode(self, values, codes_map, names):
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, v in enumerate(values):
+            code = codes_map.get(v)
+            if code is None:
+                code = codes_map[v] = len(names)
+                names.append(v)
+            codes[i] = code
+        return codes
+
+    def refresh(self):
+        """Loads frames added since the last refresh and new video chunk assignments. Returns the
+        number of new frames."""
+        with self._lock:
+            conn = self.db.get_connection()
+            # video_chunk jobs assign a chunk's frames over several transactions, so their chunks
+            # are re-read until the job finishes. Read before the frames: a job finishing in
+            # between keeps its chunk for one more refresh.
+            active_chunk_ids = {r[0] for r in conn.execute('''
+                SELECT video_chunks.id FROM jobs JOIN video_chunks ON video_chunks.path = json_extract(jobs.payload, '$.path')
+                WHERE jobs.job_type = 'video_chunk' AND jobs.status IN ('pending', 'running')
+            ''').fetchall()}
+            new_frames = conn.execute('''
+                SELECT id, timestamp, application, source, path, video_chunk_id, video_chunk_offset
+                FROM frames WHERE id > ? ORDER BY id
+            ''', (self.last_seen_id,)).fetchall()
+            new_chunks = conn.execute("SELECT id, path FROM video_chunks WHERE id > ?", (self.last_seen_video_chunk_id,)).fetchall()
+            self.video_chunk_paths.update(new_chunks)
+
+            # Existing frames compressed into video chunks since the last refresh
+            if self.last_seen_id > 0:
+                candidate_chunk_ids = list(self._pending_video_chunk_ids | active_chunk_ids | {c[0] for c in new_chunks})
+                chunk_frames = list()
+                for i in range(0, len(candidate_chunk_ids), 500):
+                    chunk_ids = candidate_chunk_ids[i:i + 500]
+                    chunk_frames += conn.execute(f'''
+                        SELECT id, video_chunk_id, video_chunk_offset FROM frames
+                        WHERE video_chunk_id IN ({','.join(['?'] * len(chunk_ids))}) AND id <= ?
+                    ''', chunk_ids + [self.last_seen_id]).fetchall()
+                if chunk_frames:
+                    frame_ids, chunk_ids, offsets = zip(*chunk_frames)
+                    positions = self.positions_of(frame_ids)
+                    self.video_chunk_ids[positions] = chunk_ids
+                    self.video_chunk_offsets[positions] = [-1 if o is None else o for o in offsets]
+            self._pending_video_chunk_ids = active_chunk_ids
+            if new_chunks:
+                self.last_seen_video_chunk_id = max(c[0] for c in new_chunks)
+
+            if new_frames:
+                self._append_frames(new_frames)
+            return len(new_frames)
+
+    def _append_frames(self, new_frames):
+        ids, timestamps, applications, sources, paths, video_chunk_ids, video_chunk_offsets = zip(*new_frames)
+        new_ids = np.array(ids, dtype=np.int32)
+        new_timestamps = np.array(timestamps, dtype=np.int64)
+        new_columns = {
+            "app_codes": self._encode(applications, self._app_to_code, self.applications),
+            "source_codes": self._encode(sources, self._source_to_code, self.sources),
+            "video_chunk_ids": np.array([-1 if c is None else c for c in video_chunk_ids], dtype=np.int64),
+            "video_chunk_offsets": np.array([-1 if o is None else o for o in video_chunk_offsets], dtype=np.int32),
+            "paths": np.array(paths, dtype=object),
+        }
+        order = np.lexsort((new_ids, new_timestamps))
+        num_existing = len(self.ids)
+        # New ids are always larger, so frames that are not older than the last one can be appended
+        in_order = num_existing == 0 or new_timestamps[order[0]] >= self.timestamps[-1]
+
+        self.ids = np.concatenate([self.ids, new_ids[order]])
+        self.timestamps = np.concatenate([self.timestamps, new_timestamps[order]])
+        for name, values in new_columns.items():
+            setattr(self, name, np.concatenate([getattr(self, name), values[order]]))
+
+        if in_order:
+            self._id_order = np.concatenate([self._id_order, num_existing + np.argsort(new_ids[order], kind="stable")])
+        else:
+            # Backfilled frames (e.g. a late sync) land in the middle so re-sort everything
+            order = np.lexsort((self.ids, self.timestamps))
+            for name in ["ids", "timestamps"] + list(new_columns):
+                setattr(self, name, getattr(self, name)[order])
+            self._id_order = np.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[self._id_order]
+        self.last_seen_id = int(new_ids.max())
+
+    def positions_of(self, frame_ids):
+        """Returns the positions of frame_ids. Raises KeyError for unknown frame ids."""
+        frame_ids = np.atleast_1d(np.asarray(frame_ids, dtype=np.int64))
+        with self._lock:
+            return self._positions_of(frame_ids)
+
+    def _positions_of(self, frame_ids):
+        i = np.searchsorted(self._sorted_ids, frame_ids)
+        found = i < len(self._sorted_ids)
+        found[found] = self._sorted_ids[i[found]] == frame_ids[found]
+        if not found.all():
+            raise KeyError(f"Frames not in index: {frame_ids[~found].tolist()}")
+        return self._id_order[i]
+
+    def app_codes_of(self, applications):
+        return np.array([self._app_to_code[a] for a in applications if a in self._app_to_code], dtype=np.int32)
+
+    def select(self, start_ts=None, end_ts=None, applications=None, exclude_applications=None, exclude_sources=None,
+               has_video_chunk=None):
+        """Returns the sorted positions of frames matching all of the provided filters.
+        Args:
+            start_ts (int): only frames with timestamp >= start_ts (UTC milliseconds)
+            end_ts (int): only frames with timestamp <= end_ts (UTC milliseconds)
+            applications (list[str]): only these application identifiers
+            exclude_applications (list[str]): leave out these application identifiers
+            exclude_sources (list[str]): leave out frames from these sources
+            has_video_chunk (bool): only frames that are (or are not) in a video chunk
+        """
+        with self._lock:
+            return self._select(start_ts, end_ts, applications, exclude_applications, exclude_sources, has_video_chunk)
+
+    def _select(self, start_ts, end_ts, applications, exclude_applications, exclude_sources, has_video_chunk):
+        start = 0 if start_ts is None else np.searchsorted(self.timestamps, start_ts, side="left")
+        end = len(self.timestamps) if end_ts is None else np.searchsorted(self.timestamps, end_ts, side="right")
+        mask = np.ones(max(end - start, 0), dtype=bool)
+        if applications is not None:
+            mask &= np.isin(self.app_codes[start:end], self.app_codes_of(applications))
+        if exclude_applications is not None:
+            mask &= ~np.isin(self.app_codes[start:end], self.app_codes_of(exclude_applications))
+        if exclude_sources is not None:
+            exclude_codes = [self._source_to_code[s] for s in exclude_sources if s in self._source_to_code]
+            mask &= ~np.isin(self.source_codes[start:end], exclude_codes)
+        if has_video_chunk is not None:
+            mask &= (self.video_chunk_ids[start:end] >= 0) == has_video_chunk
+        return start + np.flatnonzero(mask)
+
+    def neighbor_id(self, frame_id, offset=1, same_application=False):
+        """Returns the id of the frame offset positions after frame_id in time (negative offsets
+        go back), or None if there is no such frame."""
+        with self._lock:
+            position = self.positions_of(frame_id)[0]
+            if same_application:
+                app_positions = np.flatnonzero(self.app_codes == self.app_codes[position])
+                i = np.searchsorted(app_positions, position) + offset
+                return int(self.ids[app_positions[i]]) if 0 <= i < len(app_positions) else None
+            i = position + offset
+            return int(self.ids[i]) if 0 <= i < len(self.ids) else None
+
+    def application_window(self, frame_id, before, after):
+        """Returns the positions of the frames of frame_id's application from before frames
+        earlier to after frames later (inclusive of frame_id)."""
+        with self._lock:
+            position = self.positions_of(frame_id)[0]
+            app_positions = np.flatnonzero(self.app_codes == self.app_codes[position])
+        i = np.searchsorted(app_positions, position)
+        return app_positions[max(i - before, 0):i + after + 1]
+
+    def to_df(self, positions=None, application_alias=True):
+        """Returns a frames DataFrame (id, timestamp, application, application_org, source,
+        path, video_chunk_id, video_chunk_offset, video_chunk_path, datetime_utc,
+        datetime_local) for positions, defaulting to every frame."""
+        with self._lock:
+            positions = np.arange(len(self.ids)) if positions is None else np.asarray(positions, dtype=np.int64)
+            applications = np.array(self.applications, dtype=object)[self.app_codes[positions]] if len(self.applications) else np.empty(0, dtype=object)
+            video_chunk_ids = self.video_chunk_ids[positions]
+            df = pd.DataFrame({
+                "id": self.ids[positions],
+                "timestamp": self.timestamps[positions],
+                "application": applications,
+                "application_org": applications,
+                "source": np.array(self.sources, dtype=object)[self.source_codes[positions]],
+                "path": self.paths[positions],
+                "video_chunk_id": np.where(video_chunk_ids >= 0, video_chunk_ids, np.nan),
+                "video_chunk_offset": np.where(video_chunk_ids >= 0, self.video_chunk_offsets[positions], np.nan),
+                "video_chunk_path": [self.video_chunk_paths.get(c) for c in video_chunk_ids.tolist()],
+            })
+        if application_alias:
+            id_to_alias = utils.get_identifiers_to_alias()
+            df['application'] = df['application_org'].map(id_to_alias).fillna(df['application_org'])
+        return utils.add_datetimes(df)
+
+_frame_indexes = dict()
+_frame_indexes_lock = threading.Lock()
+
+def get_frame_index(db, refresh=True):
+    """Returns the FrameIndex shared by every user of db's database file, refreshed by default."""
+    with _frame_indexes_lock:
+        frame_index = _frame_indexes.get(db.db_file)
+        if frame_index is None:
+            frame_index = _frame_indexes[db.db_file] = FrameIndex(db)
+    if refresh:
+        frame_index.refresh()
+    return frame_index
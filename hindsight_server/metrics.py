@@ -0,0 +1,214 @@
+"""Lightweight in-process metrics exposed in the Prometheus text format. The server serves them at
+/metrics and the backend with start_metrics_server. Recording a value is a dict update under a
+lock, so metrics are cheap enough to leave on.
+
+    REQUESTS = counter("hindsight_requests_total", "Requests handled", ["route", "status"])
+    REQUESTS.inc(route="/ping", status=200)
+"""
+import time
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_registry = dict()
+_registry_lock = threading.Lock()
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[l] for l in self.labelnames)
+
+    def _samples(self):
+        """Returns (suffix, labelvalues, extra labels, value) for every sample."""
+        with self._lock:
+            return [("", key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for suffix, key, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {value}")
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """A value that goes up and down, either set directly or computed by a function at scrape time."""
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        if self.function is not None:
+            try:
+                values = self.function()
+            except Exception as e:
+                print(f"Failed computing metric {self.name}: {e}")
+            else:
+                # Functions return a value, or a dict of label values tuple -> value when labelled
+                values = values if isinstance(values, dict) else {(): values}
+                with self._lock:
+                    self._values = dict(values)
+        return super()._samples()
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0, 0.0] # bucket counts, count, sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        samples = list()
+        with self._lock:
+            for key, counts in self._values.items():
+                for bound, count in zip(self.buckets, counts):
+                    samples.append(("_bucket", key, (("le", bound),), count))
+                samples.append(("_bucket", key, (("le", "+Inf"),), counts[-2]))
+                samples.append(("_count", key, (), counts[-2]))
+                samples.append(("_sum", key, (), counts[-1]))
+        return samples
+
+def _get_or_create(metric_class, name, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = metric_class(name, *args, **kwargs)
+        elif not isinstance(metric, metric_class):
+            raise ValueError(f"Metric {name} already registered as a {metric.metric_type}")
+        return metric
+
+def counter(name, documentation, labelnames=()):
+    return _get_or_create(Counter, name, documentation, labelnames)
+
+def gauge(name, documentation, labelnames=(), function=None):
+    return _get_or_create(Gauge, name, documentation, labelnames, function=function)
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+def render():
+    """Returns every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(m.render() for m in metrics) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serves /metrics from a daemon thread, for processes without a web server (the backend)."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    return server
+
+def register_backlog_gauges(db, cache_seconds=15):
+    """Registers gauges of the work waiting in db (see HindsightDB.get_backlog_counts). The counts
+    are recomputed at most every cache_seconds however often metrics are scraped. While one scrape
+    recomputes them others use the previous counts instead of waiting, so the lock is never waited
+    on while the database is queried (a greenlet waiting on it would block the gevent hub)."""
+    cache = {"timestamp": None, "counts": None}
+    cache_lock = threading.Lock()
+
+    def backlog_counts():
+        if cache["timestamp"] is not None and time.time() - cache["timestamp"] < cache_seconds:
+            return cache["counts"]
+        if not cache_lock.acquire(blocking=False):
+            return cache["counts"]
+        try:
+            cache["counts"] = db.get_backlog_counts()
+            cache["timestamp"] = time.time()
+        finally:
+            cache_lock.release()
+        return cache["counts"]
+
+    def backlog_count(name):
+        counts = backlog_counts()
+        return dict() if counts is None else counts[name] # No samples until the first counts are in
+
+    gauge("hindsight_frames_awaiting_ocr", "Uploaded frames queued for OCR (pending ingest_frame jobs)",
+          function=lambda: backlog_count("frames_awaiting_ocr"))
+    gauge("hindsight_frames_awaiting_embedding", "Frames not yet ingested into chromadb",
+          function=lambda: backlog_count("frames_awaiting_embedding"))
+    gauge("hindsight_unprocessed_queries", "Queries not yet answered",
+          function=lambda: backlog_count("unprocessed_queries"))
+    gauge("hindsight_pending_jobs", "Queued jobs not yet started", ["job_type"],
+          function=lambda: {(job_type,): count for job_type, count in backlog_count("pending_jobs").items()})
+
+"""Per-stage throughput of the backend loop, see server_backend.py."""
+BACKEND_STAGE_SECONDS = histogram("hindsight_backend_stage_seconds", "Duration of each backend loop stage", ["stage"])
+BACKEND_STAGE_ITEMS = counter("hindsight_backend_stage_items_total", "Items processed by each backend loop stage", ["stage"])
+
+@contextlib.contextmanager
+def backend_stage(stage):
+    """Times a backend loop stage. Yields a dict whose "items" the stage sets to the number of
+    items it processed."""
+    stats = {"items": 0}
+    with BACKEND_STAGE_SECONDS.time(stage=stage):
+        yield stats
+    BACKEND_STAGE_ITEMS.inc(stats["items"] or 0, stage=stage)
@@ -0,0 +1,100 @@
+"""Compact per-frame storage of OCR results. All of a frame's boxes are packed into one BLOB:
+
+    header      magic (4 bytes), version (uint8), 3 padding bytes, num_boxes (uint32), text_bytes (uint32)
+    float32     x[n], y[n], w[n], h[n], conf[n]
+    int32       block_num[n], line_num[n] (-1 when missing)
+    uint32      text_offsets[n + 1], byte offsets of each box's text in the text buffer
+    uint8       text_null[n], 1 where the box has no text
+    utf-8       text buffer
+
+Decoding returns NumPy views straight onto the blob, so only the texts are copied. The format makes
+reads fast rather than small: at a few KB per frame most blobs fill a database page on their own, so
+it takes about as much space as ocr_results rows (see config.OCR_STORAGE).
+"""
+import struct
+import numpy as np
+import pandas as pd
+
+OCR_BLOB_MAGIC = b"HOCR"
+OCR_BLOB_VERSION = 1
+_HEADER = struct.Struct("<4sBxxxII")
+
+FLOAT_COLUMNS = ("x", "y", "w", "h", "conf")
+INT_COLUMNS = ("block_num", "line_num")
+OCR_COLUMNS = ("x", "y", "w", "h", "text", "conf", "block_num", "line_num")
+
+def _to_int(v):
+    return -1 if v is None or v != v else int(v) # v != v for NaN
+
+def encode_ocr_results(ocr_results):
+    """Packs a list of (x, y, w, h, text, conf, block_num, line_num) tuples into a blob."""
+    num_boxes = len(ocr_results)
+    if num_boxes == 0:
+        return _HEADER.pack(OCR_BLOB_MAGIC, OCR_BLOB_VERSION, 0, 0) + np.zeros(1, dtype=np.uint32).tobytes()
+    x, y, w, h, texts, conf, block_num, line_num = zip(*ocr_results)
+
+    floats = np.array([x, y, w, h, conf], dtype=np.float32)
+    ints = np.array([[_to_int(v) for v in block_num], [_to_int(v) for v in line_num]], dtype=np.int32)
+    encoded_texts = [b"" if t is None else t.encode("utf-8") for t in texts]
+    text_offsets = np.zeros(num_boxes + 1, dtype=np.uint32)
+    text_offsets[1:] = np.cumsum([len(t) for t in encoded_texts])
+    text_null = np.array([t is None for t in texts], dtype=np.uint8)
+    text_buffer = b"".join(encoded_texts)
+
+    return b"".join([_HEADER.pack(OCR_BLOB_MAGIC, OCR_BLOB_VERSION, num_boxes, len(text_buffer)),
+                     floats.tobytes(), ints.tobytes(), text_offsets.tobytes(), text_null.tobytes(), text_buffer])
+
+def decode_ocr_blob(blob):
+    """Returns a dict of zero-copy NumPy arrays for each numeric column plus text_offsets,
+    text_null and the raw text_buffer. Use decode_texts for the texts."""
+    magic, version, num_boxes, text_bytes = _HEADER.unpack_from(blob)
+    if magic != OCR_BLOB_MAGIC or version != OCR_BLOB_VERSION:
+        raise ValueError(f"Not a version {OCR_BLOB_VERSION} OCR blob")
+
+    offset = _HEADER.size
+    floats = np.frombuffer(blob, dtype=np.float32, count=len(FLOAT_COLUMNS) * num_boxes, offset=offset)
+    floats = floats.reshape(len(FLOAT_COLUMNS), num_boxes)
+    offset += floats.nbytes
+    ints = np.frombuffer(blob, dtype=np.int32, count=len(INT_COLUMNS) * num_boxes, offset=offset)
+    ints = ints.reshape(len(INT_COLUMNS), num_boxes)
+    offset += ints.nbytes
+    text_offsets = np.frombuffer(blob, dtype=np.uint32, count=num_boxes + 1, offset=offset)
+    offset += text_offsets.nbytes
+    text_null = np.frombuffer(blob, dtype=np.uint8, count=num_boxes, offset=offset)
+    offset += text_null.nbytes
+
+    decoded = {c: floats[i] for i, c in enumerate(FLOAT_COLUMNS)}
+    decoded.update({c: ints[i] for i, c in enumerate(INT_COLUMNS)})
+    decoded["text_offsets"] = text_offsets
+    decoded["text_null"] = text_null
+    decoded["text_buffer"] = memoryview(blob)[offset:offset + text_bytes]
+    return decoded
+
+def decode_texts(decoded):
+    """Returns the list of box texts (None where missing) of a decoded blob."""
+    text_buffer = bytes(decoded["text_buffer"])
+    text_offsets = decoded["text_offsets"].tolist()
+    return [None if is_null else text_buffer[text_offsets[i]:text_offsets[i + 1]].decode("utf-8")
+            for i, is_null in enumerate(decoded["text_null"].tolist())]
+
+def decode_ocr_results(blob):
+    """Inverse of encode_ocr_results (with float32 precision)."""
+    decoded = decode_ocr_blob(blob)
+    texts = decode_texts(decoded)
+    columns = [texts if c == "text" else decoded[c].tolist() for c in OCR_COLUMNS]
+    return list(zip(*columns))
+
+def ocr_blobs_to_df(frame_ids, blobs):
+    """Returns a DataFrame with a frame_id column and the ocr_results columns for each box of
+    the provided blobs, in the same shape as rows read from the ocr_results table."""
+    decoded_blobs = [decode_ocr_blob(blob) for blob in blobs]
+    num_boxes = [len(d["x"]) for d in decoded_blobs]
+    data = {"frame_id": np.repeat(np.asarray(frame_ids, dtype=np.int64), num_boxes)}
+    for c in OCR_COLUMNS:
+        if c == "text":
+            data[c] = np.array([t for d in decoded_blobs for t in decode_texts(d)], dtype=object)
+        elif decoded_blobs:
+            data[c] = np.concatenate([d[c] for d in decoded_blobs])
+        else:
+            data[c] = np.array([], dtype=np.int32 if c in INT_COLUMNS else np.float32)
+    return pd.DataFrame(data)
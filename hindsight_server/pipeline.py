@@ -0,0 +1,125 @@
+"""Staged pipeline for the backend's frame processing (see server_backend.py). Each stage has its own
+worker threads taking batches from a bounded queue and putting what they return on the next stage's
+queue, so stages overlap instead of alternating and a slow stage only holds back the stages feeding
+it. Threads suffice since the heavy work runs in native code or in worker processes (worker_pool.py).
+"""
+import time
+import queue
+import itertools
+import threading
+import contextlib
+
+import hindsight_server.metrics as metrics
+
+PIPELINE_BATCHES = metrics.counter("hindsight_pipeline_batches_total", "Batches processed by each pipeline stage", ["stage", "result"])
+PIPELINE_ITEMS = metrics.counter("hindsight_pipeline_items_total", "Items processed by each pipeline stage", ["stage"])
+PIPELINE_STAGE_SECONDS = metrics.histogram("hindsight_pipeline_stage_seconds", "Time a pipeline stage spends on a batch", ["stage"])
+PIPELINE_QUEUE_DEPTH = metrics.gauge("hindsight_pipeline_queue_depth", "Batches waiting for each pipeline stage", ["stage"])
+
+class Stage:
+    """A step of a Pipeline. func takes a batch (anything with a len) and returns the batch for the
+    next stage, or None or an empty batch when nothing is left to pass on. Queued batches are taken
+    lowest priority value first, in submission order within a priority."""
+    def __init__(self, name, func, workers=1, queue_size=4):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = queue.PriorityQueue(maxsize=queue_size)
+
+class Pipeline:
+    """Runs batches through stages in order. Batches can enter at any stage and keep the priority
+    they were submitted with. on_idle is called whenever the last batch in the pipeline is done, and
+    on_room whenever a stage takes a batch from its full queue, so whoever feeds it can refill it.
+    wait_turn(priority), if given, is called before each batch, e.g. to yield to more important
+    work, and each batch is processed within the context manager running(priority), if given, so
+    less important work can yield to it (see scheduler.PriorityScheduler)."""
+    def __init__(self, stages, on_idle=None, on_room=None, wait_turn=None, running=None):
+        self.stages = list(stages)
+        self.on_idle = on_idle
+        self.on_room = on_room
+        self.wait_turn = wait_turn
+        self.running = running
+        self._sequence = itertools.count() # Keeps batches of equal priority in order, never compared
+        self._stage_index = {stage.name: i for i, stage in enumerate(self.stages)}
+        self._active = 0 # Batches queued or being processed in any stage
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        for i, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                threading.Thread(target=self._run_stage, args=(i,), name=f"Pipeline-{stage.name}-{n}", daemon=True).start()
+        self._started = True
+
+    def submit(self, batch, stage=None, priority=0, block=True):
+        """Queues batch at stage (a stage name, defaults to the first). Returns False if block is
+        False and the stage's queue is full."""
+        index = 0 if stage is None else self._stage_index[stage]
+        with self._lock:
+            self._active += 1
+        try:
+            self._put(index, priority, batch, block=block)
+        except queue.Full:
+            self._batch_done()
+            return False
+        return True
+
+    def _put(self, index, priority, batch, block=True):
+        stage = self.stages[index]
+        stage.queue.put((priority, next(self._sequence), batch), block=block)
+        PIPELINE_QUEUE_DEPTH.set(stage.queue.qsize(), stage=stage.name)
+
+    def _run_stage(self, index):
+        stage = self.stages[index]
+        while True:
+            priority, _, batch = stage.queue.get()
+            depth = stage.queue.qsize()
+            PIPELINE_QUEUE_DEPTH.set(depth, stage=stage.name)
+            if depth == stage.queue.maxsize - 1 and self.on_room is not None:
+                self.on_room()
+            if self.wait_turn is not None:
+                self.wait_turn(priority)
+            start = time.perf_counter()
+            try:
+                with self.running(priority) if self.running is not None else contextlib.nullcontext():
+                    output = stage.func(batch)
+            except Exception as e:
+                print(f"Pipeline stage {stage.name} failed on a batch of {len(batch)}: {e}")
+                PIPELINE_BATCHES.inc(stage=stage.name, result="error")
+                output = None
+            else:
+                PIPELINE_BATCHES.inc(stage=stage.name, result="success")
+                PIPELINE_ITEMS.inc(len(batch), stage=stage.name)
+            PIPELINE_STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage.name)
+
+            if output is not None and len(output) > 0 and index + 1 < len(self.stages):
+                with self._lock:
+                    self._active += 1
+                self._put(index + 1, priority, output) # Blocks while the next stage is behind
+            self._batch_done()
+
+    def _batch_done(self):
+        with self._lock:
+            self._active -= 1
+            idle = self._active == 0
+            if idle:
+                self._idle.notify_all()
+        if idle and self.on_idle is not None:
+            self.on_idle()
+
+    def room(self, stage):
+        """Returns the number of batches the queue of stage (a stage name) can take without blocking."""
+        stage_queue = self.stages[self._stage_index[stage]].queue
+        return max(stage_queue.maxsize - stage_queue.qsize(), 0)
+
+    def is_idle(self):
+        with self._lock:
+            return self._active == 0
+
+    def wait_idle(self, timeout=None):
+        """Blocks until every submitted batch went through the pipeline. Returns False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._active == 0, timeout)
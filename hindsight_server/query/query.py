@@ -6,6 +6,7 @@ from datetime import timedelta
 from .prompts import get_prompt, get_summary_prompt, get_recomposition_prompt, get_decomposition_prompt, get_summary_compete_prompt
 from hindsight_server.chromadb_tools import query_chroma, chroma_search_results_to_df, get_chroma_collection
 from hindsight_server.db import HindsightDB
+from hindsight_server.frame_index import get_frame_index
 import hindsight_server.utils as utils
 from hindsight_server.config import LLM_MODEL_NAME, RUNNING_PLATFORM
 # from query_vlm import vlm_basic_retrieved_query
@@ -100,14 +101,14 @@ def long_context_query(query_text, source_apps=None, utc_milliseconds_start_date
     chroma_search_results_df = chroma_search_results_df.iloc[:num_contexts]
     chroma_search_results_df = chroma_search_results_df.sort_values(by="datetime_local", ascending=True)
 
-    frames_df = db.get_frames()
+    frame_index = get_frame_index(db)
 
     if pipeline is None:
         pipeline = load(LLM_MODEL_NAME) 
 
     responses = list()
     for frame_id in chroma_search_results_df['id']:
-        context_text = utils.get_context_around_frame_id(int(frame_id), frames_df, db, context_buffer=context_buffer)
+        context_text = utils.get_context_around_frame_id(int(frame_id), frame_index, db, context_buffer=context_buffer)
         prompt = get_prompt(text=context_text, query=query_text)
         response = llm_generate(pipeline=pipeline, prompt=prompt, max_tokens=max_tokens)
         responses.append(response)
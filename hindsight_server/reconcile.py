@@ -0,0 +1,112 @@
+"""Incremental reconciliation of RAW_SCREENSHOTS_DIR with the frames table. A manifest records the
+mtime and number of screenshots of every day/application directory (see utils.get_screenshot_path)
+when it was last reconciled, so later runs only list the directories whose mtime changed instead of
+globbing every screenshot and loading every frame into memory.
+"""
+import os
+import json
+import pandas as pd
+
+from hindsight_server.config import RAW_SCREENSHOTS_DIR, SCREENSHOTS_MANIFEST_FILE
+import hindsight_server.utils as utils
+
+MANIFEST_VERSION = 1
+DAY_MS = 24 * 60 * 60 * 1000
+
+def _subdirs(path):
+    try:
+        return sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+    except FileNotFoundError:
+        return []
+
+def iter_screenshot_dirs(root=RAW_SCREENSHOTS_DIR):
+    """Yields the relative path (year/month/day/application) of every screenshot directory."""
+    for year in _subdirs(root):
+        for month in _subdirs(os.path.join(root, year)):
+            for day in _subdirs(os.path.join(root, year, month)):
+                for application in _subdirs(os.path.join(root, year, month, day)):
+                    yield f"{year}/{month}/{day}/{application}"
+
+def _database_identity(db):
+    """Identifies the database a manifest was built against, so a recreated database is rescanned."""
+    return {"db_file": str(db.db_file), "db_inode": os.stat(db.db_file).st_ino}
+
+def load_manifest(db, manifest_file=SCREENSHOTS_MANIFEST_FILE):
+    """Returns the manifest's dict of relative directory -> [mtime_ns, number of screenshots], or
+    an empty dict (everything is rescanned) if it is missing, unreadable or built for another
+    database."""
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return dict()
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("database") != _database_identity(db):
+        return dict()
+    return manifest["directories"]
+
+def save_manifest(db, directories, manifest_file=SCREENSHOTS_MANIFEST_FILE):
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "database": _database_identity(db), "directories": directories}, f)
+    os.replace(tmp_file, manifest_file)
+
+def reconcile_directory(db, root, relative_dir, batch_size=1000):
+    """Inserts frames for the screenshots in relative_dir missing from the frames table, in
+    timestamp order, batch_size frames per transaction. Returns (number of screenshots, number of
+    frames inserted)."""
+    year, month, day, application = relative_dir.split("/")
+    # Directories are UTC days, see utils.get_screenshot_path
+    day_start = int(pd.Timestamp(f"{year}-{month}-{day}", tz="UTC").timestamp() * 1000)
+    frames = db.get_frame_paths(application, day_start, day_start + DAY_MS)
+    frame_paths = set(frames['path'])
+
+    screenshot_paths = set()
+    missing_frames = list()
+    for entry in os.scandir(os.path.join(root, relative_dir)):
+        if not entry.name.endswith(".jpg") or not entry.is_file():
+            continue
+        path = os.path.abspath(entry.path)
+        screenshot_paths.add(path)
+        if path in frame_paths:
+            continue
+        try:
+            frame_application, timestamp = utils.parse_screenshot_filename(entry.name)
+        except ValueError as e:
+            print(e)
+            continue
+        missing_frames.append({"timestamp": timestamp, "path": path, "application": frame_application})
+
+    missing_frames.sort(key=lambda frame: frame['timestamp'])
+    for i in range(0, len(missing_frames), batch_size):
+        db.insert_frames_with_ocr_bulk(missing_frames[i:i + batch_size])
+
+    uncompressed_frame_paths = set(frames.loc[frames['video_chunk_id'].isnull(), 'path'])
+    screenshots_missing_paths = uncompressed_frame_paths - screenshot_paths - {"None"}
+    if len(screenshots_missing_paths) > 0:
+        print(f"Screenshots missing path: {screenshots_missing_paths}")
+    return len(screenshot_paths), len(missing_frames)
+
+def reconcile_screenshots(db, root=RAW_SCREENSHOTS_DIR, manifest_file=SCREENSHOTS_MANIFEST_FILE, save_every=100):
+    """Ensures every screenshot in root has a frame, rescanning only directories that changed
+    since the manifest was saved. The manifest is saved every save_every rescanned directories
+    so an interrupted run resumes where it stopped. Returns the number of frames inserted."""
+    manifest = load_manifest(db, manifest_file)
+    directories = dict()
+    num_rescanned = 0
+    num_inserted = 0
+    for relative_dir in iter_screenshot_dirs(root):
+        # Stat before listing, a screenshot added during the listing changes the mtime again
+        mtime_ns = os.stat(os.path.join(root, relative_dir)).st_mtime_ns
+        entry = manifest.get(relative_dir)
+        if entry is not None and entry[0] == mtime_ns:
+            directories[relative_dir] = entry
+            continue
+        num_screenshots, num_missing = reconcile_directory(db, root, relative_dir)
+        directories[relative_dir] = [mtime_ns, num_screenshots]
+        num_rescanned += 1
+        num_inserted += num_missing
+        if num_rescanned % save_every == 0:
+            save_manifest(db, {**manifest, **directories}, manifest_file)
+    save_manifest(db, directories, manifest_file)
+    print(f"Rescanned {num_rescanned} of {len(directories)} screenshot directories, ingested {num_inserted} screenshots missing from frames table.")
+    return num_inserted
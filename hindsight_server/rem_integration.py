@@ -69,26 +69,28 @@ def ingest_rem():
         # Video chunks done to speed up by grabbing more OCR results at once
         video_chunk_frames = frames.loc[frames['chunkId'].isin(video_chunks_batch['id'])]
         video_batch_ocr_res = get_ocr_res(frame_ids=list(video_chunk_frames['id']), conn=rem_conn)
+        frame_id_to_ocr_res = dict(tuple(video_batch_ocr_res.groupby('frameId')))
+        batch_video_chunks = list()
         for _, video_row in video_chunks_batch.iterrows():
             print(video_row['id'])
             width, height = get_video_dimensions(video_row['filePath'])
             video_frames = video_chunk_frames.loc[video_chunk_frames['chunkId'] == video_row['id']]
-            video_chunk_id = hindsight_db.insert_video_chunk(video_row["filePath"], source=source_name, source_id=video_row['id'])
+            frame_records = list()
             # The video chunk id from the rem video_chunks table
-            for _, frame_row in video_frames.iterrows():
-                frame_id = hindsight_db.insert_frame(timestamp=frame_row['int_timestamp'], path="None", application=frame_row["activeApplicationName"],
-                                        source=source_name, source_id=frame_row['id'], video_chunk_id=video_chunk_id, video_chunk_offset=frame_row['offsetIndex'])
-                
+            for frame_row in video_frames.itertuples():
                 # The frame id from the rem frames table
-                frame_ocr_res = video_batch_ocr_res.loc[video_batch_ocr_res['frameId'] == frame_row["id"]]
-                # Convert normalized ocr results to pixel based
-                frame_ocr_res["x"] = frame_ocr_res["x"] * width
-                frame_ocr_res["w"] = frame_ocr_res["w"] * width
-                frame_ocr_res["y"] = frame_ocr_res["y"] * height
-                frame_ocr_res["h"] = frame_ocr_res["h"] * height
+                frame_ocr_res = frame_id_to_ocr_res.get(frame_row.id)
                 converted_ocr_results = list()
-                for _, ocr_result in frame_ocr_res.iterrows():
-                    converted_ocr_results.append((ocr_result['x'], ocr_result['y'], ocr_result['w'],
-                                                ocr_result['h'], ocr_result['text'], -1, -1, -1))
-                hindsight_db.insert_ocr_results(frame_id=frame_id, ocr_results=converted_ocr_results)
-
+                if frame_ocr_res is not None:
+                    # Convert normalized ocr results to pixel based
+                    num_ocr_res = len(frame_ocr_res)
+                    converted_ocr_results = list(zip((frame_ocr_res["x"] * width).tolist(), (frame_ocr_res["y"] * height).tolist(),
+                                                     (frame_ocr_res["w"] * width).tolist(), (frame_ocr_res["h"] * height).tolist(),
+                                                     frame_ocr_res['text'].tolist(), [-1] * num_ocr_res, [-1] * num_ocr_res, [-1] * num_ocr_res))
+                frame_records.append({"timestamp": int(frame_row.int_timestamp), "path": "None", "application": frame_row.activeApplicationName,
+                                      "source": source_name, "source_id": int(frame_row.id),
+                                      "video_chunk_offset": int(frame_row.offsetIndex), "ocr_results": converted_ocr_results})
+            batch_video_chunks.append({"path": video_row["filePath"], "source": source_name, "source_id": int(video_row['id']),
+                                       "frames": frame_records})
+        # Chunks and frames commit together, so get_last_id never resumes past chunks whose frames are missing
+        hindsight_db.insert_video_chunks_with_frames(batch_video_chunks)
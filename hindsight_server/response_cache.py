@@ -0,0 +1,36 @@
+"""Read-through cache for the results of frequent device polls. Each entry remembers the versions
+of the tables it was read from (HindsightDB.get_table_versions), so a cached value is served until
+any process commits a change to one of those tables, and polls in between never query SQLite.
+"""
+import threading
+
+import hindsight_server.metrics as metrics
+
+CACHE_REQUESTS = metrics.counter("hindsight_response_cache_requests_total", "Response cache lookups", ["name", "result"])
+
+class TableVersionedCache:
+    def __init__(self, db, max_entries=256):
+        self.db = db
+        self.max_entries = max_entries
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key, tables, compute):
+        """Returns the cached value for key if none of tables changed since it was computed,
+        otherwise computes, caches and returns compute(). key is a tuple starting with a name
+        used for metrics."""
+        versions = self.db.get_table_versions(tables)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == versions:
+            CACHE_REQUESTS.inc(name=key[0], result="hit")
+            return entry[1]
+
+        CACHE_REQUESTS.inc(name=key[0], result="miss")
+        # Versions are read before computing so a change committed meanwhile invalidates the entry
+        value = compute()
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                self._entries.clear()
+            self._entries[key] = (versions, value)
+        return value
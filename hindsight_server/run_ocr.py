@@ -1,4 +1,5 @@
 """Runs frames insert and OCR on any screenshots not in the database."""
+import threading
 from PIL import Image
 
 import tzlocal
@@ -19,8 +20,29 @@ video_timezone = ZoneInfo("UTC")
 
 db = HindsightDB()
 
+_doctr_model = None
+_doctr_model_lock = threading.Lock()
+
+def init_worker():
+    """Initializer of backend worker processes (see worker_pool.py). Opens the worker's database
+    connection once instead of on its first task."""
+    db.get_connection()
+
+def get_doctr_model():
+    """Loads the doctr model on first use and keeps it for the life of the process. Called from
+    the ingest pipeline's and ingest jobs' threads at once, so it is only loaded by one of them."""
+    global _doctr_model
+    with _doctr_model_lock:
+        if _doctr_model is None:
+            _doctr_model = ocr_predictor(pretrained=True)
+        return _doctr_model
+
 def run_ocr(frames, doctr_model):
-    """Uses doctr to pull text from the frames provided."""
+    """Uses doctr to pull text from the frames provided, skipping frames that already have OCR
+    results (e.g. from an ingest job that ran meanwhile)."""
+    frames = frames.loc[frames['id'].isin(db.get_frames_without_ocr(frame_ids=frames['id'])['id'])]
+    if len(frames) == 0:
+        return
     frame_ids = list(frames['id'])
     img_docs = DocumentFile.from_images(list(frames['path']))
     ocr_res = doctr_model(img_docs)
@@ -39,11 +61,12 @@ def run_ocr(frames, doctr_model):
                     img_ocr_res.append((x, y, w, h, word['value'], word['confidence'], block_num, line_num))
         if len(img_ocr_res) == 0:
             img_ocr_res = [[0, 0, 0, 0, None, 0, None, None]]
-        db.insert_ocr_results(frame_ids[page_num], img_ocr_res)
+        if not db.insert_ocr_results(frame_ids[page_num], img_ocr_res, if_missing=True):
+            print(f"Already have OCR results for {frame_ids[page_num]}")
 
 def run_ocr_batched(df, batch_size=20):
     """Runs doctr OCR in a batched fashion to balance efficiency and reliability."""
-    doctr_model = ocr_predictor(pretrained=True)
+    doctr_model = get_doctr_model()
     num_batches = len(df) // batch_size + (1 if len(df) % batch_size > 0 else 0)
     for i in range(num_batches):
         print(f"OCR Batch {i} out of {num_batches}")
@@ -69,6 +92,8 @@ def run_ocr_mac(frame_id, frame_path=None):
         return ocr_res
     frame_path = db.get_frames(frame_ids=[frame_id]).iloc[0]['path'] if frame_path is None else frame_path
     ocr_res = extract_text_from_frame_mac(frame_path)
-    db.insert_ocr_results(frame_id, ocr_res)
+    if not db.insert_ocr_results(frame_id, ocr_res, if_missing=True):
+        print(f"Already have OCR results for {frame_id}")
+        return db.get_ocr_results(frame_id=frame_id)
     print(f"Inserted ocr results for {frame_path}")
     return ocr_res
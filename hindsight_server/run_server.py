@@ -1,33 +1,74 @@
 """Script for running the Hindsight Server."""
 import os
+import io
+import time
+import json
 import logging
+import tempfile
+import functools
+import contextlib
+import tarfile
+import zipfile
+import itertools
 from pathlib import Path
 from random import randrange
 from werkzeug.utils import secure_filename
-from flask import Flask, request, jsonify, abort, Blueprint
+from flask import Flask, request, jsonify, abort, Blueprint, g, Response
 from gevent.pywsgi import WSGIServer
 from gevent import monkey
-monkey.patch_all()
+monkey.patch_all(thread=False, queue=False) # Real threads and queues for blocking work, see blocking.py
 
 from config import SERVER_LOG_FILE, SECRET_API_KEY, HINDSIGHT_SERVER_DIR, SCREENSHOTS_TMP_DIR, VIDEO_FILES_DIR
 import utils
-from db import HindsightDB
+import sync_format
+import hindsight_server.metrics as metrics
+from db import HindsightDB, TRACKED_TABLES
+from blocking import Offloaded, run_blocking
+from response_cache import TableVersionedCache
+from admission import AdmissionController
 
-from hindsight_applications.hindsight_feed.hindsight_feed_db import from_app_update_content, fetch_contents, fetch_newly_viewed_content
+from hindsight_applications.hindsight_feed.hindsight_feed_db import from_app_update_content, fetch_contents, fetch_newly_viewed_content, \
+    fetch_content_changes, get_max_change_seq
 
 main_app = Blueprint('main', __name__)
 
 HOME = Path.home()
 SSL_CERT = HINDSIGHT_SERVER_DIR / "server.crt"
 SSL_KEY = HINDSIGHT_SERVER_DIR / "server.key"
+SYNC_FRAMES_CHUNK_SIZE = 500 # Frames committed per transaction in /sync_db
+CONTENT_CHANGES_LIMIT = 500 # Content changes per /get_new_content delta response
+MAX_UPLOAD_BYTES = 1024 * 1024 * 1024 # Largest /upload_images request body
+MAX_UPLOAD_FILES = 5000 # Most screenshots per /upload_images request
+MAX_SCREENSHOT_BYTES = 50 * 1024 * 1024 # Largest screenshot (or checksums.json) accepted by /upload_images
+UPLOAD_SPOOL_MEMORY_BYTES = 16 * 1024 * 1024 # Larger /upload_images archives are spooled to disk
 
 utils.make_dir(SCREENSHOTS_TMP_DIR)
 
-db = HindsightDB()
+hindsight_db = HindsightDB()
+db = Offloaded(hindsight_db) # Every db call runs off the gevent hub
+
+REQUESTS = metrics.counter("hindsight_requests_total", "Requests handled", ["route", "method", "status"])
+REQUEST_SECONDS = metrics.histogram("hindsight_request_seconds", "Request latency", ["route"])
+metrics.register_backlog_gauges(hindsight_db) # Computed on the pool, see get_metrics
+
+poll_cache = TableVersionedCache(hindsight_db) # Only stats files itself, computes go through db
+admission = AdmissionController(db)
+
+def start_request_timer():
+    g.request_start_time = time.perf_counter()
+
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    if "request_start_time" in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start_time, route=route)
+    return response
 
 def create_app(*args, **kwargs):
     app = Flask(__name__)
     app.register_blueprint(main_app)
+    app.before_request(start_request_timer)
+    app.after_request(record_request)
 
     handler = logging.FileHandler(SERVER_LOG_FILE)
     handler.setLevel(logging.DEBUG)
@@ -41,11 +82,25 @@ def verify_api_key():
     api_key = request.headers.get('Hightsight-API-Key')
     return api_key == SECRET_API_KEY
 
+def admission_response(kind):
+    """Returns a 429 response if admission control refuses an upload of kind, otherwise None."""
+    refusal = admission.check(kind)
+    if refusal is None:
+        return None
+    message, retry_after = refusal
+    response = jsonify({"status": "error", "message": message, "retry_after": retry_after})
+    response.headers["Retry-After"] = str(retry_after)
+    return response, 429
+
 @main_app.route('/upload_image', methods=['POST'])
 def upload_image():
-    """Saves images to SCREENSHOTS_TMP_DIR"""
+    """Streams an image to its final RAW_SCREENSHOTS_DIR path, inserts its frame and queues an
+    ingest_frame job for the backend."""
     if not verify_api_key():
         abort(401)
+    refused = admission_response("images")
+    if refused is not None:
+        return refused
     if 'file' not in request.files:
         return jsonify({"status": "error", "message": "No file part"}), 400
     file = request.files['file']
@@ -53,17 +108,160 @@ def upload_image():
         return jsonify({"status": "error", "message": "No selected file"}), 400
     if file:
         filename = secure_filename(file.filename)
-        tmp_file_path = os.path.join(SCREENSHOTS_TMP_DIR, filename)
         try:
-            with open(tmp_file_path, 'wb') as tmp_file:
-                file.save(tmp_file)
+            application, timestamp = utils.parse_screenshot_filename(filename)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        filepath = utils.get_screenshot_path(application, timestamp, filename)
+        try:
+            if not os.path.exists(filepath):
+                run_blocking(utils.save_file_atomic, file.stream, filepath)
+            frame_id, job_id = db.insert_uploaded_frame(timestamp, filepath, application)
             print("Saved", filename)
-            return jsonify({"status": "success", "message": "File successfully uploaded"}), 200
+            return jsonify({"status": "success", "message": "File successfully uploaded", "frame_id": frame_id}), 200
         except Exception as e:
             print(f"Error saving file: {e}")
             return jsonify({"status": "error", "message": "Failed to save file"}), 500
     return jsonify({"status": "error", "message": "No file"}), 400
 
+def spool_request_body(max_bytes):
+    """Copies the request body to a temporary file, kept in memory while small, so archives are not
+    held in memory. Aborts with 413 once more than max_bytes are read."""
+    spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY_BYTES)
+    size = 0
+    while True:
+        chunk = request.stream.read(utils.BUF_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            spooled.close()
+            abort(413)
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+def parse_checksums(data):
+    """Parses checksums (JSON mapping filenames to md5s) sent with an /upload_images request."""
+    checksums = json.loads(data)
+    if not isinstance(checksums, dict) or not all(isinstance(md5, str) for md5 in checksums.values()):
+        raise ValueError("checksums must map filenames to md5 strings")
+    return checksums
+
+@contextlib.contextmanager
+def open_uploaded_screenshots():
+    """Yields the checksums (filename to md5) sent with an /upload_images request and a list of
+    (filename, size or None, open) for its screenshots, where open() returns a file-like object
+    of the screenshot. Archives are spooled to a temporary file and read one member at a time,
+    multipart files are already spooled by werkzeug. Aborts with 413 past MAX_UPLOAD_BYTES or
+    MAX_UPLOAD_FILES."""
+    if request.content_length is not None and request.content_length > MAX_UPLOAD_BYTES:
+        abort(413)
+    content_type = request.mimetype
+    if content_type not in ("application/x-tar", "application/gzip", "application/x-gtar", "application/zip"):
+        files = list(request.files.items(multi=True))
+        if len(files) > MAX_UPLOAD_FILES:
+            abort(413)
+        yield parse_checksums(request.form.get("checksums", "{}")), [(f.filename, None, lambda f=f: f.stream) for _, f in files]
+        return
+
+    with spool_request_body(MAX_UPLOAD_BYTES) as body:
+        if content_type == "application/zip":
+            archive = zipfile.ZipFile(body)
+            members = [(os.path.basename(info.filename), info.file_size, functools.partial(archive.open, info))
+                       for info in archive.infolist() if not info.is_dir()]
+        else:
+            archive = tarfile.open(fileobj=body, mode="r:*")
+            members = [(os.path.basename(member.name), member.size, functools.partial(archive.extractfile, member))
+                       for member in run_blocking(archive.getmembers) if member.isfile()]
+        with archive:
+            # Archives carry their checksums in a checksums.json member
+            checksums = dict()
+            for filename, size, open_member in members:
+                if filename == "checksums.json":
+                    if size > MAX_SCREENSHOT_BYTES:
+                        abort(413)
+                    with open_member() as member:
+                        checksums = parse_checksums(member.read())
+            members = [m for m in members if m[0] != "checksums.json"]
+            if len(members) > MAX_UPLOAD_FILES:
+                abort(413)
+            yield checksums, members
+
+def read_uploaded_screenshot(open_file):
+    """Returns a screenshot's bytes, or None if it is larger than MAX_SCREENSHOT_BYTES."""
+    with open_file() as f:
+        data = f.read(MAX_SCREENSHOT_BYTES + 1)
+    return data if len(data) <= MAX_SCREENSHOT_BYTES else None
+
+def save_uploaded_screenshots(entries, checksums):
+    """Verifies and writes the screenshots of an /upload_images request one at a time. Returns a
+    result dict per screenshot and the (result, (timestamp, path, application)) of those saved."""
+    results = list()
+    frames = list()
+    for uploaded_filename, size, open_file in entries:
+        filename = secure_filename(uploaded_filename)
+        result = {"filename": filename, "status": "error"}
+        results.append(result)
+        try:
+            application, timestamp = utils.parse_screenshot_filename(filename)
+        except ValueError as e:
+            result["message"] = str(e)
+            continue
+        data = None if size is not None and size > MAX_SCREENSHOT_BYTES else run_blocking(read_uploaded_screenshot, open_file)
+        if data is None:
+            result["message"] = "File too large"
+            continue
+        # Checksums are keyed by the name the client sent
+        error = utils.verify_screenshot(data, expected_md5=checksums.get(uploaded_filename))
+        if error is not None:
+            result["message"] = error
+            continue
+        filepath = utils.get_screenshot_path(application, timestamp, filename)
+        try:
+            if not os.path.exists(filepath):
+                run_blocking(utils.save_file_atomic, io.BytesIO(data), filepath)
+        except OSError as e:
+            print(f"Error saving file: {e}")
+            result["message"] = "Failed to save file"
+            continue
+        frames.append((result, (timestamp, filepath, application)))
+    return results, frames
+
+@main_app.route('/upload_images', methods=['POST'])
+def upload_images():
+    """Batch version of /upload_image. Screenshots are sent as multipart files (optionally with
+    a checksums form field mapping filenames to md5s) or as a tar or zip archive body (optionally
+    containing a checksums.json). Every file is verified, valid ones are written and their frames
+    inserted and queued for ingest in one transaction. Returns a status per file."""
+    if not verify_api_key():
+        abort(401)
+    refused = admission_response("images")
+    if refused is not None:
+        return refused
+    try:
+        with open_uploaded_screenshots() as (checksums, entries):
+            if len(entries) == 0:
+                return jsonify({"status": "error", "message": "No files"}), 400
+            results, frames = save_uploaded_screenshots(entries, checksums)
+    except (tarfile.TarError, zipfile.BadZipFile, ValueError) as e:
+        return jsonify({"status": "error", "message": f"Could not read upload: {e}"}), 400
+
+    try:
+        frame_and_job_ids = db.insert_uploaded_frames([f for _, f in frames])
+    except Exception as e:
+        print(f"Error inserting uploaded frames: {e}")
+        for result, _ in frames:
+            result["message"] = "Failed to insert frame"
+    else:
+        for (result, _), (frame_id, _) in zip(frames, frame_and_job_ids):
+            result.update({"status": "success", "frame_id": frame_id})
+
+    num_saved = sum(r["status"] == "success" for r in results)
+    print(f"Saved {num_saved} of {len(results)} uploaded images")
+    status = "success" if num_saved == len(results) else ("partial" if num_saved > 0 else "error")
+    return jsonify({"status": status, "files": results}), 200
+
 @main_app.route('/post_query', methods=['POST'])
 def post_query():
     if not verify_api_key():
@@ -84,12 +282,8 @@ def post_query():
 def get_queries():
     if not verify_api_key():
         abort(401)
-    active_queries = db.get_active_queries().sort_values(by='timestamp', ascending=False)
-    queries = list()
-    for i, row in active_queries.iterrows():
-        queries.append({"query": row['query'], "result": row['result']})
-    print("Successully sent queries.")
-    return jsonify(queries[:6])
+    queries = poll_cache.get(("get_queries",), ["queries"], lambda: db.get_recent_active_queries(limit=6))
+    return jsonify(queries)
 
 @main_app.route('/get_last_timestamp', methods=['GET'])
 def get_last_timestamp():
@@ -101,12 +295,13 @@ def get_last_timestamp():
         return jsonify({"status": "error", "message": "Missing table parameter"}), 400
     
     try:
-        last_timestamp = db.get_last_timestamp(table)
-
+        if table in TRACKED_TABLES:
+            last_timestamp = poll_cache.get(("get_last_timestamp", table), [table], lambda: db.get_last_timestamp(table))
+        else:
+            last_timestamp = db.get_last_timestamp(table)
     except:
         return jsonify({"status": "error", "message": f"Couldn't retrieve last timestamp for table {table}"}), 400
-    
-    print(f"Successfully sent last timestamp {last_timestamp} for {table}.")
+
     return jsonify({"last_timestamp": last_timestamp})
 
 @main_app.route('/get_last_id', methods=['GET'])
@@ -119,66 +314,107 @@ def get_last_id():
     table = request.args.get("table", "frames")
 
     try:
-        last_id = db.get_last_id(source=source, table=table)
+        if table in TRACKED_TABLES:
+            last_id = poll_cache.get(("get_last_id", table, source), [table], lambda: db.get_last_id(source=source, table=table))
+        else:
+            last_id = db.get_last_id(source=source, table=table)
     except:
         return jsonify({"status": "error", "message": f"Couldn't retrieve last id for table {table} source {source}"}), 400
-    
-    print(f"Successfully sent last id for table {table} source {source}")
+
     return jsonify({"last_id": last_id})
 
+def read_sync_request():
+    """Returns the metadata (source, annotations, locations, content) and an iterator over the
+    frames of a /sync_db request sent either as JSON or in the sync_format wire format, both
+    optionally compressed (Content-Encoding)."""
+    content_encoding = request.headers.get("Content-Encoding")
+    stream = sync_format.decompressed_stream(request.stream, content_encoding)
+    if request.mimetype == sync_format.SYNC_CONTENT_TYPE:
+        return sync_format.read_sync_payload(stream)
+
+    data = json.load(stream) if content_encoding not in (None, "", "identity") else request.get_json()
+    if not data:
+        return None, None
+    frames = sorted([f for f in data.get("frames") or [] if f is not None], key=lambda f: f['id'])
+    return data, (sync_format.convert_json_frame(f) for f in frames)
+
 @main_app.route('/sync_db', methods=['POST'])
 def sync_db():
-    """Endpoint for syncing annotations, locations, content updates, and frames from a device to the Hindsight server."""
+    """Endpoint for syncing annotations, locations, content updates, and frames from a device to the Hindsight server.
+    The payload is JSON or the more compact sync_format wire format, see read_sync_request.
+    Everything is deduplicated on insert so re-sending a payload is safe. Frames are committed in chunks of
+    SYNC_FRAMES_CHUNK_SIZE in order of their device id and resume_after_id in the response is the largest device
+    frame id committed, so after a partial failure the device can resend only the frames with larger ids. JSON frames
+    are sorted on arrival, streamed sync_format frames must be sent in ascending id order: syncing stops with a 400
+    at the first chunk with a smaller id than the one before it, as later frames could be below resume_after_id.
+    """
     if not verify_api_key():
         abort(401)
-    data = request.get_json()
+    refused = admission_response("sync")
+    if refused is not None:
+        return refused
+    try:
+        data, frames = read_sync_request()
+    except (ValueError, OSError) as e:
+        return jsonify({'status': 'error', 'message': f'Could not read sync payload: {e}'}), 400
     if not data:
         return jsonify({'status': 'error', 'message': 'No data provided'}), 400
-    
+
     annotations = data.get('annotations', [])
     locations = data.get('locations', [])
     content_updates = data.get('content', [])
 
     source = data.get("source", "not_provided")
-    frames = data.get("frames", [])
 
     try:
-        ingested_annotations_timestamps = set(db.get_annotations()['timestamp'])
-        annotations = [a for a in annotations if a['timestamp'] not in ingested_annotations_timestamps]
-        # Insert annotations
         db.insert_annotations(annotations)
-        
-        ingested_locations_timestamps = set(db.get_locations()['timestamp'])
-        locations = [l for l in locations if l['timestamp'] not in ingested_locations_timestamps]
-        # Insert locations
         db.insert_locations(locations)
 
         # Sync content updates (viewed, rankings, etc...)
-        from_app_update_content(content_sync_list=content_updates)
-
-        # Ingest frames and OCR results from a device
-        if frames is not None:
-            for frame in frames:
-                if frame is None:
-                    continue
-                frame_id = db.insert_frame(timestamp=frame['timestamp'], path="None", application=frame['application'],
-                                        source=source, source_id=frame['id'])
-
-                converted_ocr_results = list()
-                for ocr_result in frame['ocr_results']:
-                    converted_ocr_results.append((ocr_result['x'], ocr_result['y'], ocr_result['width'],
-                                                ocr_result['height'], ocr_result['text'], ocr_result['confidence'], ocr_result['blockNum'], -1))
-                db.insert_ocr_results(frame_id=frame_id, ocr_results=converted_ocr_results)
-    except:
-        return jsonify({'status': 'error', 'message': 'Failed Database sync'}), 400
+        run_blocking(from_app_update_content, content_sync_list=content_updates)
+    except Exception as e:
+        print(f"Error syncing annotations, locations and content: {e}")
+        return jsonify({'status': 'error', 'message': 'Failed Database sync', 'resume_after_id': None}), 400
+
+    # Ingest frames and OCR results from a device
+    resume_after_id = None
+    num_synced_frames = 0
+    while True:
+        try:
+            chunk = list(itertools.islice(frames, SYNC_FRAMES_CHUNK_SIZE))
+            if not chunk:
+                break
+            chunk_ids = [frame['id'] for frame in chunk]
+            if resume_after_id is not None:
+                chunk_ids.insert(0, resume_after_id)
+            if any(a > b for a, b in zip(chunk_ids, chunk_ids[1:])):
+                return jsonify({'status': 'partial' if resume_after_id is not None else 'error',
+                                'message': 'Frames must be sent in ascending id order', 'synced_frames': num_synced_frames,
+                                'resume_after_id': resume_after_id}), 400
+            db.insert_frames_with_ocr_bulk([{"timestamp": frame['timestamp'], "path": "None", "application": frame['application'],
+                                             "source": source, "source_id": frame['id'], "ocr_results": frame['ocr_results']}
+                                            for frame in chunk])
+        except Exception as e:
+            print(f"Error syncing frames after {resume_after_id}: {e}")
+            return jsonify({'status': 'partial' if resume_after_id is not None else 'error',
+                            'message': 'Failed to sync all frames', 'synced_frames': num_synced_frames,
+                            'resume_after_id': resume_after_id}), 400
+        resume_after_id = chunk[-1]['id']
+        num_synced_frames += len(chunk)
 
-    return jsonify({'status': 'success', 'message': 'Database successfully synced'})
+    return jsonify({'status': 'success', 'message': 'Database successfully synced', 'synced_frames': num_synced_frames,
+                    'resume_after_id': resume_after_id})
 
 @main_app.route('/upload_video', methods=['POST'])
 def upload_video():
-    """Upload a video and update frames video_chunk_id and video_chunk_offset"""
+    """Upload a video. Once it is durably on disk a video_chunk job is queued for the backend to record
+    it and set its frames' video_chunk_id and video_chunk_offset, and 202 is returned with the job id
+    (see /jobs/<job_id>)."""
     if not verify_api_key():
         abort(401)
+    refused = admission_response("video")
+    if refused is not None:
+        return refused
 
     if 'file' not in request.files:
         return jsonify({"status": "error", "message": "No file part"}), 400
@@ -187,71 +423,111 @@ def upload_video():
         return jsonify({"status": "error", "message": "No selected file"}), 400
     
     source = request.form.get("source", None)
-    source_id = int(request.form.get("video_chunk_id", None))
+    source_id = request.form.get("video_chunk_id", None)
     if source is None or source_id is None:
         return jsonify({"status": "error", "message": "Must provide source and source_id"}), 400
+    source_id = int(source_id)
     
     frame_ids = request.form.get("frame_ids", "")
 
     # Convert frame_ids to list of integers
     frame_ids_list = list(map(int, frame_ids.split(","))) if frame_ids else []
 
-    # Convert the source_ids to the correct ids in the hindsight db
-    hindsight_frame_ids = db.convert_source_ids_to_hindsight_ids(table="frames", source=source, source_ids=frame_ids_list)
-
     if file:
         filename = secure_filename(file.filename)
         video_file_path = os.path.join(VIDEO_FILES_DIR, filename)
         try:
-            with open(video_file_path, 'wb') as outfile:
-                file.save(outfile)
+            run_blocking(utils.save_file_atomic, file.stream, video_file_path, fsync=True)
             print("Saved", filename)
         except Exception as e:
             print(f"Error saving file: {e}")
             return jsonify({"status": "error", "message": "Failed to save video"}), 500
-        
-        video_chunk_id = db.insert_video_chunk(path=video_file_path, source=source, source_id=source_id)
-        db.update_video_chunk_info(video_chunk_id=video_chunk_id, frame_ids=hindsight_frame_ids)
-    
-        return jsonify({"status": "success", "message": "Video file successfully uploaded"}), 200
+
+        job_id = db.enqueue_job("video_chunk", {"path": video_file_path, "source": source, "source_id": source_id,
+                                                "frame_ids": frame_ids_list})
+        return jsonify({"status": "accepted", "message": "Video file uploaded, processing queued", "job_id": job_id}), 202
     
     return jsonify({"status": "error", "message": "No file"}), 400
     
+@main_app.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Status and progress (0 to 1) of a job queued by an upload."""
+    if not verify_api_key():
+        abort(401)
+    job = db.get_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    job.pop('payload')
+    return jsonify(job), 200
+
 @main_app.route('/get_new_content', methods=['GET'])
 def get_new_content():
-    """Fetch all new unviewed content and content updates since provided last_sync_timestamp"""
+    """Fetch content changes for the app. With a change_seq cursor returns the content changed since
+    that cursor (see get_content_changes), otherwise all new unviewed content and content updates since
+    the provided last_sync_timestamp."""
     if not verify_api_key():
         abort(401)
 
+    if 'change_seq' in request.args:
+        return get_content_changes(int(request.args.get('change_seq')))
+
     last_content_id = int(request.args.get('last_content_id'))
     last_sync_timestamp = int(request.args.get('last_sync_timestamp')) 
 
     print(f"Last content id {last_content_id}")
-    new_content = fetch_contents(non_viewed=True, last_content_id=last_content_id)
+    non_viewed_content = run_blocking(fetch_contents, non_viewed=True)
     new_content_list = list()
-    for c in new_content:
-        c_dict = c.__dict__
-        if "_sa_instance_state" in c_dict:
-            del c_dict['_sa_instance_state']
-        new_content_list.append(c_dict)
-
-    newly_viewed_content = fetch_newly_viewed_content(since_timestamp=last_sync_timestamp)
-    newly_viewed_content_ids = list(c.id for c in newly_viewed_content)
-
-    non_viewed_content = fetch_contents(non_viewed=True)
     non_viewed_content_updates = list()
     for c in non_viewed_content:
+        if c.id > last_content_id:
+            c_dict = dict(c.__dict__)
+            c_dict.pop('_sa_instance_state', None)
+            new_content_list.append(c_dict)
         non_viewed_content_updates.append({"content_id" : c.id, "ranking_score" : c.ranking_score,
                                            "topic_label" : c.topic_label})
+
+    newly_viewed_content = run_blocking(fetch_newly_viewed_content, since_timestamp=last_sync_timestamp)
+    newly_viewed_content_ids = list(c.id for c in newly_viewed_content)
+
     print(f"Successully sent new content {len(new_content_list)} and newly viewed content {len(newly_viewed_content)}")
     return jsonify({"new_content" : new_content_list, "newly_viewed_content_ids" : newly_viewed_content_ids,
                     "non_viewed_content_updates" : non_viewed_content_updates})
     
+def get_content_changes(since_change_seq):
+    """Delta sync of content: returns up to CONTENT_CHANGES_LIMIT content rows (only the fields the app
+    renders) changed after since_change_seq, oldest change first, with the cursor to send next time and
+    whether more changes are waiting. Viewed content is included so the app can drop it. Answers 304
+    when nothing changed."""
+    max_change_seq = run_blocking(get_max_change_seq)
+    # The response depends on the cursor as well as on the latest change
+    etag = f"{since_change_seq}-{max_change_seq}"
+    if max_change_seq <= since_change_seq or etag in request.if_none_match:
+        return "", 304, {"ETag": etag}
+
+    changes = run_blocking(fetch_content_changes, since_change_seq=since_change_seq, limit=CONTENT_CHANGES_LIMIT)
+    change_seq = changes[-1]['change_seq'] if changes else max_change_seq
+    print(f"Sent {len(changes)} content changes after change_seq {since_change_seq}")
+    response = jsonify({"changes": changes, "change_seq": change_seq, "has_more": change_seq < max_change_seq})
+    response.headers["ETag"] = etag
+    return response
+
+@main_app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics. Requires the API key like every other route: requests tunnelled in
+    through ngrok arrive from localhost too."""
+    if not verify_api_key():
+        abort(401)
+    # Rendering queries the database for the backlog gauges
+    return Response(run_blocking(metrics.render), content_type=metrics.CONTENT_TYPE)
+
 @main_app.route('/ping', methods=['GET'])
 def ping_server():
+    """Reachability check. Also tells devices how long to wait between uploads so they can pace
+    themselves before admission control refuses them."""
     if not verify_api_key():
         abort(401)
-    return jsonify({'status': 'success', 'message': 'Server is reachable'}), 200
+    return jsonify({'status': 'success', 'message': 'Server is reachable',
+                    'suggested_upload_interval': admission.suggested_upload_interval()}), 200
 
 app = create_app()
 if __name__ == '__main__':
@@ -0,0 +1,47 @@
+"""Priority classes for the backend's work. User queries (INTERACTIVE) come before recently captured
+frames and uploads (FRESH), which come before working through backlogs (BACKFILL). Work is never
+interrupted midway: background work calls wait_turn at batch boundaries and blocks there while
+work of a higher class is running (see server_backend.py).
+"""
+import time
+import threading
+import contextlib
+
+import hindsight_server.metrics as metrics
+
+INTERACTIVE = 0
+FRESH = 1
+BACKFILL = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", FRESH: "fresh", BACKFILL: "backfill"}
+
+QUERY_WAIT_SECONDS = metrics.histogram("hindsight_query_wait_seconds", "Time from a query's submission until the backend starts answering it")
+YIELD_SECONDS = metrics.histogram("hindsight_scheduler_yield_seconds", "Time background batches waited for higher priority work", ["priority"])
+
+class PriorityScheduler:
+    def __init__(self):
+        self._running = {priority: 0 for priority in PRIORITY_NAMES}
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def running(self, priority):
+        """Marks work of priority as running for the duration of the block."""
+        with self._condition:
+            self._running[priority] += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running[priority] -= 1
+                self._condition.notify_all()
+
+    def _higher_running(self, priority):
+        return any(count > 0 for p, count in self._running.items() if p < priority)
+
+    def wait_turn(self, priority):
+        """Blocks while work of a higher priority than priority is running."""
+        with self._condition:
+            if not self._higher_running(priority):
+                return
+            start = time.perf_counter()
+            self._condition.wait_for(lambda: not self._higher_running(priority))
+        YIELD_SECONDS.observe(time.perf_counter() - start, priority=PRIORITY_NAMES[priority])
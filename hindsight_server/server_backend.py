@@ -1,17 +1,24 @@
 """This contains the heavy processes of the hindsight server."""
 import os
-import glob
 import shutil
 import time
-import multiprocessing
+import functools
+import threading
 import pandas as pd
 from datetime import datetime, timedelta
 
-from db import HindsightDB
-from chromadb_tools import get_chroma_collection, run_chroma_ingest_batched
-from config import RAW_SCREENSHOTS_DIR, SCREENSHOTS_TMP_DIR, RUNNING_PLATFORM
-from rem_integration import ingest_rem
+from db import HindsightDB, TRACKED_TABLES
+from chromadb_tools import get_chroma_collection, get_embedding_function, get_chroma_documents, add_chroma_documents
+from config import SCREENSHOTS_TMP_DIR, RUNNING_PLATFORM, BACKEND_METRICS_PORT, \
+    BACKEND_IDLE_CHECK_SECONDS, BACKEND_FULL_SWEEP_SECONDS, JOB_RETENTION_DAYS
+from rem_integration import ingest_rem, rem_db_path
+from wakeup import WakeupListener
+from worker_pool import WorkerPool
+from pipeline import Pipeline, Stage
+from reconcile import reconcile_screenshots
+from scheduler import PriorityScheduler, INTERACTIVE, FRESH, BACKFILL, QUERY_WAIT_SECONDS
 import hindsight_server.query.query as query
+import hindsight_server.metrics as metrics
 import utils
 import run_ocr
 
@@ -19,90 +26,363 @@ from hindsight_applications.hindsight_feed.feed_generator import FeedGenerator
 from hindsight_applications.hindsight_feed.rankers.sentence_transformers_linear_reg import SentenceTransformersLinearRegRanker
 
 db = HindsightDB()
+worker_pool = WorkerPool(initializer=run_ocr.init_worker)
+scheduler = PriorityScheduler()
 
 def process_queries(unprocessed_queries: pd.DataFrame):
     """Processes all unprocessed queries."""
     for i, row in unprocessed_queries.iterrows():
+        QUERY_WAIT_SECONDS.observe(max(time.time() - row['timestamp'] / 1000, 0))
         query.query_and_insert(query_id=row['id'], query_text=row['query'], source_apps=row['context_applications'], 
                                        utc_milliseconds_start_date=row['context_start_timestamp'], 
                                        utc_milliseconds_end_date=row['context_end_timestamp'])
         
 def ingest_image(tmp_image_path):
-    """Moves image into RAW_SCREENSHOTS_DIR, ingests into frames table, 
-    runs OCR and ingests results.
+    """Moves image into RAW_SCREENSHOTS_DIR and ingests into frames table, returning the frame id.
+    Only used for images left in SCREENSHOTS_TMP_DIR, uploads are written to RAW_SCREENSHOTS_DIR
+    directly (see run_server.upload_image).
     """
     filename = os.path.basename(tmp_image_path)
-    filename_s = filename.replace(".jpg", "").split("_")
-    application = filename_s[0]
-    timestamp = int(filename_s[1])
-    timestamp_obj = pd.to_datetime(timestamp / 1000, unit='s', utc=True)
-    destdir = os.path.join(RAW_SCREENSHOTS_DIR, f"{timestamp_obj.strftime('%Y/%m/%d')}/{application}/")
-    utils.make_dir(destdir)
-    filepath = os.path.abspath(os.path.join(destdir, filename))
+    application, timestamp = utils.parse_screenshot_filename(filename)
+    filepath = utils.get_screenshot_path(application, timestamp, filename)
+    utils.make_dir(os.path.dirname(filepath))
     if not os.path.exists(filepath):
         shutil.move(tmp_image_path, filepath)
         print(f"File saved to {filepath}")
     elif os.path.exists(tmp_image_path):
         os.remove(tmp_image_path)
 
-    # Insert into db
-    frame_id = db.insert_frame(timestamp, filepath, application)
-    if RUNNING_PLATFORM == 'Darwin':
-        run_ocr.run_ocr_mac(frame_id=frame_id, frame_path=filepath) # run_ocr inserts results into db
+    # Insert into db, OCR runs in the ingest pipeline's next stage
+    return db.insert_frame(timestamp, filepath, application)
 
-def run_grouped_ocr():
-    """Run OCR on all frames without OCR results"""
-    frames_without_ocr = db.get_frames_without_ocr()
-    frames_without_ocr = frames_without_ocr.loc[frames_without_ocr['path'] != "None"]
-    if len(frames_without_ocr) == 0:
-        return
-    
-    print(f"Running OCR on {len(frames_without_ocr)} frames")
+def run_frames_ocr(frames_df):
+    """Runs OCR on the frames (id and path) in frames_df."""
     if RUNNING_PLATFORM == 'Darwin':
-        frame_id_path = [(frame_id, filepath) for frame_id, filepath in zip(frames_without_ocr['id'], frames_without_ocr['path'])]
-        with multiprocessing.Pool(os.cpu_count() - 2) as p:
-            p.starmap(run_ocr.run_ocr_mac, frame_id_path)
+        worker_pool.map(run_ocr.run_ocr_mac, frames_df['id'], frames_df['path'], batch_size=8)
         return
-    
-    run_ocr.run_ocr_batched(df=frames_without_ocr, batch_size=20)
+    run_ocr.run_ocr_batched(df=frames_df, batch_size=20)
+
+def process_ingest_jobs(max_jobs=500, batch_size=50):
+    """OCRs frames queued by uploads (ingest_frame jobs) and materializes their text so they
+    are searchable, batch_size jobs at a time, yielding to queries between batches and holding
+    off backfill work during them. Returns the number of jobs processed."""
+    num_processed = 0
+    while num_processed < max_jobs:
+        scheduler.wait_turn(FRESH)
+        with scheduler.running(FRESH):
+            jobs = db.claim_jobs("ingest_frame", limit=min(batch_size, max_jobs - num_processed))
+            if len(jobs) == 0:
+                break
+            num_processed += len(jobs)
+            job_ids = [job['id'] for job in jobs]
+            frame_ids = [job['payload']['frame_id'] for job in jobs]
+            try:
+                # Frames may have been OCRed by the ingest pipeline in the meantime
+                frames_without_ocr = db.get_frames_without_ocr(frame_ids=frame_ids)
+                if len(frames_without_ocr) > 0:
+                    print(f"Running OCR on {len(frames_without_ocr)} uploaded frames")
+                    run_frames_ocr(frames_without_ocr)
+                db.materialize_frame_text(frame_ids=frame_ids)
+            except Exception as e:
+                print(f"Failed ingest jobs {job_ids}: {e}")
+                db.fail_jobs(job_ids, error=e)
+                continue
+            db.complete_jobs(job_ids)
+            # The embedding scan may have passed these frames while they had no OCR results
+            ingest_feeder.rewind("embedding", min(frame_ids))
+    return num_processed
+
+def process_video_chunk_jobs(max_jobs=10, batch_size=1000):
+    """Records videos uploaded by /upload_video (video_chunk jobs) and points their frames at
+    them, batch_size frames per transaction, reporting progress on the job. Returns the number
+    of jobs processed."""
+    jobs = db.claim_jobs("video_chunk", limit=max_jobs)
+    for job in jobs:
+        payload = job['payload']
+        source_frame_ids = payload['frame_ids']
+        try:
+            video_chunk_id = db.insert_video_chunk(path=payload['path'], source=payload['source'], source_id=payload['source_id'])
+            for i in range(0, len(source_frame_ids), batch_size):
+                scheduler.wait_turn(FRESH)
+                with scheduler.running(FRESH):
+                    frame_ids = db.convert_source_ids_to_hindsight_ids(table="frames", source=payload['source'],
+                                                                       source_ids=source_frame_ids[i:i + batch_size])
+                    db.update_video_chunk_info(video_chunk_id=video_chunk_id, frame_ids=frame_ids, start_offset=i)
+                db.update_job_progress(job['id'], min(i + batch_size, len(source_frame_ids)) / len(source_frame_ids))
+        except Exception as e:
+            print(f"Failed video chunk job {job['id']}: {e}")
+            db.fail_jobs([job['id']], error=e)
+            continue
+        db.complete_jobs([job['id']])
+    return len(jobs)
+
+def process_jobs():
+    """Processes queued upload jobs. Returns the number of jobs processed."""
+    return process_ingest_jobs() + process_video_chunk_jobs()
+
+def process_unprocessed_queries():
+    """Answers queries without results, holding off background work meanwhile. Returns the number
+    of queries answered."""
+    unprocessed_queries = db.get_unprocessed_queries()
+    if len(unprocessed_queries) > 0:
+        with scheduler.running(INTERACTIVE):
+            process_queries(unprocessed_queries)
+    return len(unprocessed_queries)
+
+def run_query_worker(wakeup):
+    """Answers queries on their own thread as soon as they are submitted (wakeup is set on every
+    database change, see WakeupListener.subscribe), so they never wait for the backend loop and
+    background work yields to them at its next batch boundary."""
+    last_version = None
+    while True:
+        version = db.get_table_versions(["queries"])
+        if version != last_version:
+            last_version = version
+            try:
+                with metrics.backend_stage("queries") as stage:
+                    stage["items"] = process_unprocessed_queries()
+            except Exception as e:
+                print(f"Failed processing queries: {e}")
+            continue
+        wakeup.wait(BACKEND_IDLE_CHECK_SECONDS)
+        wakeup.clear()
+
+"""Batch sizes of the ingest pipeline. Frames captured in the last FRESH_FRAME_SECONDS are processed
+before older backlogs."""
+INGEST_BATCH_SIZE = 64
+OCR_BATCH_SIZE = 20
+FRAME_TEXT_BATCH_SIZE = 500
+EMBEDDING_BATCH_SIZE = 500
+FRESH_FRAME_SECONDS = 3600
+
+_chroma = dict()
+_chroma_lock = threading.Lock()
+
+def get_pipeline_chroma():
+    """Returns the embedding function and chromadb collection of the ingest pipeline, loaded once."""
+    with _chroma_lock:
+        if not _chroma:
+            _chroma["embedding_function"] = get_embedding_function()
+            _chroma["collection"] = get_chroma_collection(embedding_function=_chroma["embedding_function"])
+        return _chroma["embedding_function"], _chroma["collection"]
+
+def releases_frames_on_error(stage_func):
+    """Wraps a pipeline stage taking frames so the frames of a batch it fails on, which the
+    pipeline drops, are no longer tracked as in the pipeline (see IngestFeeder)."""
+    @functools.wraps(stage_func)
+    def stage(frames_df):
+        try:
+            return stage_func(frames_df)
+        except Exception:
+            ingest_feeder.release(frames_df['id'])
+            raise
+    return stage
+
+def ingest_stage(tmp_image_paths):
+    """Ingests tmp images into the frames table and passes on their frames."""
+    print(f"Ingesting {len(tmp_image_paths)} images.")
+    try:
+        frame_ids = worker_pool.map(ingest_image, tmp_image_paths, batch_size=8)
+    finally:
+        ingest_feeder.release_images(tmp_image_paths)
+    return ingest_feeder.claim(db.get_frames_without_ocr(frame_ids=[f for f in frame_ids if f is not None]))
+
+@releases_frames_on_error
+def ocr_stage(frames_df):
+    print(f"Running OCR on {len(frames_df)} frames")
+    run_frames_ocr(frames_df)
+    return frames_df
+
+@releases_frames_on_error
+def frame_text_stage(frames_df):
+    """Materializes the cleaned text of frames and passes on those not yet in chromadb."""
+    db.materialize_frame_text(frame_ids=frames_df['id'])
+    # Need to improve computer OCR text parsing 
+    to_embed = (frames_df['source'] != "rem") & ~frames_df['chromadb_processed'].astype(bool)
+    ingest_feeder.release(frames_df.loc[~to_embed, 'id'])
+    return frames_df.loc[to_embed]
+
+@releases_frames_on_error
+def embedding_stage(frames_df):
+    """Adds the chromadb "document" and "embedding" of each frame (None for frames skipped, see
+    chromadb_tools.get_chroma_documents)."""
+    embedding_function, _ = get_pipeline_chroma()
+    frames_df = frames_df.sort_values(by='timestamp', ascending=True)
+    frames_df = frames_df.assign(document=get_chroma_documents(frames_df, db.get_frame_texts(frame_ids=frames_df['id'])))
+    documents = frames_df['document'].dropna()
+    embeddings = dict(zip(documents.index, embedding_function(list(documents)))) if len(documents) > 0 else dict()
+    return frames_df.assign(embedding=[embeddings.get(i) for i in frames_df.index])
+
+def chroma_write_stage(frames_df):
+    try:
+        _, chroma_collection = get_pipeline_chroma()
+        add_chroma_documents(frames_df, chroma_collection)
+        db.update_chromadb_processed(frame_ids=set(frames_df['id']))
+    finally:
+        ingest_feeder.release(frames_df['id'])
+    return frames_df
+
+"""File ingest -> OCR -> text materialization -> embedding -> chroma write. OCR and embedding each
+have their own thread, so they overlap instead of alternating. On mac OCR runs in worker_pool, where
+a second thread keeps the workers busy while a batch finishes."""
+ingest_pipeline = Pipeline([
+    Stage("ingest", ingest_stage, workers=1, queue_size=4),
+    Stage("ocr", ocr_stage, workers=2 if RUNNING_PLATFORM == 'Darwin' else 1, queue_size=8),
+    Stage("frame_text", frame_text_stage, workers=1, queue_size=4),
+    Stage("embedding", embedding_stage, workers=1, queue_size=4),
+    Stage("chroma_write", chroma_write_stage, workers=1, queue_size=4),
+], wait_turn=scheduler.wait_turn, running=scheduler.running)
+
+class IngestFeeder:
+    """Queues frames at the ingest pipeline stage they need next, as many as each stage's queue has
+    room for. Frames captured in the last FRESH_FRAME_SECONDS are looked up by timestamp on every
+    feed and queued first. Older frames are scanned with an id cursor per stage, so a feed only
+    reads frames past the last ones it queued instead of the whole frames table. Frames a cursor
+    passed without queueing (e.g. OCRed by an ingest job after the embedding cursor went by) are
+    picked up once the stage is rewound, see rewind and reset. Frames and tmp images are tracked
+    from being queued until they leave the pipeline, so they are never queued twice."""
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.cursors = {"ocr": 0, "frame_text": 0, "embedding": 0}
+        self._in_flight = set()
+        self._queued_images = set()
+        self._lock = threading.Lock()
+
+    def rewind(self, stage, frame_id):
+        """Makes the next feed scan stage from frame_id again."""
+        self.cursors[stage] = min(self.cursors[stage], int(frame_id) - 1)
+
+    def reset(self):
+        """Makes the next feed scan every stage from the first frame again."""
+        self.cursors = dict.fromkeys(self.cursors, 0)
+
+    def claim(self, frames_df):
+        """Tracks frames as in the pipeline, returning those that were not already."""
+        with self._lock:
+            frames_df = frames_df.loc[~frames_df['id'].isin(self._in_flight)]
+            self._in_flight.update(int(i) for i in frames_df['id'])
+        return frames_df
 
-def chromadb_process_images(frames_df):
-    """Ingests frames into chromadb."""
-    frame_ids = set(frames_df['id'])
-    print(f"Running ChromaDB ingest on {len(frame_ids)} frames")
-    chroma_collection = get_chroma_collection()
-    run_chroma_ingest_batched(db=db, df=frames_df, chroma_collection=chroma_collection)
+    def release(self, frame_ids):
+        """Stops tracking frames that left the pipeline."""
+        with self._lock:
+            self._in_flight.difference_update(int(i) for i in frame_ids)
+
+    def release_images(self, tmp_image_paths):
+        with self._lock:
+            self._queued_images.difference_update(tmp_image_paths)
+
+    def _feed_images(self):
+        """Queues tmp images at the ingest stage. Returns (number queued, whether images were left
+        that did not fit)."""
+        with self._lock:
+            tmp_image_paths = sorted(p for p in (os.path.join(SCREENSHOTS_TMP_DIR, f) for f in os.listdir(SCREENSHOTS_TMP_DIR))
+                                     if p not in self._queued_images)
+            self._queued_images.update(tmp_image_paths)
+        num_queued = 0
+        for i in range(0, len(tmp_image_paths), INGEST_BATCH_SIZE):
+            batch = tmp_image_paths[i:i + INGEST_BATCH_SIZE]
+            if not self.pipeline.submit(batch, stage="ingest", priority=FRESH, block=False):
+                self.release_images(tmp_image_paths[i:])
+                return num_queued, True
+            num_queued += len(batch)
+        return num_queued, False
+
+    def _feed_stage(self, stage, scan, keep, batch_size, fresh_since, first_fresh_id):
+        """Queues the frames returned by scan(after_id, min_timestamp, limit) (frames with an id
+        above after_id captured at or after min_timestamp, at most limit of them in id order) that
+        keep(frames_df) keeps at stage, those captured since fresh_since (first_fresh_id being the
+        smallest of their ids) first. Returns (number queued, whether frames may be left that did
+        not fit)."""
+        num_queued = 0
+        scans = [(BACKFILL, self.cursors[stage], None)]
+        if first_fresh_id is not None:
+            scans.insert(0, (FRESH, first_fresh_id - 1, fresh_since))
+        for priority, after_id, min_timestamp in scans:
+            while True:
+                limit = self.pipeline.room(stage) * batch_size
+                if limit == 0:
+                    return num_queued, True
+                frames_df = scan(after_id=after_id, min_timestamp=min_timestamp, limit=limit)
+                if len(frames_df) == 0:
+                    break
+                num_scanned = len(frames_df)
+                last_id = int(frames_df['id'].iloc[-1])
+                frames_df = self.claim(keep(frames_df))
+                full = False
+                for i in range(0, len(frames_df), batch_size):
+                    batch = frames_df.iloc[i:i + batch_size]
+                    if not self.pipeline.submit(batch, stage=stage, priority=priority, block=False):
+                        self.release(frames_df['id'].iloc[i:])
+                        last_id = int(batch['id'].iloc[0]) - 1
+                        full = True
+                        break
+                    num_queued += len(batch)
+                after_id = last_id
+                if priority == BACKFILL:
+                    self.cursors[stage] = after_id
+                if full:
+                    return num_queued, True
+                if num_scanned < limit:
+                    break
+        return num_queued, False
+
+    def feed(self):
+        """Queues tmp images and frames missing OCR, text or embeddings at the pipeline stage they
+        need next. Returns the number of items queued, or None when a stage's queue filled up (the
+        pipeline wakes the backend once it has room again, see run_backend)."""
+        num_queued, full = self._feed_images()
+        fresh_since = int((time.time() - FRESH_FRAME_SECONDS) * 1000)
+        first_fresh_id = db.get_first_frame_id_since(fresh_since)
+        for stage, scan, keep, batch_size in [
+                ("ocr", get_frames_for_pipeline_ocr, has_screenshot, OCR_BATCH_SIZE),
+                ("frame_text", get_stale_text_frames, lambda frames_df: frames_df, FRAME_TEXT_BATCH_SIZE),
+                ("embedding", db.get_non_chromadb_processed_frames_with_ocr, needs_embedding, EMBEDDING_BATCH_SIZE)]:
+            stage_queued, stage_full = self._feed_stage(stage, scan, keep, batch_size, fresh_since, first_fresh_id)
+            num_queued += stage_queued
+            full = full or stage_full
+        return None if full else num_queued
+
+def get_frames_for_pipeline_ocr(after_id, min_timestamp, limit):
+    """Frames without OCR results, except uploaded frames, which are OCRed by their ingest_frame job
+    (see process_ingest_jobs)."""
+    return db.get_frames_without_ocr(after_id=after_id, min_timestamp=min_timestamp, limit=limit, exclude_job_type="ingest_frame")
+
+def has_screenshot(frames_df):
+    return frames_df.loc[frames_df['path'] != "None"]
+
+def get_stale_text_frames(after_id, min_timestamp, limit):
+    """Frames whose text is missing or stale, e.g. after a TEXT_CLEANING_VERSION bump."""
+    frame_ids = db.get_stale_frame_text_ids(after_id=after_id, min_timestamp=min_timestamp, max_frames=limit)
+    if len(frame_ids) == 0:
+        return pd.DataFrame()
+    return db.get_frames(frame_ids=frame_ids, application_alias=False).sort_values(by='id')
+
+def needs_embedding(frames_df):
+    # The backend does not embed frames ingested from rem
+    return frames_df.loc[frames_df['source'] != "rem"]
+
+ingest_feeder = IngestFeeder(ingest_pipeline)
+
+def feed_ingest_pipeline():
+    return ingest_feeder.feed()
+
+def run_rem_ingest():
+    scheduler.wait_turn(BACKFILL)
+    ingest_rem()
+    return 0
 
 def check_all_frames_ingested():
     """Ensures that all screenshots in the RAW_SCREENSHOTS_DIR are
-    ingested in the frames table.
+    ingested in the frames table. Only directories changed since the last check are rescanned,
+    see reconcile.py.
     """
-    frames = db.get_frames()
-    screenshot_paths = {os.path.abspath(f) for f in glob.glob(os.path.join(RAW_SCREENSHOTS_DIR, '*', '*', '*', '*', '*.jpg'))}
-    missing_screenshots = screenshot_paths - set(frames['path'])
-    if len(missing_screenshots) > 0:
-        print(f"Ingesting {len(missing_screenshots)} screenshots missing from frames table.")
-
-        sorted_screenshots = sorted(
-            ((int(os.path.basename(path).split('_')[1].split(".")[0]), path) for path in missing_screenshots),
-            key=lambda x: x[0]
-        )
-
-        for timestamp, ms_path in sorted_screenshots:
-            application = os.path.basename(ms_path).split('_')[0]
-            # Insert into db and run OCR
-            db.insert_frame(timestamp, ms_path, application)
-
-    uncompressed_screenshots = frames.loc[frames['video_chunk_id'].isnull()]
-    screenshots_missing_paths = set(uncompressed_screenshots['path']) - screenshot_paths - {"None"}
-    if len(screenshots_missing_paths) > 0:
-        print(f"Screenshots missing path: {screenshots_missing_paths}")
+    reconcile_screenshots(db)
 
 def update_android_identifiers_file():
     """Adds any missing android identifiers to the android identifers json"""
     id_to_alias = utils.get_identifiers_to_alias()
-    frames = db.get_frames()
-    new_applications = set(frames['application_org']) - set(id_to_alias.keys())
+    new_applications = db.get_all_applications() - set(id_to_alias.keys())
     if len(new_applications) == 0:
         return
     for a in new_applications:
@@ -125,31 +405,73 @@ def run_applications():
     else:
         ranker.generate_rankings()
 
-if __name__ == "__main__":
-    check_all_frames_ingested()
-    update_android_identifiers_file()
-    print("Finished Backend setup")
+"""Stages of the backend loop in the order they run: (name, function returning the number of items
+processed or None while it is busy, work sources whose changes give it work (see
+get_work_versions), whether it stops at a batch limit and reruns while it finds work)."""
+STAGES = [
+    ("jobs", process_jobs, ("jobs",), True),
+    ("ingest_pipeline", feed_ingest_pipeline, ("tmp_images", "frames", "jobs"), False),
+    ("rem", run_rem_ingest, ("rem",), False),
+]
 
+def get_work_versions():
+    """Returns a dict of work source -> version that changes whenever the source gets new work:
+    the tracked tables (see HindsightDB.get_table_versions), SCREENSHOTS_TMP_DIR and the REM database."""
+    versions = dict(zip(TRACKED_TABLES, db.get_table_versions(TRACKED_TABLES)))
+    versions["tmp_images"] = os.stat(SCREENSHOTS_TMP_DIR).st_mtime_ns
+    versions["rem"] = tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else 0 for path in (rem_db_path, rem_db_path + "-wal"))
+    return versions
+
+def run_backend():
+    """Runs each stage only when it may have work: when one of its work sources changed or when it
+    stopped at its batch limit. A busy stage is retried once it wakes the loop. Sleeps until woken
+    (see wakeup.py) while no stage has work. Queries are answered on their own thread, see
+    run_query_worker."""
+    listener = WakeupListener(watch_dirs=[SCREENSHOTS_TMP_DIR])
+    ingest_pipeline.on_room = listener.wake
+    ingest_pipeline.start()
+    threading.Thread(target=run_query_worker, args=(listener.subscribe(),), name="QueryWorker", daemon=True).start()
+    pending_stages = {name for name, _, _, _ in STAGES} # Everything may have work on startup
+    busy_stages = set()
+    last_versions = dict()
+    last_full_sweep = time.time()
     while True:
-        unprocessed_queries = db.get_unprocessed_queries()
-        if len(unprocessed_queries) > 0:
-            process_queries(unprocessed_queries)
+        versions = get_work_versions()
+        changed = {source for source, version in versions.items() if version != last_versions.get(source)}
+        last_versions = versions
+        pending_stages.update(name for name, _, sources, _ in STAGES if changed.intersection(sources))
+        if time.time() - last_full_sweep >= BACKEND_FULL_SWEEP_SECONDS:
+            pending_stages.update(name for name, _, _, _ in STAGES)
+            db.delete_done_jobs(JOB_RETENTION_DAYS)
+            ingest_feeder.reset()
+            last_full_sweep = time.time()
 
-        unprocessed_image_paths = [os.path.join(SCREENSHOTS_TMP_DIR, f) for f in os.listdir(SCREENSHOTS_TMP_DIR)]
-        if len(unprocessed_image_paths) > 0:
-            print(f"Ingesting {len(unprocessed_image_paths)} images.")
-            with multiprocessing.Pool(os.cpu_count() - 2) as p:
-                p.map(ingest_image, unprocessed_image_paths)
+        if pending_stages <= busy_stages:
+            listener.wait(BACKEND_IDLE_CHECK_SECONDS)
+            busy_stages.clear()
+            continue
 
-        run_grouped_ocr() # Run OCR on any frames missing ocr results
+        busy_stages.clear()
+        for name, run_stage, _, batched in STAGES:
+            if name not in pending_stages:
+                continue
+            pending_stages.discard(name)
+            with metrics.backend_stage(name) as stage:
+                stage["items"] = run_stage()
+            if stage["items"] is None:
+                busy_stages.add(name)
+                pending_stages.add(name)
+            elif stage["items"] and batched:
+                pending_stages.add(name)
 
-        non_chromadb_processed_frames_df = db.get_non_chromadb_processed_frames_with_ocr().sort_values(by='timestamp', ascending=True)
-        # Need to improve computer OCR text parsing 
-        non_chromadb_processed_frames_df = non_chromadb_processed_frames_df.loc[non_chromadb_processed_frames_df['source'] != "rem"]
-        if len(non_chromadb_processed_frames_df) > 0:
-            chromadb_process_images(non_chromadb_processed_frames_df)
-        
-        ingest_rem()
-        # run_applications()
-            
-        time.sleep(20)
+if __name__ == "__main__":
+    check_all_frames_ingested()
+    update_android_identifiers_file()
+    db.requeue_running_jobs("ingest_frame")
+    db.requeue_running_jobs("video_chunk")
+    metrics.register_backlog_gauges(db)
+    metrics.start_metrics_server(BACKEND_METRICS_PORT)
+    print("Finished Backend setup")
+
+    # run_applications()
+    run_backend()
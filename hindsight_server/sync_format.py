@@ -0,0 +1,104 @@
+"""Compact wire format for /sync_db payloads (Content-Type application/x-hindsight-sync). The body,
+optionally compressed as given by Content-Encoding (gzip, or zstd when the zstandard package is
+installed), is:
+
+    header      magic (4 bytes), version (uint8), 3 padding bytes, metadata_bytes (uint32)
+    metadata    utf-8 JSON object with source, annotations, locations and content
+    frames      frame records until the end of the body, in increasing id order
+
+where each frame record is
+
+    header      id (int64), timestamp (int64), application_bytes (uint16), ocr_bytes (uint32)
+    utf-8       application
+    ocr         the frame's OCR results packed with ocr_blob.encode_ocr_results
+
+Frames are decoded one record at a time straight from the request stream so memory stays bounded
+however many frames a device sends.
+"""
+import io
+import gzip
+import json
+import struct
+
+from hindsight_server.ocr_blob import encode_ocr_results, decode_ocr_results
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SYNC_CONTENT_TYPE = "application/x-hindsight-sync"
+SYNC_MAGIC = b"HSYN"
+SYNC_VERSION = 1
+_HEADER = struct.Struct("<4sBxxxI")
+_FRAME_HEADER = struct.Struct("<qqHI")
+
+def supported_encodings():
+    return ["identity", "gzip"] + (["zstd"] if zstandard is not None else [])
+
+def decompressed_stream(stream, content_encoding=None):
+    """Wraps stream so it is read decompressed. Raises ValueError for unsupported encodings."""
+    if content_encoding in (None, "", "identity"):
+        return stream
+    if content_encoding == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if content_encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    raise ValueError(f"Unsupported Content-Encoding {content_encoding}, expected one of {supported_encodings()}")
+
+def _read_exactly(stream, num_bytes):
+    data = stream.read(num_bytes)
+    while len(data) < num_bytes:
+        more = stream.read(num_bytes - len(data))
+        if not more:
+            raise ValueError("Truncated sync payload")
+        data += more
+    return data
+
+def _iter_frames(stream):
+    while True:
+        header = stream.read(_FRAME_HEADER.size)
+        if not header:
+            return
+        if len(header) < _FRAME_HEADER.size:
+            header += _read_exactly(stream, _FRAME_HEADER.size - len(header))
+        frame_id, timestamp, application_bytes, ocr_bytes = _FRAME_HEADER.unpack(header)
+        application = _read_exactly(stream, application_bytes).decode("utf-8")
+        ocr_results = decode_ocr_results(_read_exactly(stream, ocr_bytes))
+        yield {"id": frame_id, "timestamp": timestamp, "application": application, "ocr_results": ocr_results}
+
+def read_sync_payload(stream):
+    """Reads the header and metadata of a (decompressed) sync payload. Returns (metadata, frames)
+    where frames lazily yields dicts with id, timestamp, application and ocr_results (a list of
+    (x, y, w, h, text, conf, block_num, line_num) tuples)."""
+    magic, version, metadata_bytes = _HEADER.unpack(_read_exactly(stream, _HEADER.size))
+    if magic != SYNC_MAGIC or version != SYNC_VERSION:
+        raise ValueError(f"Not a version {SYNC_VERSION} sync payload")
+    metadata = json.loads(_read_exactly(stream, metadata_bytes))
+    return metadata, _iter_frames(stream)
+
+def convert_json_frame(frame):
+    """Converts a frame of a JSON sync payload to the dict yielded by read_sync_payload."""
+    ocr_results = [(r['x'], r['y'], r['width'], r['height'], r['text'], r['confidence'], r['blockNum'], -1)
+                   for r in frame['ocr_results']]
+    return {"id": frame['id'], "timestamp": frame['timestamp'], "application": frame['application'],
+            "ocr_results": ocr_results}
+
+def encode_sync_payload(metadata, frames, content_encoding="gzip"):
+    """Inverse of read_sync_payload, for clients and benchmarks. frames must be sorted by id."""
+    buffer = io.BytesIO()
+    metadata = json.dumps(metadata).encode("utf-8")
+    buffer.write(_HEADER.pack(SYNC_MAGIC, SYNC_VERSION, len(metadata)))
+    buffer.write(metadata)
+    for frame in frames:
+        application = frame['application'].encode("utf-8")
+        ocr = encode_ocr_results(frame['ocr_results'])
+        buffer.write(_FRAME_HEADER.pack(frame['id'], frame['timestamp'], len(application), len(ocr)))
+        buffer.write(application)
+        buffer.write(ocr)
+    payload = buffer.getvalue()
+    if content_encoding == "gzip":
+        return gzip.compress(payload)
+    if content_encoding == "zstd":
+        return zstandard.ZstdCompressor().compress(payload)
+    return payload
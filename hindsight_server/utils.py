@@ -1,7 +1,9 @@
 import os
 import cv2
 import json
+import shutil
 import hashlib
+import tempfile
 import numpy as np
 import pandas as pd
 from collections import defaultdict
@@ -14,7 +16,7 @@ from zoneinfo import ZoneInfo
 local_timezone = tzlocal.get_localzone()
 video_timezone = ZoneInfo("UTC")
 
-from hindsight_server.config import ANDROID_IDENTIFIERS_ALIAS_FILE
+from hindsight_server.config import ANDROID_IDENTIFIERS_ALIAS_FILE, RAW_SCREENSHOTS_DIR
 
 def make_dir(d):
     if not os.path.exists(d):
@@ -38,9 +40,19 @@ def impute_applications(df):
 def add_datetimes(df):
     """Adds UTC datetime and local datetime columns to a DataFrame with a UTC timestamp in milliseconds"""
     df['datetime_utc'] = pd.to_datetime(df['timestamp'] / 1000, unit='s', utc=True)
-    df['datetime_local'] = df['datetime_utc'].apply(lambda x: x.replace(tzinfo=video_timezone).astimezone(local_timezone))
+    df['datetime_local'] = df['datetime_utc'].dt.tz_convert(local_timezone)
     return df
 
+def to_utc_milliseconds(date):
+    """Converts a datetime to a UTC timestamp in milliseconds. Naive datetimes are treated as
+    local time and ints are assumed to already be UTC milliseconds."""
+    if isinstance(date, (int, np.integer)):
+        return int(date)
+    date = pd.Timestamp(date)
+    if date.tzinfo is None:
+        date = date.tz_localize(local_timezone)
+    return int(date.timestamp() * 1000)
+
 def add_usage_ids(df, new_usage_threshold=timedelta(seconds=120)):
     """Adds a column that identifies what 'usage' the frame belongs to. A new usage is defined
     by a time difference of new_usage_threshold
@@ -98,6 +110,11 @@ def convert_to_continuos_str(df, newline_threshold):
         final_text.append(line_text)        
     return "\n".join(final_text)
 
+"""Version of the ocr_results_to_str output. Bump it whenever the cleaning changes so the
+materialized frame_text table is rebuilt (see HindsightDB.materialize_frame_text).
+"""
+TEXT_CLEANING_VERSION = 1
+
 def ocr_results_to_str(ocr_result, text_conf_thresh=0.7):
     """Converts OCR results for a frame into paragraphs based on y distance. Converts each
     paragraph into a str and finally combines all of the paragraph strs into a single str
@@ -129,23 +146,25 @@ def get_screenshot_preprompt(application, timestamp):
 def get_preprompted_text(ocr_result, application, timestamp):
     """Used for preprompting chromadb documents and preprompting before feeding to an LLM."""
     frame_cleaned_text = ocr_results_to_str(ocr_result)
-    frame_text = get_screenshot_preprompt(application, timestamp) + frame_cleaned_text
-    return frame_text
+    return preprompt_cleaned_text(frame_cleaned_text, application, timestamp)
 
-def get_context_around_frame_id(frame_id, frames_df, db, context_buffer=5):
+def preprompt_cleaned_text(frame_cleaned_text, application, timestamp):
+    """get_preprompted_text for text already cleaned by ocr_results_to_str (e.g. from frame_text)."""
+    return get_screenshot_preprompt(application, timestamp) + frame_cleaned_text
+
+def get_context_around_frame_id(frame_id, frame_index, db, context_buffer=5):
     """Used by the Long Context Querying method. Pulls context_buffer frames before and after 
     the provided frame_id and combines them into a single str. It does some deduplication but
     keeps the entire text of the frame_id passed.
+    Args:
+        frame_index (FrameIndex): the shared frame index (see frame_index.get_frame_index)
     """
-    frame_application = frames_df.loc[frames_df['id'] == frame_id].iloc[0]['application']
-    application_df = frames_df.loc[frames_df['application'] == frame_application].reset_index(drop=True)
-    frame_index = int(application_df.index.get_loc(application_df[application_df['id'] == frame_id].index[0]))
-    application_df = application_df.iloc[frame_index-context_buffer:frame_index+context_buffer]
-    ocr_results_df = db.get_frames_with_ocr(frame_ids=set(application_df['id']))
+    application_df = frame_index.to_df(frame_index.application_window(frame_id, before=context_buffer, after=context_buffer - 1))
+    frame_texts = db.get_frame_texts(frame_ids=application_df['id'])
+    frame_id_to_text = dict(zip(frame_texts['frame_id'], frame_texts['text']))
     text_list = list()
     for i, row in application_df.iterrows():
-        ocr_res = ocr_results_df.loc[ocr_results_df['frame_id'] == row['id']]
-        cleaned_res = get_preprompted_text(ocr_res, row['application'], row['timestamp'])
+        cleaned_res = preprompt_cleaned_text(frame_id_to_text.get(row['id'], ""), row['application'], row['timestamp'])
         for t in cleaned_res.split(text_split_str):
             if t not in text_list or row['id'] == frame_id:
                 text_list.append(t)
@@ -182,7 +201,62 @@ def save_identifiers_to_alias(id_to_alias):
     with open(ANDROID_IDENTIFIERS_ALIAS_FILE, 'w') as outfile:
         json.dump(id_to_alias, outfile, indent=4)
 
+def hash_text(text):
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+def parse_screenshot_filename(filename):
+    """Returns (application, timestamp) of a screenshot named {application}_{timestamp}.jpg"""
+    filename_s = os.path.basename(filename).replace(".jpg", "").split("_")
+    if len(filename_s) < 2 or not filename_s[0]:
+        raise ValueError(f"Screenshot filename {filename} is not application_timestamp.jpg")
+    return filename_s[0], int(filename_s[1])
+
+def get_screenshot_path(application, timestamp, filename):
+    """Returns the absolute path a screenshot is stored at in RAW_SCREENSHOTS_DIR."""
+    timestamp_obj = pd.to_datetime(timestamp / 1000, unit='s', utc=True)
+    destdir = os.path.join(RAW_SCREENSHOTS_DIR, f"{timestamp_obj.strftime('%Y/%m/%d')}/{application}/")
+    return os.path.abspath(os.path.join(destdir, filename))
+
 BUF_SIZE = 65536
+def save_file_atomic(stream, path, fsync=False):
+    """Streams a file-like object to path through a uniquely named .part file in the same
+    directory, so a partially written file is never visible at path and concurrent writers of
+    the same path never share a .part file. The .part file is removed if writing fails. With
+    fsync the file and its directory entry are flushed to disk before returning, so the file
+    survives a crash."""
+    directory = os.path.dirname(path)
+    make_dir(directory)
+    outfile = tempfile.NamedTemporaryFile(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".part", delete=False)
+    try:
+        with outfile:
+            shutil.copyfileobj(stream, outfile, BUF_SIZE)
+            if fsync:
+                outfile.flush()
+                os.fsync(outfile.fileno())
+        os.replace(outfile.name, path)
+    except BaseException:
+        try:
+            os.remove(outfile.name)
+        except FileNotFoundError:
+            pass
+        raise
+    if fsync:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def verify_screenshot(data, expected_md5=None):
+    """Returns why the bytes of an uploaded screenshot are invalid, or None if they are valid."""
+    if len(data) == 0:
+        return "Empty file"
+    if not data.startswith(b"\xff\xd8"):
+        return "Not a JPEG image"
+    if expected_md5 is not None and hashlib.md5(data).hexdigest() != expected_md5.lower():
+        return "Checksum mismatch"
+    return None
+
 def hash_file(f_path):
     md5 = hashlib.md5()
 
@@ -232,15 +306,13 @@ def get_ids_to_images(frames_df):
 
 def get_previous_frame_id(db, frame_id):
     """Returns the previous frame id sorted by timestamp."""
-    frames = db.get_frames(impute_applications=False).sort_values(by="timestamp", ascending=True).reset_index(drop=False)
-    frame_index = frames.index.get_loc(frames[frames['id'] == frame_id].index[0])
-    return frames.iloc[frame_index -1].id
+    from hindsight_server.frame_index import get_frame_index
+    return get_frame_index(db).neighbor_id(frame_id, offset=-1)
 
 def get_next_frame_id(db, frame_id):
     """Returns the next frame id sorted by timestamp."""
-    frames = db.get_frames(impute_applications=False).sort_values(by="timestamp", ascending=True).reset_index(drop=False)
-    frame_index = frames.index.get_loc(frames[frames['id'] == frame_id].index[0])
-    return frames.iloc[frame_index + 1].id
+    from hindsight_server.frame_index import get_frame_index
+    return get_frame_index(db).neighbor_id(frame_id, offset=1)
 
 def save_images_to_dir(df, save_dir):
     """Saves images from a frames df to the provided directory."""
@@ -9,6 +9,7 @@ from datetime import timedelta
 from tkcalendar import DateEntry
 
 from hindsight_server.db import HindsightDB
+from hindsight_server.frame_index import get_frame_index
 from hindsight_server.views.timeline_view import TimelineViewer
 
 local_timezone = tzlocal.get_localzone()
@@ -33,9 +34,7 @@ class QueryViewer:
 
     def get_images_df(self):
         """Gets a DataFrame of all images at the time of inititation"""
-        images_df = self.db.get_frames()
-        images_df['datetime_utc'] = pd.to_datetime(images_df['timestamp'] / 1000, unit='s', utc=True)
-        images_df['datetime_local'] = images_df['datetime_utc'].apply(lambda x: x.replace(tzinfo=video_timezone).astimezone(local_timezone))
+        images_df = get_frame_index(self.db).to_df()
         return images_df.sort_values(by='datetime_local', ascending=False)
     
     def setup_gui(self):
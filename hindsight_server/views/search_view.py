@@ -18,6 +18,7 @@ sys.path.insert(0, "./")
 import utils
 from db import HindsightDB
 from hindsight_server.utils import get_ids_to_images
+from hindsight_server.frame_index import get_frame_index
 from chromadb_tools import get_chroma_collection, query_chroma
 from timeline_view import Screenshot, TimelineViewer
 
@@ -47,10 +48,8 @@ class SearchViewer:
 
     def get_images_df(self):
         """Gets a DataFrame of all images at the time of inititation"""
-        images_df = self.db.get_frames()
-        images_df['datetime_utc'] = pd.to_datetime(images_df['timestamp'] / 1000, unit='s', utc=True)
-        images_df['datetime_local'] = images_df['datetime_utc'].apply(lambda x: x.replace(tzinfo=video_timezone).astimezone(local_timezone))
-        images_df = images_df.dropna(subset=['video_chunk_path'])
+        frame_index = get_frame_index(self.db)
+        images_df = frame_index.to_df(frame_index.select(has_video_chunk=True))
         return images_df.sort_values(by='datetime_local', ascending=False)
 
     def calculate_num_images_per_row(self):
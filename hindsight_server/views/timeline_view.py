@@ -16,6 +16,7 @@ from zoneinfo import ZoneInfo
 from dataclasses import dataclass
 
 from hindsight_server.db import HindsightDB
+from hindsight_server.frame_index import get_frame_index
 from hindsight_server.utils import get_ids_to_images
 
 @dataclass
@@ -30,18 +31,14 @@ timeline_scrollbar_height = 50
 
 def get_images_df(db: HindsightDB, front_camera):
     """Gets a DataFrame of all images at the time of inititation"""
+    frame_index = get_frame_index(db)
     if front_camera is None:
-        images_df = db.get_screenshots(impute_applications=False)
-        images_df = images_df.dropna(subset=['video_chunk_path'])
+        positions = frame_index.select(exclude_applications=["frontCamera", "backCamera"], exclude_sources=["rem"], has_video_chunk=True)
     elif front_camera:
-        images_df = db.get_frames(applications=["frontCamera"])
+        positions = frame_index.select(applications=["frontCamera"], exclude_sources=["rem"])
     else:
-        images_df = db.get_frames(applications=["backCamera"])
-
-    images_df = images_df.loc[images_df['source'] != "rem"].reset_index(drop=True)
-    # images_df = images_df.loc[images_df['source'].isnull()].reset_index(drop=True)
-    images_df['datetime_utc'] = pd.to_datetime(images_df['timestamp'] / 1000, unit='s', utc=True)
-    images_df['datetime_local'] = images_df['datetime_utc'].apply(lambda x: x.replace(tzinfo=video_timezone).astimezone(local_timezone))
+        positions = frame_index.select(applications=["backCamera"], exclude_sources=["rem"])
+    images_df = frame_index.to_df(positions)
     return images_df.sort_values(by='datetime_local', ascending=False)
 
 def get_app_color_map(images_df: pd.DataFrame):
@@ -0,0 +1,92 @@
+"""Wakes the backend (server_backend.py) as soon as there is new work instead of on a timer.
+HindsightDB sends a datagram to BACKEND_WAKEUP_PORT after every commit that changes a tracked table,
+and files created in watched directories wake it through watchdog when it is installed.
+Wakeups are only hints: the backend compares table versions and directory mtimes to decide which
+stages have work, so a lost datagram delays work by at most the listener timeout.
+"""
+import socket
+import threading
+
+from hindsight_server.config import BACKEND_WAKEUP_PORT
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+_notify_socket = None
+
+def notify(port=BACKEND_WAKEUP_PORT):
+    """Wakes a WakeupListener on port if one is running. Never blocks or raises."""
+    global _notify_socket
+    try:
+        if _notify_socket is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            _notify_socket = sock
+        _notify_socket.sendto(b"1", ("127.0.0.1", port))
+    except OSError:
+        pass
+
+class _WakeOnChange(FileSystemEventHandler):
+    def __init__(self, listener):
+        self.listener = listener
+
+    def on_any_event(self, event):
+        self.listener.wake()
+
+class WakeupListener:
+    """Receives notify() datagrams and, with watchdog, file system events in watch_dirs."""
+    def __init__(self, port=BACKEND_WAKEUP_PORT, watch_dirs=()):
+        self._event = threading.Event()
+        self._subscribers = [self._event]
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._socket.bind(("127.0.0.1", port))
+        except OSError as e:
+            print(f"Could not listen for backend wakeups on port {port}, checking for work on a timer: {e}")
+            self._socket.close()
+            self._socket = None
+        else:
+            threading.Thread(target=self._receive, name="WakeupListener", daemon=True).start()
+
+        self._observer = None
+        if Observer is not None and watch_dirs:
+            self._observer = Observer()
+            for watch_dir in watch_dirs:
+                self._observer.schedule(_WakeOnChange(self), watch_dir, recursive=False)
+            self._observer.daemon = True
+            self._observer.start()
+
+    def _receive(self):
+        while True:
+            try:
+                self._socket.recv(64)
+            except OSError:
+                return # Closed
+            self.wake()
+
+    def wake(self):
+        """Wakes wait and every subscriber, e.g. from within the process."""
+        for event in self._subscribers:
+            event.set()
+
+    def subscribe(self):
+        """Returns a threading.Event that is set on every wakeup, for another thread to wait on."""
+        event = threading.Event()
+        self._subscribers.append(event)
+        return event
+
+    def wait(self, timeout):
+        """Blocks until a wakeup arrives or timeout seconds pass. Returns True if woken up."""
+        woken = self._event.wait(timeout)
+        self._event.clear()
+        return woken
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+        if self._observer is not None:
+            self._observer.stop()
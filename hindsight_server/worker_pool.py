@@ -0,0 +1,77 @@
+"""Long-lived pool of worker processes for the backend's CPU heavy work (ingesting images, OCR on
+mac). Workers are started once and keep their database handle loaded between batches (see
+run_ocr.init_worker), instead of a new multiprocessing.Pool re-importing everything on every loop.
+"""
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from hindsight_server.config import BACKEND_WORKERS
+
+class WorkerPool:
+    """A ProcessPoolExecutor that is replaced when a worker dies (e.g. crashing on a bad image),
+    which breaks every pending task of the executor. map then retries the first item without a
+    result alone on a fresh pool, skipping it if it kills its worker again, and continues with
+    the rest. It gives up once max_restarts items in a row crashed on their own, which means the
+    workers cannot run anything (e.g. a failing initializer). Safe to use from several threads:
+    a thread only restarts the executor it saw break, never a fresh one another thread is using."""
+    def __init__(self, size=BACKEND_WORKERS, initializer=None, max_restarts=3):
+        self.size = size
+        self.initializer = initializer
+        self.max_restarts = max_restarts
+        self._executor = None
+        self._generation = 0 # Incremented for every new executor
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """Returns the executor, starting one if needed, and its generation (see restart)."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.size, initializer=self.initializer)
+                self._generation += 1
+            return self._executor, self._generation
+
+    def restart(self, generation):
+        """Shuts down the executor of generation so the next _get_executor starts a new one. Does
+        nothing if it was already replaced, e.g. by another thread that saw it break."""
+        with self._lock:
+            if self._executor is not None and self._generation == generation:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def map(self, func, *iterables, batch_size=1):
+        """Returns [func(*args) for args in zip(*iterables)], run in the workers with batch_size
+        items sent per task. Items that kill their worker get None."""
+        items = list(zip(*iterables))
+        results = list()
+        consecutive_crashes = 0
+        while len(results) < len(items):
+            remaining = items[len(results):]
+            executor, generation = self._get_executor()
+            try:
+                for result in executor.map(func, *zip(*remaining), chunksize=batch_size):
+                    results.append(result)
+            except BrokenProcessPool as e:
+                self.restart(generation)
+                item = items[len(results)]
+                print(f"Worker died after {len(results)} of {len(items)} items ({e}), retrying item {len(results)} alone")
+                # Any in-flight item may have crashed it, the first unfinished one is retried alone
+                executor, generation = self._get_executor()
+                try:
+                    results.append(executor.submit(func, *item).result())
+                except BrokenProcessPool as e:
+                    self.restart(generation)
+                    consecutive_crashes += 1
+                    if consecutive_crashes >= self.max_restarts:
+                        raise
+                    print(f"Skipping item {len(results)} {item}, it killed its worker: {e}")
+                    results.append(None)
+                else:
+                    consecutive_crashes = 0
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()